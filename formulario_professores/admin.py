@@ -1,6 +1,6 @@
 # formularios/admin.py
 from django.contrib import admin
-from .models import EvolutionAPISettings, Instancia, Mensagem, Midia, UserMessageLimit, Enviadas
+from .models import EvolutionAPISettings, Instancia, Mensagem, Midia, UserMessageLimit, Enviadas, EnviadasDiario, EnvioContato, ListaContatos
 
 @admin.register(EvolutionAPISettings)
 class EvolutionAPISettingsAdmin(admin.ModelAdmin):
@@ -20,6 +20,13 @@ class MensagemAdmin(admin.ModelAdmin):
     list_display = ('id', 'usuario', 'horario_disparo', 'id_campanha')
     list_filter = ('usuario',)
     search_fields = ('id_campanha', 'usuario__username')
+    raw_id_fields = ('lista_contatos',)
+
+@admin.register(ListaContatos)
+class ListaContatosAdmin(admin.ModelAdmin):
+    list_display = ('id', 'total', 'hash', 'criado_em')
+    search_fields = ('hash',)
+    readonly_fields = ('hash', 'total', 'criado_em')
 
 @admin.register(Midia)
 class MidiaAdmin(admin.ModelAdmin):
@@ -28,4 +35,16 @@ class MidiaAdmin(admin.ModelAdmin):
     search_fields = ('nome', 'descricao')
 
 admin.site.register(UserMessageLimit)
-admin.site.register(Enviadas)
\ No newline at end of file
+admin.site.register(Enviadas)
+
+@admin.register(EnviadasDiario)
+class EnviadasDiarioAdmin(admin.ModelAdmin):
+    list_display = ('user', 'data', 'total')
+    list_filter = ('data',)
+    search_fields = ('user__username',)
+
+@admin.register(EnvioContato)
+class EnvioContatoAdmin(admin.ModelAdmin):
+    list_display = ('contato', 'parte', 'estado', 'tentativas', 'latencia_ms', 'id_campanha', 'atualizado_em')
+    list_filter = ('estado', 'parte')
+    search_fields = ('contato', 'id_campanha', 'message_key')
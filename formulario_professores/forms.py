@@ -1,13 +1,15 @@
 # forms.py
 from django import forms
 from .models import Mensagem, Midia, Instancia 
-import re
 from datetime import datetime
-import pandas as pd
+from itertools import chain
+from django.conf import settings
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm
 from django.contrib.auth.models import User
 from django import forms
-from .models import Mensagem, Midia, Instancia, EvolutionAPISettings # Adicione EvolutionAPISettings aqui
+from .models import Mensagem, Midia, Instancia, EvolutionAPISettings, ListaContatos # Adicione EvolutionAPISettings aqui
+from .services.importador_contatos import EXTENSOES_SUPORTADAS, importar_contatos, primeira_coluna
+from .services.normalizacao_telefones import formatar_numero_telefone
 
 TAMANHO_LOTE_CONTATOS_FORM = 65
 
@@ -113,7 +115,6 @@ class MensagemForm(forms.ModelForm):
             'mensagem_notificacao',
             'tipo_envio',
             'modo_envio',
-            'contato',
             'dias_disparo',
             'incluir_botao',
             'botao_texto',
@@ -143,21 +144,15 @@ class MensagemForm(forms.ModelForm):
                     field.widget.attrs.update({'class': tailwind_select_classes})
 
         if self.instance and self.instance.pk:
-            if isinstance(self.instance.contato, list): 
-                self.fields['contato_digitado'].initial = ", ".join(self.instance.contato)
+            if self.instance.lista_contatos_id:
+                self.fields['contato_digitado'].initial = ", ".join(self.instance.contatos)
             if isinstance(self.instance.dias_disparo, list):
                 self.fields['dias_disparo'].initial = ", ".join(self.instance.dias_disparo)
             if self.instance.horario_disparo:
                  self.fields['horario_disparo'].initial = self.instance.horario_disparo.strftime('%H:%M')
 
     def _formatar_numero_telefone(self, numero_str):
-        if not numero_str: return None
-        numero_limpo = re.sub(r'[^\d+]', '', str(numero_str).strip())
-        if numero_limpo.startswith('+55') and (13 <= len(numero_limpo) <= 14): return numero_limpo
-        if numero_limpo.startswith('55') and (12 <= len(numero_limpo) <= 13): return f"+{numero_limpo}"
-        apenas_digitos_internos = re.sub(r'\D', '', numero_limpo)
-        if 10 <= len(apenas_digitos_internos) <= 11: return f"+55{apenas_digitos_internos}"
-        return None
+        return formatar_numero_telefone(numero_str)
 
     def clean_dias_disparo(self): 
         datas_raw = self.cleaned_data.get('dias_disparo', '').strip()
@@ -186,52 +181,41 @@ class MensagemForm(forms.ModelForm):
         arquivo_contatos = cleaned_data.get('contacts_file')
         
         numeros_crus_combinados = []
-        numeros_invalidos_reportados = []
         erro_no_processamento_do_ficheiro = False
+        # Arquivos acima do limite não são lidos aqui: a view os envia para importação em segundo plano
+        cleaned_data['arquivo_importacao'] = None
 
         if contatos_digitados_str:
             numeros_crus_combinados.extend([c.strip() for c in contatos_digitados_str.split(',') if c.strip()])
 
+        resultado = importar_contatos(numeros_crus_combinados)
         if arquivo_contatos:
-            try:
-                df = None; file_name = arquivo_contatos.name.lower()
-                if file_name.endswith(('.xls', '.xlsx')):
-                    engine = 'xlrd' if file_name.endswith('.xls') else 'openpyxl'
-                    df = pd.read_excel(arquivo_contatos, header=None, dtype=str, engine=engine)
-                elif file_name.endswith('.csv'):
-                    df = pd.read_csv(arquivo_contatos, header=None, dtype=str, encoding='utf-8-sig', on_bad_lines='skip')
-                else: self.add_error('contacts_file', "Formato de arquivo não suportado."); erro_no_processamento_do_ficheiro = True
-                
-                if df is not None and not df.empty:
-                    numeros_potenciais_arquivo = df.iloc[:, 0].astype(str).str.strip().dropna().tolist()
-                    for num_str in numeros_potenciais_arquivo:
-                        if num_str and num_str.lower() not in ['nan', 'none', '']:
-                            numeros_crus_combinados.append(num_str)
-                elif df is not None and df.empty: self.add_error('contacts_file', "Arquivo vazio ou sem dados."); erro_no_processamento_do_ficheiro = True
-            except Exception as e: self.add_error('contacts_file', f"Erro ao processar o arquivo: {e}"); erro_no_processamento_do_ficheiro = True
-        
-        contatos_finais_formatados = []
-        numeros_ja_vistos = set()
-        for num_cru in numeros_crus_combinados:
-            numero_formatado = self._formatar_numero_telefone(num_cru)
-            if numero_formatado:
-                if numero_formatado not in numeros_ja_vistos:
-                    contatos_finais_formatados.append(numero_formatado)
-                    numeros_ja_vistos.add(numero_formatado)
-            elif num_cru: 
-                numeros_invalidos_reportados.append(num_cru)
-        
-        if numeros_invalidos_reportados:
-            exemplos = ", ".join(list(set(numeros_invalidos_reportados))[:3])
+            if not arquivo_contatos.name.lower().endswith(EXTENSOES_SUPORTADAS):
+                self.add_error('contacts_file', "Formato de arquivo não suportado."); erro_no_processamento_do_ficheiro = True
+            elif arquivo_contatos.size > settings.IMPORTACAO_CONTATOS_LIMITE_BYTES:
+                cleaned_data['arquivo_importacao'] = arquivo_contatos
+            else:
+                try:
+                    # Lido linha a linha (csv / openpyxl read-only), junto com os contatos digitados
+                    resultado = importar_contatos(
+                        chain(numeros_crus_combinados, primeira_coluna(arquivo_contatos, arquivo_contatos.name))
+                    )
+                    if resultado.linhas_lidas == len(numeros_crus_combinados):
+                        self.add_error('contacts_file', "Arquivo vazio ou sem dados."); erro_no_processamento_do_ficheiro = True
+                except Exception as e: self.add_error('contacts_file', f"Erro ao processar o arquivo: {e}"); erro_no_processamento_do_ficheiro = True
+
+        contatos_finais_formatados = resultado.contatos
+        if resultado.exemplos_invalidos:
+            exemplos = ", ".join(resultado.exemplos_invalidos)
             self.add_error(None, f"Aviso: Alguns números foram descartados por não serem um formato brasileiro válido (ex: {exemplos}).")
 
         # CORREÇÃO CRÍTICA PARA EDIÇÃO E CRIAÇÃO:
         # 1. Popula 'todos_contatos_validados' para a view de criação de lotes usar.
         cleaned_data['todos_contatos_validados'] = contatos_finais_formatados
-        # 2. Popula 'contato' (o campo do modelo) com a lista final para que form.save() funcione na edição.
+        # 2. Popula 'contato' com a lista final; form.save() a grava como ListaContatos.
         cleaned_data['contato'] = contatos_finais_formatados
 
-        if not contatos_finais_formatados:
+        if not contatos_finais_formatados and not cleaned_data['arquivo_importacao']:
             if not (arquivo_contatos and erro_no_processamento_do_ficheiro and not contatos_digitados_str):
                 if not contatos_digitados_str and not arquivo_contatos:
                     self.add_error(None, "É obrigatório fornecer contatos (digitados ou via arquivo).")
@@ -269,6 +253,18 @@ class MensagemForm(forms.ModelForm):
         
         return cleaned_data
 
+    def save(self, commit=True):
+        # Com commit=False nada é gravado: quem salvar a mensagem chama gravar_lista_contatos() antes
+        instance = super().save(commit=False)
+        if commit:
+            self.gravar_lista_contatos()
+            instance.save()
+        return instance
+
+    def gravar_lista_contatos(self):
+        """Grava (ou reaproveita) a ListaContatos com os contatos do formulário e a associa à mensagem."""
+        self.instance.lista_contatos = ListaContatos.obter(self.cleaned_data.get('contato') or [])
+
 class MidiaForm(forms.ModelForm):
     tipo = forms.ChoiceField(
         choices=Midia.TIPOS_MIDIA,
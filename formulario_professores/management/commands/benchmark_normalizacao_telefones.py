@@ -0,0 +1,49 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from formulario_professores.services.normalizacao_telefones import formatar_numero_telefone, normalizar_telefones
+
+FORMATOS = (
+    '({ddd}) 9{a}-{b}',
+    '+55 {ddd} 9{a} {b}',
+    '55{ddd}9{a}{b}',
+    '{ddd}9{a}{b}',
+    '{a}-{b}',
+    '',
+)
+
+
+class Command(BaseCommand):
+    help = 'Compara a vazão (números/s) da normalização de telefones escalar com a vetorizada (amostra só de textos).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantidade', type=int, default=1_000_000, help='Quantidade de números gerados.')
+        parser.add_argument('--semente', type=int, default=42, help='Semente do gerador, para repetir a mesma amostra.')
+
+    def handle(self, *args, **options):
+        gerador = random.Random(options['semente'])
+        numeros = [
+            gerador.choice(FORMATOS).format(ddd=gerador.randint(11, 99), a=gerador.randint(1000, 9999), b=gerador.randint(1000, 9999))
+            for _ in range(options['quantidade'])
+        ]
+        if not numeros:
+            self.stdout.write('Nada a medir.')
+            return
+
+        inicio = time.perf_counter()
+        escalar = [formatar_numero_telefone(numero) for numero in numeros]
+        tempo_escalar = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        vetorizado = normalizar_telefones(numeros)['numero'].tolist()
+        tempo_vetorizado = time.perf_counter() - inicio
+
+        divergencias = sum(a != b for a, b in zip(escalar, vetorizado))
+        self.stdout.write(f'Escalar:    {tempo_escalar:.2f}s ({len(numeros) / tempo_escalar:,.0f} números/s)')
+        self.stdout.write(f'Vetorizado: {tempo_vetorizado:.2f}s ({len(numeros) / tempo_vetorizado:,.0f} números/s)')
+        self.stdout.write(f'Ganho: {tempo_escalar / tempo_vetorizado:.1f}x')
+        if divergencias:
+            self.stdout.write(self.style.WARNING(f'⚠️ {divergencias} resultados diferentes entre as duas versões.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('✅ Resultados idênticos.'))
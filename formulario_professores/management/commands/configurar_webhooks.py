@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from formulario_professores.models import Instancia
+from formulario_professores.services import webhook_evolution
+
+
+class Command(BaseCommand):
+    help = 'Registra o webhook deste app em todas as instâncias ativas da Evolution API.'
+
+    def handle(self, *args, **options):
+        if not webhook_evolution.webhooks_ativos():
+            raise CommandError('Defina EVOLUTION_WEBHOOK_URL e EVOLUTION_WEBHOOK_TOKEN antes de registrar os webhooks.')
+
+        instancias = Instancia.objects.filter(usuario__evolutionapisettings__is_active=True).select_related('usuario__evolutionapisettings')
+        registradas = falhas = 0
+        for instancia in instancias:
+            resultado = webhook_evolution.registrar_webhook(instancia.usuario.evolutionapisettings, instancia)
+            if "error" in resultado or resultado.get("status") == "error":
+                falhas += 1
+                self.stdout.write(self.style.WARNING(f"⚠️ {instancia.nome_instancia}: {resultado.get('message')}"))
+            else:
+                registradas += 1
+        self.stdout.write(self.style.SUCCESS(f'✅ Webhook registrado em {registradas} instâncias ({falhas} falhas).'))
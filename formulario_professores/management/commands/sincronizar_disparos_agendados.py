@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from formulario_professores.models import Mensagem
+
+
+class Command(BaseCommand):
+    help = ('Ressincroniza a tabela DisparoAgendado a partir do JSON dias_disparo das mensagens existentes. '
+            'O preenchimento inicial é feito pela migração 0034; use só para reparos manuais.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help='Quantidade de mensagens lidas por vez.')
+
+    def handle(self, *args, **options):
+        mensagens = Mensagem.objects.only('id', 'dias_disparo', 'horario_disparo').order_by('id')
+        total = 0
+        for mensagem in mensagens.iterator(chunk_size=options['lote']):
+            mensagem.sincronizar_disparos_agendados()
+            total += 1
+        self.stdout.write(self.style.SUCCESS(f'✅ Disparos agendados sincronizados para {total} mensagens.'))
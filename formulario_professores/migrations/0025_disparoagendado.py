@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0024_mensagem_botao_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DisparoAgendado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_hora', models.DateTimeField(db_index=True)),
+                ('mensagem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='disparos_agendados', to='formulario_professores.mensagem')),
+            ],
+            options={
+                'verbose_name': 'Disparo Agendado',
+                'verbose_name_plural': 'Disparos Agendados',
+                'constraints': [models.UniqueConstraint(fields=('mensagem', 'data_hora'), name='disparo_agendado_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:29
+
+import storages.backends.s3
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0025_disparoagendado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='midia',
+            name='arquivo_ogg',
+            field=models.FileField(blank=True, null=True, storage=storages.backends.s3.S3Storage(), upload_to='midia/ogg/'),
+        ),
+        migrations.AddField(
+            model_name='midia',
+            name='duracao_audio',
+            field=models.FloatField(blank=True, help_text='Duração do áudio em segundos', null=True),
+        ),
+        migrations.AddField(
+            model_name='midia',
+            name='status_transcodificacao',
+            field=models.CharField(blank=True, choices=[('pendente', 'Pendente'), ('processando', 'Processando'), ('pronto', 'Pronto'), ('erro', 'Erro')], default='', max_length=12),
+        ),
+    ]
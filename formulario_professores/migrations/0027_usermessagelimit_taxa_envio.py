@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0026_midia_transcodificacao_audio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usermessagelimit',
+            name='envios_por_minuto',
+            field=models.PositiveIntegerField(default=20, verbose_name='Envios por minuto'),
+        ),
+        migrations.AddField(
+            model_name='usermessagelimit',
+            name='rajada_envios',
+            field=models.PositiveIntegerField(default=5, verbose_name='Rajada máxima de envios'),
+        ),
+    ]
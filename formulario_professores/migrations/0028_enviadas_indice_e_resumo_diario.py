@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0027_usermessagelimit_taxa_envio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnviadasDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('total', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário de Enviadas',
+                'verbose_name_plural': 'Resumos Diários de Enviadas',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='enviadas',
+            index=models.Index(fields=['user', 'data_envio'], name='enviadas_user_data_idx'),
+        ),
+        migrations.AddField(
+            model_name='enviadasdiario',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enviadas_diario', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='enviadasdiario',
+            constraint=models.UniqueConstraint(fields=('user', 'data'), name='enviadas_diario_unico'),
+        ),
+    ]
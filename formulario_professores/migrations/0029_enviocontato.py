@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0028_enviadas_indice_e_resumo_diario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvioContato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_campanha', models.UUIDField()),
+                ('contato', models.CharField(max_length=32)),
+                ('parte', models.CharField(choices=[('txt', 'Texto'), ('btn', 'Botão'), ('mid', 'Mídia')], max_length=3)),
+                ('estado', models.CharField(choices=[('enviado', 'Enviado'), ('falha', 'Falha')], max_length=10)),
+                ('tentativas', models.PositiveSmallIntegerField(default=1)),
+                ('latencia_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('message_key', models.CharField(blank=True, db_index=True, help_text='ID da mensagem retornado pela Evolution API', max_length=100)),
+                ('erro', models.CharField(blank=True, max_length=255)),
+                ('atualizado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('mensagem', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='envios_contato', to='formulario_professores.mensagem')),
+            ],
+            options={
+                'verbose_name': 'Envio por Contato',
+                'verbose_name_plural': 'Envios por Contato',
+                'indexes': [models.Index(fields=['id_campanha', 'estado'], name='envio_contato_camp_estado_idx')],
+                'constraints': [models.UniqueConstraint(fields=('id_campanha', 'contato', 'parte'), name='envio_contato_unico')],
+            },
+        ),
+    ]
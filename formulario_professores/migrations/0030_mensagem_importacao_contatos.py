@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0029_enviocontato'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagem',
+            name='importacao_detalhe',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='mensagem',
+            name='importacao_linhas',
+            field=models.PositiveIntegerField(default=0, help_text='Linhas do arquivo já processadas'),
+        ),
+        migrations.AddField(
+            model_name='mensagem',
+            name='importacao_status',
+            field=models.CharField(blank=True, choices=[('pendente', 'Na fila'), ('processando', 'Importando'), ('concluida', 'Concluída'), ('erro', 'Erro')], default='', max_length=15),
+        ),
+    ]
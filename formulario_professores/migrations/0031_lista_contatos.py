@@ -0,0 +1,70 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:52
+
+import hashlib
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SEPARADOR = "\n"
+
+
+def mover_contatos_para_listas(apps, schema_editor):
+    """Copia o JSON Mensagem.contato para ListaContatos (uma por lista distinta)."""
+    Mensagem = apps.get_model('formulario_professores', 'Mensagem')
+    ListaContatos = apps.get_model('formulario_professores', 'ListaContatos')
+    for mensagem in Mensagem.objects.only('id', 'contato').iterator(chunk_size=500):
+        contatos = list(dict.fromkeys(str(c) for c in mensagem.contato)) if isinstance(mensagem.contato, list) else []
+        if not contatos:
+            continue
+        numeros = SEPARADOR.join(contatos)
+        lista, _ = ListaContatos.objects.get_or_create(
+            hash=hashlib.sha256(numeros.encode()).hexdigest(),
+            defaults={'numeros': numeros, 'total': len(contatos)},
+        )
+        Mensagem.objects.filter(id=mensagem.id).update(lista_contatos=lista)
+
+
+def restaurar_contatos(apps, schema_editor):
+    Mensagem = apps.get_model('formulario_professores', 'Mensagem')
+    for mensagem in Mensagem.objects.filter(lista_contatos__isnull=False).select_related('lista_contatos').iterator(chunk_size=500):
+        Mensagem.objects.filter(id=mensagem.id).update(contato=mensagem.lista_contatos.numeros.split(SEPARADOR))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0030_mensagem_importacao_contatos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListaContatos',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('numeros', models.TextField()),
+                ('total', models.PositiveIntegerField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Lista de Contatos',
+                'verbose_name_plural': 'Listas de Contatos',
+            },
+        ),
+        migrations.AddField(
+            model_name='mensagem',
+            name='lista_contatos',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='mensagens', to='formulario_professores.listacontatos'),
+        ),
+        # Com default, a operação inversa consegue recriar a coluna antes de restaurar os dados
+        migrations.AlterField(
+            model_name='mensagem',
+            name='contato',
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(mover_contatos_para_listas, restaurar_contatos),
+        migrations.RemoveField(
+            model_name='mensagem',
+            name='contato',
+        ),
+    ]
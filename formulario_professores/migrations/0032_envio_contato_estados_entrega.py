@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0031_lista_contatos'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='enviocontato',
+            name='estado',
+            field=models.CharField(choices=[('enviado', 'Enviado'), ('entregue', 'Entregue'), ('lido', 'Lido'), ('falha', 'Falha')], max_length=10),
+        ),
+    ]
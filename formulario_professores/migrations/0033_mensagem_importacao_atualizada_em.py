@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0032_envio_contato_estados_entrega'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagem',
+            name='importacao_atualizada_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
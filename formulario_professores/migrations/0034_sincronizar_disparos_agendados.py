@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:40
+
+from datetime import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def popular_disparos_agendados(apps, schema_editor):
+    """Preenche DisparoAgendado (só ocorrências futuras) a partir de dias_disparo das mensagens existentes."""
+    Mensagem = apps.get_model('formulario_professores', 'Mensagem')
+    DisparoAgendado = apps.get_model('formulario_professores', 'DisparoAgendado')
+    fuso = timezone.get_current_timezone()
+    inicio = timezone.now().replace(second=0, microsecond=0)
+    mensagens = Mensagem.objects.filter(horario_disparo__isnull=False).only('id', 'dias_disparo', 'horario_disparo')
+    for mensagem in mensagens.order_by('id').iterator(chunk_size=500):
+        if not isinstance(mensagem.dias_disparo, list):
+            continue
+        horario = mensagem.horario_disparo.replace(second=0, microsecond=0)
+        novas = []
+        for dia_str in mensagem.dias_disparo:
+            try:
+                dia = datetime.strptime(str(dia_str).strip(), '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            data_hora = timezone.make_aware(datetime.combine(dia, horario), fuso)
+            if data_hora >= inicio:
+                novas.append(DisparoAgendado(mensagem_id=mensagem.id, data_hora=data_hora))
+        DisparoAgendado.objects.bulk_create(novas, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('formulario_professores', '0033_mensagem_importacao_atualizada_em'),
+    ]
+
+    operations = [
+        migrations.RunPython(popular_disparos_agendados, migrations.RunPython.noop),
+    ]
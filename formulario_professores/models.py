@@ -1,6 +1,10 @@
 # formularios/models.py
+import hashlib
 import uuid
+from datetime import datetime, timedelta
 from django.db import models
+from django.db.models import Avg, Count, Max, Min
+from django.utils import timezone
 from django.contrib.auth.models import User
 from storages.backends.s3boto3 import S3Boto3Storage
 import boto3
@@ -43,21 +47,66 @@ class Instancia(models.Model):
         return f"Instância '{self.nome_instancia}' de {self.usuario.username} ({status})"
 
     def get_cached_status(self):
-        """Busca o status da conexão do cache para evitar chamadas excessivas."""
+        """Status da conexão gravado no cache pelo poller (tasks.atualizar_status_instancias)."""
         cache_key = f'evolution_status_{self.id}'
         status = cache.get(cache_key)
         if status is None:
-            # Se não estiver no cache, a view irá chamar a API e atualizar o cache.
-            return self.conectado # Retorna o último estado conhecido do banco
+            # Cache expirado (poller parado): usa o último estado que ele gravou no banco
+            return self.conectado
         return status.get('connected', False)
 
+class ListaContatosQuerySet(models.QuerySet):
+    def orfas(self):
+        """Listas que nenhuma mensagem referencia mais (editadas ou excluídas)."""
+        return self.filter(mensagens__isnull=True)
+
+
+class ListaContatos(models.Model):
+    """
+    Lista de contatos de um agendamento, guardada fora da Mensagem e compartilhada entre mensagens
+    com a mesma lista (deduplicada pelo hash). Os números ficam num único texto, um por linha.
+    """
+    hash = models.CharField(max_length=64, unique=True)
+    numeros = models.TextField()
+    total = models.PositiveIntegerField()
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    objects = ListaContatosQuerySet.as_manager()
+
+    SEPARADOR = "\n"
+
+    def __str__(self):
+        return f"Lista {self.hash[:8]} ({self.total} contatos)"
+
+    @classmethod
+    def obter(cls, contatos):
+        """Lista já existente com esses contatos (na mesma ordem, sem repetidos), ou uma nova. None se vazia."""
+        contatos = list(dict.fromkeys(contatos))
+        if not contatos:
+            return None
+        numeros = cls.SEPARADOR.join(contatos)
+        lista, _ = cls.objects.get_or_create(
+            hash=hashlib.sha256(numeros.encode()).hexdigest(),
+            defaults={'numeros': numeros, 'total': len(contatos)},
+        )
+        return lista
+
+    @property
+    def contatos(self):
+        return self.numeros.split(self.SEPARADOR) if self.numeros else []
+
+    class Meta:
+        verbose_name = "Lista de Contatos"
+        verbose_name_plural = "Listas de Contatos"
+
+
 # --- Modelos existentes (mantidos como estão) ---
 
 class Mensagem(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     dias_disparo = models.JSONField(blank=False)
     horario_disparo = models.TimeField(blank=False)
-    contato = models.JSONField(blank=False)
+    lista_contatos = models.ForeignKey(ListaContatos, on_delete=models.PROTECT, null=True, blank=True, related_name='mensagens')
     intervalo_disparo = models.IntegerField()
     mensagem_notificacao = models.TextField(blank=True)
     
@@ -89,6 +138,90 @@ class Mensagem(models.Model):
     id_campanha = models.UUIDField(default=uuid.uuid4, editable=False, help_text="Loteamento")
     midia = models.ForeignKey('Midia', on_delete=models.SET_NULL, null=True, blank=True, related_name="mensagens")
 
+    # Planilhas grandes são importadas em segundo plano (importar_contatos_arquivo); enquanto isso o agendamento não dispara
+    IMPORTACAO_STATUS = [
+        ("pendente", "Na fila"),
+        ("processando", "Importando"),
+        ("concluida", "Concluída"),
+        ("erro", "Erro"),
+    ]
+    importacao_status = models.CharField(max_length=15, choices=IMPORTACAO_STATUS, blank=True, default="")
+    importacao_linhas = models.PositiveIntegerField(default=0, help_text="Linhas do arquivo já processadas")
+    importacao_detalhe = models.CharField(max_length=255, blank=True, default="")
+    # Última notícia da importação (enfileirada, progresso, retentativa): importações paradas há muito tempo viram 'erro'
+    importacao_atualizada_em = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def contatos(self):
+        """Contatos do agendamento (carrega a ListaContatos; nas listagens use lista_contatos__total)."""
+        return self.lista_contatos.contatos if self.lista_contatos_id else []
+
+    @property
+    def importacao_em_andamento(self):
+        return self.importacao_status in ("pendente", "processando")
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.sincronizar_disparos_agendados()
+
+    def datas_hora_disparo(self):
+        """Converte 'dias_disparo' + 'horario_disparo' em datetimes (fuso local) de cada ocorrência."""
+        if not self.horario_disparo or not isinstance(self.dias_disparo, list):
+            return set()
+        fuso = timezone.get_current_timezone()
+        horario = self.horario_disparo.replace(second=0, microsecond=0)
+        ocorrencias = set()
+        for dia_str in self.dias_disparo:
+            try:
+                dia = datetime.strptime(str(dia_str).strip(), '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            ocorrencias.add(timezone.make_aware(datetime.combine(dia, horario), fuso))
+        return ocorrencias
+
+    def sincronizar_disparos_agendados(self):
+        """
+        Mantém a tabela DisparoAgendado igual às datas atualmente configuradas na mensagem.
+        Só as ocorrências a partir do minuto atual: as passadas já dispararam e são apagadas por consolidar_enviadas.
+        """
+        inicio = timezone.now().replace(second=0, microsecond=0)
+        desejadas = {data_hora for data_hora in self.datas_hora_disparo() if data_hora >= inicio}
+        existentes = set(self.disparos_agendados.filter(data_hora__gte=inicio).values_list('data_hora', flat=True))
+        removidas = existentes - desejadas
+        if removidas:
+            self.disparos_agendados.filter(data_hora__in=removidas).delete()
+        novas = desejadas - existentes
+        if novas:
+            DisparoAgendado.objects.bulk_create(
+                [DisparoAgendado(mensagem=self, data_hora=data_hora) for data_hora in novas],
+                ignore_conflicts=True
+            )
+
+
+class DisparoAgendadoQuerySet(models.QuerySet):
+    def do_minuto(self, momento):
+        """Ocorrências que disparam no minuto de 'momento' (consulta por intervalo no índice de data_hora)."""
+        inicio = momento.replace(second=0, microsecond=0)
+        return self.filter(data_hora__gte=inicio, data_hora__lt=inicio + timedelta(minutes=1))
+
+
+class DisparoAgendado(models.Model):
+    """Uma linha por (mensagem, data/hora de disparo), para o beat buscar os disparos do minuto via índice."""
+    mensagem = models.ForeignKey(Mensagem, on_delete=models.CASCADE, related_name='disparos_agendados')
+    data_hora = models.DateTimeField(db_index=True)
+
+    objects = DisparoAgendadoQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Mensagem {self.mensagem_id} em {self.data_hora}"
+
+    class Meta:
+        verbose_name = "Disparo Agendado"
+        verbose_name_plural = "Disparos Agendados"
+        constraints = [
+            models.UniqueConstraint(fields=['mensagem', 'data_hora'], name='disparo_agendado_unico'),
+        ]
+
 
 class Enviadas(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -98,9 +231,34 @@ class Enviadas(models.Model):
     def __str__(self):
         return f"Mensagem enviada por {self.user.username} em {self.data_envio}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'data_envio'], name='enviadas_user_data_idx'),
+        ]
+
+
+class EnviadasDiario(models.Model):
+    """Resumo diário de Enviadas por usuário; as linhas brutas são apagadas após a retenção."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enviadas_diario')
+    data = models.DateField()
+    total = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} - {self.data}: {self.total} mensagens"
+
+    class Meta:
+        verbose_name = "Resumo Diário de Enviadas"
+        verbose_name_plural = "Resumos Diários de Enviadas"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'data'], name='enviadas_diario_unico'),
+        ]
+
 class UserMessageLimit(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     limite_diario = models.IntegerField(default=65)
+    # Token bucket por instância: ritmo sustentado e tamanho máximo de rajada
+    envios_por_minuto = models.PositiveIntegerField(default=20, verbose_name="Envios por minuto")
+    rajada_envios = models.PositiveIntegerField(default=5, verbose_name="Rajada máxima de envios")
 
     def __str__(self):
         return f"{self.user.username} - Limite: {self.limite_diario} mensagens/dia"
@@ -117,6 +275,12 @@ class Midia(models.Model):
         ('audio', 'Áudio'),
         ('document', 'Documento'),
     ]
+    STATUS_TRANSCODIFICACAO = [
+        ('pendente', 'Pendente'),
+        ('processando', 'Processando'),
+        ('pronto', 'Pronto'),
+        ('erro', 'Erro'),
+    ]
 
     tipo = models.CharField(max_length=10, choices=TIPOS_MIDIA)
     nome = models.CharField(max_length=255)
@@ -126,11 +290,22 @@ class Midia(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='midias')
     mimetype = models.CharField(max_length=100, blank=True, null=True)
 
+    # Versão OGG/Opus dos áudios, gerada uma única vez após o upload
+    arquivo_ogg = models.FileField(upload_to='midia/ogg/', storage=S3Boto3Storage(), blank=True, null=True)
+    status_transcodificacao = models.CharField(max_length=12, choices=STATUS_TRANSCODIFICACAO, blank=True, default='')
+    duracao_audio = models.FloatField(null=True, blank=True, help_text="Duração do áudio em segundos")
+
     def __str__(self):
         return self.nome
+
+    @property
+    def audio_pronto(self):
+        """True quando a versão OGG/Opus já pode ser enviada sem conversão."""
+        return self.tipo == 'audio' and self.status_transcodificacao == 'pronto' and bool(self.arquivo_ogg)
     
-    def get_presigned_url(self):
-        if not self.arquivo:
+    def get_presigned_url(self, arquivo=None):
+        arquivo = arquivo or self.arquivo
+        if not arquivo:
             return None
         
         s3_client = boto3.client(
@@ -145,7 +320,7 @@ class Midia(models.Model):
                 'get_object',
                 Params={
                     'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-                    'Key': self.arquivo.name
+                    'Key': arquivo.name
                 },
                 ExpiresIn=3600
             )
@@ -162,24 +337,99 @@ class Midia(models.Model):
                 region_name=settings.AWS_S3_REGION_NAME
             )
 
-            try:
-                s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=self.arquivo.name)
-            except Exception as e:
-                print(f"Erro ao excluir do S3: {e}")
+            for arquivo in (self.arquivo, self.arquivo_ogg):
+                if not arquivo:
+                    continue
+                try:
+                    s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=arquivo.name)
+                except Exception as e:
+                    print(f"Erro ao excluir do S3: {e}")
 
         super().delete(*args, **kwargs)
     
     def save(self, *args, **kwargs):
         if self.arquivo and not self.mimetype:
             mime, _ = mimetypes.guess_type(self.arquivo.name)
-        if mime:
-            self.mimetype = mime
-        else:
-            # Define um valor padrão genérico para evitar None
-            self.mimetype = 'application/octet-stream'
+            if mime:
+                self.mimetype = mime
+            else:
+                # Define um valor padrão genérico para evitar None
+                self.mimetype = 'application/octet-stream'
         super().save(*args, **kwargs)
 
 
 class MidiaMensagem(models.Model):
     mensagem = models.ForeignKey('Mensagem', on_delete=models.CASCADE, related_name="mensagem_midias")
-    midia = models.ForeignKey(Midia, on_delete=models.CASCADE, related_name="midia_mensagens")
\ No newline at end of file
+    midia = models.ForeignKey(Midia, on_delete=models.CASCADE, related_name="midia_mensagens")
+
+
+class EnvioContatoQuerySet(models.QuerySet):
+    def da_campanha(self, id_campanha):
+        return self.filter(id_campanha=id_campanha)
+
+    def resumo_campanha(self, id_campanha):
+        """Totais por estado, taxa de falha, latência média e vazão (envios/min) de uma campanha."""
+        envios = self.da_campanha(id_campanha)
+        por_estado = {
+            linha['estado']: linha['total']
+            for linha in envios.values('estado').annotate(total=Count('id')).order_by()
+        }
+        agregados = envios.aggregate(
+            total=Count('id'), latencia_media_ms=Avg('latencia_ms'),
+            primeiro=Min('atualizado_em'), ultimo=Max('atualizado_em')
+        )
+        total = agregados['total']
+        falhas = por_estado.get('falha', 0)
+        duracao_min = (
+            (agregados['ultimo'] - agregados['primeiro']).total_seconds() / 60
+            if total > 1 else 0
+        )
+        return {
+            'id_campanha': str(id_campanha),
+            'total': total,
+            'por_estado': por_estado,
+            'taxa_falha': round(falhas / total, 4) if total else 0,
+            'latencia_media_ms': round(agregados['latencia_media_ms'] or 0),
+            'envios_por_minuto': round((total - falhas) / duracao_min, 1) if duracao_min else None,
+        }
+
+
+class EnvioContato(models.Model):
+    """Resultado de cada parte (texto, botão, mídia) enviada a um contato numa campanha."""
+    PARTES = [
+        ('txt', 'Texto'),
+        ('btn', 'Botão'),
+        ('mid', 'Mídia'),
+    ]
+    ESTADOS = [
+        ('enviado', 'Enviado'),
+        ('entregue', 'Entregue'),  # Confirmações vindas do webhook da Evolution API (MESSAGES_UPDATE)
+        ('lido', 'Lido'),
+        ('falha', 'Falha'),
+    ]
+
+    id_campanha = models.UUIDField()
+    mensagem = models.ForeignKey(Mensagem, on_delete=models.SET_NULL, null=True, blank=True, related_name='envios_contato')
+    contato = models.CharField(max_length=32)
+    parte = models.CharField(max_length=3, choices=PARTES)
+    estado = models.CharField(max_length=10, choices=ESTADOS)
+    tentativas = models.PositiveSmallIntegerField(default=1)
+    latencia_ms = models.PositiveIntegerField(null=True, blank=True)
+    message_key = models.CharField(max_length=100, blank=True, db_index=True, help_text="ID da mensagem retornado pela Evolution API")
+    erro = models.CharField(max_length=255, blank=True)
+    atualizado_em = models.DateTimeField(default=timezone.now)
+
+    objects = EnvioContatoQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.contato} ({self.get_parte_display()}) - {self.get_estado_display()}"
+
+    class Meta:
+        verbose_name = "Envio por Contato"
+        verbose_name_plural = "Envios por Contato"
+        constraints = [
+            models.UniqueConstraint(fields=['id_campanha', 'contato', 'parte'], name='envio_contato_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['id_campanha', 'estado'], name='envio_contato_camp_estado_idx'),
+        ]
@@ -0,0 +1,133 @@
+# /formularios/repositories/evolutionAsyncRepository.py
+
+import asyncio
+import json
+import logging
+from typing import Dict, Any
+import httpx
+from django.conf import settings
+from .evolutionRepository import EvolutionRepository, STATUS_TRANSITORIOS, resposta_de_erro, resposta_circuito_aberto, segundos_retry_after
+from ..services import circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+class AsyncEvolutionRepository:
+    """
+    Versão assíncrona (httpx) do EvolutionRepository.
+    Mesmos métodos e mesmo formato de retorno, mas com host/api_key fixados na criação
+    e um único AsyncClient (pool de conexões keep-alive) para todas as chamadas.
+
+    Uso:
+        async with AsyncEvolutionRepository(host, api_key) as repo:
+            await repo.enviar_mensagem_texto(instance_name, number, text)
+    """
+    def __init__(self, host: str, api_key: str, timeout: int = 60, max_conexoes: int = None):
+        max_conexoes = max_conexoes or getattr(settings, 'EVOLUTION_ASYNC_MAX_CONCORRENCIA', 100)
+        self.host = host.rstrip('/')
+        self.client = httpx.AsyncClient(
+            base_url=self.host,
+            headers={"apikey": api_key, "Content-Type": "application/json"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_conexoes, max_keepalive_connections=max_conexoes),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
+        """Função centralizada para realizar todas as requisições HTTP (equivalente assíncrono)."""
+        url = f"{self.host}/{endpoint}"
+        espera = await asyncio.to_thread(circuit_breaker.permitir, self.host)
+        if espera > 0:
+            return resposta_circuito_aberto(self.host, espera)
+        try:
+            response = await self.client.request(method, f"/{endpoint}", **kwargs)
+            if response.status_code >= 500:
+                await asyncio.to_thread(circuit_breaker.registrar_falha, self.host)
+            else:
+                await asyncio.to_thread(circuit_breaker.registrar_sucesso, self.host)
+            response.raise_for_status()
+            if response.status_code in [200, 204] and not response.content:
+                return {"status": "success", "message": "Operação realizada com sucesso."}
+            return response.json()
+        except httpx.HTTPStatusError as http_err:
+            status_code = http_err.response.status_code
+            try:
+                error_details = http_err.response.json()
+                error_message = f"Erro da API: {error_details}"
+            except json.JSONDecodeError:
+                error_message = f"Erro HTTP: {status_code} - {http_err.response.text}"
+            logger.error(f"Erro na chamada para '{url}': {error_message}")
+            return resposta_de_erro(
+                error_message,
+                transitorio=status_code in STATUS_TRANSITORIOS,
+                status_code=status_code,
+                retry_after=segundos_retry_after(http_err.response.headers.get("Retry-After")),
+            )
+        except httpx.HTTPError as req_err:
+            logger.error(f"Erro de conexão com '{url}': {req_err}")
+            falha_de_rede = isinstance(req_err, httpx.TransportError)
+            if falha_de_rede:
+                await asyncio.to_thread(circuit_breaker.registrar_falha, self.host)
+            # Mesma regra do repositório síncrono: timeout de leitura num POST não é repetido
+            ambiguo = method != "GET" and isinstance(req_err, httpx.ReadTimeout)
+            transitorio = falha_de_rede and not ambiguo
+            return resposta_de_erro("Erro de conexão com a API.", transitorio=transitorio, ambiguo=ambiguo)
+
+    # --- Métodos de Gerenciamento da Instância ---
+    async def criar_instancia(self, instance_name: str) -> Dict[str, Any]:
+        payload = {
+            "instanceName": instance_name,
+            "qrcode": True,
+            "integration": "WHATSAPP-BAILEYS"
+        }
+        return await self._make_request("POST", "instance/create", json=payload)
+
+    async def get_status(self, instance_name: str) -> Dict[str, Any]:
+        return await self._make_request("GET", f"instance/connectionState/{instance_name}")
+
+    async def get_qrcode(self, instance_name: str) -> Dict[str, Any]:
+        return await self._make_request("GET", f"instance/connect/{instance_name}")
+
+    async def desconectar(self, instance_name: str) -> Dict[str, Any]:
+        return await self._make_request("DELETE", f"instance/logout/{instance_name}")
+
+    async def reiniciar(self, instance_name: str) -> Dict[str, Any]:
+        return await self._make_request("POST", f"instance/restart/{instance_name}")
+
+    # --- Métodos de Envio de Mensagens ---
+    async def enviar_mensagem_texto(self, instance_name: str, number: str, text: str) -> Dict[str, Any]:
+        payload = {"number": number, "text": text}
+        return await self._make_request("POST", f"message/sendText/{instance_name}", json=payload)
+
+    async def enviar_midia(self, instance_name: str, number: str, mediatype: str, mimetype: str, media_data: str, caption: str, file_name: str) -> Dict[str, Any]:
+        payload = {
+            "number": number,
+            "mediatype": mediatype,
+            "mimetype": mimetype,
+            "caption": caption,
+            "media": media_data,
+            "fileName": file_name
+        }
+        return await self._make_request("POST", f"message/sendMedia/{instance_name}", json=payload)
+
+    async def enviar_audio(self, instance_name: str, number: str, audio_data: str) -> Dict[str, Any]:
+        payload = {"number": number, "audio": audio_data}
+        return await self._make_request("POST", f"message/sendWhatsAppAudio/{instance_name}", json=payload)
+
+    async def enviar_mensagem_com_botao(self, instance_name: str, number: str, text: str, button_text: str, button_url: str) -> Dict[str, Any]:
+        """Mesma estratégia do repositório síncrono: texto formatado com link (Baileys não suporta sendButtons)."""
+        payload = {"number": number, "text": EvolutionRepository.formatar_mensagem_com_botao(text, button_text, button_url)}
+        return await self._make_request("POST", f"message/sendText/{instance_name}", json=payload)
+
+    # --- Grupos ---
+    async def get_todos_grupos(self, instance_name: str, get_participants: bool = False) -> Dict[str, Any]:
+        params = {"getParticipants": str(get_participants).lower()}
+        return await self._make_request("GET", f"group/fetchAllGroups/{instance_name}", params=params)
+
+    async def get_participantes_grupo(self, instance_name: str, group_id: str) -> Dict[str, Any]:
+        params = {"groupJid": group_id}
+        return await self._make_request("GET", f"group/participants/{instance_name}", params=params)
@@ -1,12 +1,141 @@
 # /formularios/repositories/evolutionRepository.py
 
+import os
+import threading
 import requests
 import json
 import logging
-from typing import Dict, Any
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Optional, BinaryIO
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ..services import circuit_breaker
 
 logger = logging.getLogger(__name__)
 
+# Sessões HTTP reaproveitadas por (processo, host): mantêm as conexões TCP/TLS abertas (keep-alive)
+_sessoes_http: Dict[tuple, requests.Session] = {}
+_sessoes_http_lock = threading.Lock()
+
+# Respostas que costumam se resolver sozinhas: vale tentar de novo mais tarde
+STATUS_TRANSITORIOS = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+
+def _criar_sessao_http() -> requests.Session:
+    """Cria uma Session com pool de conexões e retry/backoff configuráveis via settings."""
+    retentativas = getattr(settings, 'EVOLUTION_HTTP_RETRIES', 2)
+    retry = Retry(
+        total=retentativas,
+        connect=retentativas,
+        read=retentativas,
+        status=retentativas,
+        backoff_factor=getattr(settings, 'EVOLUTION_HTTP_BACKOFF', 0.5),
+        status_forcelist=(502, 503, 504),
+        # POST não é repetido automaticamente para não duplicar envios; erros de conexão sim
+        allowed_methods=frozenset(['GET', 'DELETE']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    tamanho_pool = getattr(settings, 'EVOLUTION_HTTP_POOL_SIZE', 20)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho_pool, max_retries=retry)
+    sessao = requests.Session()
+    sessao.headers.update({"Connection": "keep-alive"})
+    sessao.mount("http://", adapter)
+    sessao.mount("https://", adapter)
+    return sessao
+
+
+class CorpoJsonComBase64:
+    """
+    Corpo de requisição JSON lido sob demanda: {campos..., "<campo>": "<conteúdo do arquivo Base64>"}.
+    O http.client envia o corpo em blocos via read(), então a memória usada independe do tamanho
+    do arquivo; __len__ permite que o requests envie Content-Length (sem chunked encoding).
+    """
+    def __init__(self, payload: Dict[str, Any], campo: str, arquivo_base64: BinaryIO):
+        prefixo = json.dumps(payload)[:-1]
+        self._prefixo = f'{prefixo}{", " if payload else ""}"{campo}": "'.encode()
+        self._sufixo = b'"}'
+        self._arquivo = arquivo_base64
+        self._partes = None
+        self._pendente = b''
+
+    def __len__(self):
+        return len(self._prefixo) + os.fstat(self._arquivo.fileno()).st_size + len(self._sufixo)
+
+    def _gerar_partes(self):
+        yield self._prefixo
+        self._arquivo.seek(0)
+        while bloco := self._arquivo.read(64 * 1024):
+            yield bloco
+        yield self._sufixo
+
+    def read(self, size: int = -1) -> bytes:
+        if self._partes is None:
+            self._partes = self._gerar_partes()
+        while size < 0 or len(self._pendente) < size:
+            try:
+                self._pendente += next(self._partes)
+            except StopIteration:
+                break
+        if size < 0:
+            dados, self._pendente = self._pendente, b''
+        else:
+            dados, self._pendente = self._pendente[:size], self._pendente[size:]
+        return dados
+
+
+def segundos_retry_after(valor: Optional[str]) -> Optional[float]:
+    """Converte o cabeçalho Retry-After (segundos ou data HTTP) em segundos de espera."""
+    if not valor:
+        return None
+    try:
+        return max(float(valor), 0.0)
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max((data - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def resposta_de_erro(mensagem: str, transitorio: bool, status_code: Optional[int] = None, retry_after: Optional[float] = None, circuito_aberto: bool = False, ambiguo: bool = False) -> Dict[str, Any]:
+    """
+    Formato único dos erros devolvidos pelos repositórios, já com a classificação para retentativa.
+    'ambiguo': a requisição pode ter sido processada mesmo assim (timeout de leitura num POST).
+    """
+    return {
+        "status": "error",
+        "message": mensagem,
+        "transitorio": transitorio,
+        "status_code": status_code,
+        "retry_after": retry_after,
+        "circuito_aberto": circuito_aberto,
+        "ambiguo": ambiguo,
+    }
+
+
+def resposta_circuito_aberto(host: str, espera: float) -> Dict[str, Any]:
+    """Resposta dada sem tocar na rede enquanto o circuit breaker do host está aberto."""
+    logger.warning(f"Circuito aberto para '{host}': chamada recusada, nova tentativa em {espera:.0f}s.")
+    return resposta_de_erro("Evolution API indisponível (circuito aberto).", transitorio=True, retry_after=espera, circuito_aberto=True)
+
+
+def get_sessao_http(host: str) -> requests.Session:
+    """Retorna a Session do processo atual para o host (recria após fork dos workers)."""
+    chave = (os.getpid(), host.rstrip('/'))
+    sessao = _sessoes_http.get(chave)
+    if sessao is None:
+        with _sessoes_http_lock:
+            sessao = _sessoes_http.get(chave)
+            if sessao is None:
+                sessao = _criar_sessao_http()
+                _sessoes_http[chave] = sessao
+    return sessao
+
+
 class EvolutionRepository:
     """
     Camada de repositório para interagir com a Evolution API.
@@ -17,24 +146,53 @@ class EvolutionRepository:
         """Função centralizada para realizar todas as requisições HTTP."""
         url = f"{host.rstrip('/')}/{endpoint}"
         headers = {"apikey": api_key, "Content-Type": "application/json"}
+        espera = circuit_breaker.permitir(host)
+        if espera > 0:
+            return resposta_circuito_aberto(host, espera)
         try:
             # Passa 'params' para requisições GET e 'json' para POST/PUT etc.
-            response = requests.request(method, url, headers=headers, timeout=timeout, **kwargs)
+            response = get_sessao_http(host).request(method, url, headers=headers, timeout=timeout, **kwargs)
+            if response.status_code >= 500:
+                circuit_breaker.registrar_falha(host)
+            else:
+                circuit_breaker.registrar_sucesso(host)
             response.raise_for_status()
             if response.status_code in [200, 204] and not response.content:
                 return {"status": "success", "message": "Operação realizada com sucesso."}
             return response.json()
         except requests.exceptions.HTTPError as http_err:
+            status_code = http_err.response.status_code
             try:
                 error_details = http_err.response.json()
                 error_message = f"Erro da API: {error_details}"
             except json.JSONDecodeError:
-                error_message = f"Erro HTTP: {http_err.response.status_code} - {http_err.response.text}"
+                error_message = f"Erro HTTP: {status_code} - {http_err.response.text}"
             logger.error(f"Erro na chamada para '{url}': {error_message}")
-            return {"status": "error", "message": error_message}
+            return resposta_de_erro(
+                error_message,
+                transitorio=status_code in STATUS_TRANSITORIOS,
+                status_code=status_code,
+                retry_after=segundos_retry_after(http_err.response.headers.get("Retry-After")),
+            )
         except requests.exceptions.RequestException as req_err:
             logger.error(f"Erro de conexão com '{url}': {req_err}")
-            return {"status": "error", "message": "Erro de conexão com a API."}
+            falha_de_rede = isinstance(req_err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            if falha_de_rede:
+                circuit_breaker.registrar_falha(host)
+            # Timeout de leitura num POST é ambíguo (a mensagem pode ter saído): não é repetido
+            ambiguo = method != "GET" and isinstance(req_err, requests.exceptions.ReadTimeout)
+            transitorio = falha_de_rede and not ambiguo
+            return resposta_de_erro("Erro de conexão com a API.", transitorio=transitorio, ambiguo=ambiguo)
+
+    @staticmethod
+    def erro_transitorio(resultado: Dict[str, Any]) -> bool:
+        """True se o resultado é um erro que pode dar certo numa nova tentativa (conexão, 429, 5xx)."""
+        return resultado.get("status") == "error" and bool(resultado.get("transitorio"))
+
+    @staticmethod
+    def mensagem_nao_saiu(resultado: Dict[str, Any]) -> bool:
+        """True se o resultado é um erro em que a mensagem com certeza não foi enviada (exclui timeouts ambíguos)."""
+        return ("error" in resultado or resultado.get("status") == "error") and not resultado.get("ambiguo")
 
     # --- Métodos de Gerenciamento da Instância ---
     def criar_instancia(host: str, api_key: str, instance_name: str) -> Dict[str, Any]:
@@ -56,6 +214,20 @@ class EvolutionRepository:
         """Obtém o QR Code para conectar uma instância já criada."""
         return EvolutionRepository._make_request("GET", host, api_key, f"instance/connect/{instance_name}")
 
+    @staticmethod
+    def configurar_webhook(host: str, api_key: str, instance_name: str, url: str, eventos: list) -> Dict[str, Any]:
+        """Registra (ou substitui) o webhook da instância para os eventos informados."""
+        payload = {
+            "webhook": {
+                "enabled": True,
+                "url": url,
+                "byEvents": False,
+                "base64": False,
+                "events": eventos,
+            }
+        }
+        return EvolutionRepository._make_request("POST", host, api_key, f"webhook/set/{instance_name}", json=payload)
+
     @staticmethod
     def desconectar(host: str, api_key: str, instance_name: str) -> Dict[str, Any]:
         """Desconecta (logout) uma instância do WhatsApp."""
@@ -77,7 +249,7 @@ class EvolutionRepository:
   
     @staticmethod
     def enviar_midia(host: str, api_key: str, instance_name: str, number: str, mediatype: str, mimetype: str, media_data: str, caption: str, file_name: str) -> Dict[str, Any]:
-        """Envia uma mídia (imagem, vídeo, doc) a partir de uma string Base64."""
+        """Envia uma mídia (imagem, vídeo, doc) a partir de uma string Base64 ou de uma URL pública."""
         payload = {
             "number": number,
             "mediatype": mediatype,
@@ -88,12 +260,43 @@ class EvolutionRepository:
         }
         return EvolutionRepository._make_request("POST", host, api_key, f"message/sendMedia/{instance_name}", json=payload)
 
+    @staticmethod
+    def enviar_midia_arquivo(host: str, api_key: str, instance_name: str, number: str, mediatype: str, mimetype: str, arquivo_base64: BinaryIO, caption: str, file_name: str) -> Dict[str, Any]:
+        """Igual a enviar_midia, mas transmite o Base64 direto do arquivo (aberto) em disco, sem montá-lo na memória."""
+        payload = {
+            "number": number,
+            "mediatype": mediatype,
+            "mimetype": mimetype,
+            "caption": caption,
+            "fileName": file_name
+        }
+        corpo = CorpoJsonComBase64(payload, "media", arquivo_base64)
+        return EvolutionRepository._make_request("POST", host, api_key, f"message/sendMedia/{instance_name}", data=corpo)
+
+    @staticmethod
+    def enviar_audio_arquivo(host: str, api_key: str, instance_name: str, number: str, arquivo_base64: BinaryIO) -> Dict[str, Any]:
+        """Igual a enviar_audio, mas transmite o Base64 direto do arquivo em disco."""
+        corpo = CorpoJsonComBase64({"number": number}, "audio", arquivo_base64)
+        return EvolutionRepository._make_request("POST", host, api_key, f"message/sendWhatsAppAudio/{instance_name}", data=corpo)
+
     @staticmethod
     def enviar_audio(host: str, api_key: str, instance_name: str, number: str, audio_data: str) -> Dict[str, Any]:
-        """Envia um áudio (PTT) a partir de uma string Base64."""
+        """Envia um áudio (PTT) a partir de uma string Base64 ou de uma URL pública."""
         payload = {"number": number, "audio": audio_data} # Espera a string Base64 pura
         return EvolutionRepository._make_request("POST", host, api_key, f"message/sendWhatsAppAudio/{instance_name}", json=payload)
 
+    @staticmethod
+    def formatar_mensagem_com_botao(text: str, button_text: str, button_url: str) -> str:
+        """Formata a mensagem com link clicável e emojis para destaque visual."""
+        return f"""📩 *Mensagem Importante*
+
+{text}
+
+🔗 *{button_text}*
+👉 {button_url}
+
+_Clique no link acima para acessar_"""
+
     @staticmethod
     def enviar_mensagem_com_botao(host: str, api_key: str, instance_name: str, number: str, text: str, button_text: str, button_url: str) -> Dict[str, Any]:
         """
@@ -105,18 +308,8 @@ class EvolutionRepository:
         Solução: Enviar mensagem de texto formatada com link clicável.
         O WhatsApp detecta automaticamente URLs e as torna clicáveis.
         """
-        # Formata a mensagem com link clicável e emojis para destaque visual
-        mensagem_formatada = f"""📩 *Mensagem Importante*
-
-{text}
-
-🔗 *{button_text}*
-👉 {button_url}
-
-_Clique no link acima para acessar_"""
-        
         # Usa o endpoint de texto simples que funciona 100% no Baileys
-        payload = {"number": number, "text": mensagem_formatada}
+        payload = {"number": number, "text": EvolutionRepository.formatar_mensagem_com_botao(text, button_text, button_url)}
         return EvolutionRepository._make_request("POST", host, api_key, f"message/sendText/{instance_name}", json=payload)
 
  # --- NOVAS FUNÇÕES PARA GRUPOS ---
@@ -138,7 +331,6 @@ _Clique no link acima para acessar_"""
     @staticmethod
     def get_participantes_grupo(host: str, api_key: str, instance_name: str, group_id: str) -> Dict[str, Any]:
         """Busca os participantes de um grupo específico usando o endpoint GET."""
-        # Esta função continua aqui, mas não será mais usada pela tarefa de exportação.
         endpoint = f"group/participants/{instance_name}"
         params = {"groupJid": group_id}
         return EvolutionRepository._make_request("GET", host, api_key, endpoint, params=params)
@@ -0,0 +1,114 @@
+# /app/formulario_professores/services/circuit_breaker.py
+
+import logging
+import redis
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+FECHADO = "fechado"
+ABERTO = "aberto"
+MEIO_ABERTO = "meio_aberto"
+CIRCUITO_TTL = 24 * 3600
+
+# Decide se uma chamada ao host pode acontecer. Retorna 0 se pode, senão os segundos até a próxima chance.
+# Aberto com prazo vencido vira meio-aberto e libera uma única sonda; as demais chamadas esperam o
+# resultado dela (ou o prazo da sonda, se o worker que a fazia morrer). Com ARGV[2] == '1' só consulta.
+_SCRIPT_PERMITIR = """
+local tempo = redis.call('TIME')
+local agora = tonumber(tempo[1]) + tonumber(tempo[2]) / 1000000
+local dados = redis.call('HMGET', KEYS[1], 'estado', 'aberto_ate', 'sonda_ate')
+local estado = dados[1]
+if estado ~= 'aberto' and estado ~= 'meio_aberto' then
+    return '0'
+end
+local aberto_ate = tonumber(dados[2]) or 0
+if estado == 'aberto' and agora < aberto_ate then
+    return tostring(aberto_ate - agora)
+end
+local sonda_ate = tonumber(dados[3]) or 0
+if estado == 'meio_aberto' and agora < sonda_ate then
+    return tostring(sonda_ate - agora)
+end
+if ARGV[2] == '1' then
+    return '0'
+end
+redis.call('HSET', KEYS[1], 'estado', 'meio_aberto', 'sonda_ate', agora + tonumber(ARGV[1]))
+return '0'
+"""
+
+# Conta falhas consecutivas; abre o circuito ao atingir o limiar ou quando a sonda do meio-aberto falha.
+_SCRIPT_REGISTRAR_FALHA = """
+local tempo = redis.call('TIME')
+local agora = tonumber(tempo[1]) + tonumber(tempo[2]) / 1000000
+local estado = redis.call('HGET', KEYS[1], 'estado')
+local falhas = redis.call('HINCRBY', KEYS[1], 'falhas', 1)
+if estado == 'meio_aberto' or falhas >= tonumber(ARGV[1]) then
+    redis.call('HSET', KEYS[1], 'estado', 'aberto', 'aberto_ate', agora + tonumber(ARGV[2]))
+    redis.call('HDEL', KEYS[1], 'sonda_ate')
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return falhas
+"""
+_scripts = {}
+
+
+def _script(nome, codigo):
+    if nome not in _scripts:
+        _scripts[nome] = get_redis_connection("default").register_script(codigo)
+    return _scripts[nome]
+
+
+def _chave(host):
+    return f"circuito:{host.rstrip('/')}"
+
+
+def permitir(host, apenas_consultar=False):
+    """
+    Retorna 0.0 se a chamada ao host pode ser feita agora, senão os segundos até o circuito aceitar chamadas.
+    Se o Redis estiver fora, o circuito não bloqueia nada (falha aberta).
+    """
+    try:
+        espera = _script("permitir", _SCRIPT_PERMITIR)(
+            keys=[_chave(host)], args=[settings.CIRCUITO_TEMPO_ABERTO, '1' if apenas_consultar else '0']
+        )
+        return float(espera)
+    except redis.RedisError as e:
+        logger.warning(f"[CircuitBreaker] Redis indisponível ao consultar '{host}': {e}")
+        return 0.0
+
+
+def registrar_sucesso(host):
+    """O host respondeu: fecha o circuito e zera as falhas."""
+    try:
+        get_redis_connection("default").delete(_chave(host))
+    except redis.RedisError as e:
+        logger.warning(f"[CircuitBreaker] Redis indisponível ao registrar sucesso de '{host}': {e}")
+
+
+def registrar_falha(host):
+    """Falha de infraestrutura (conexão, timeout, 5xx) no host."""
+    try:
+        falhas = _script("registrar_falha", _SCRIPT_REGISTRAR_FALHA)(
+            keys=[_chave(host)], args=[settings.CIRCUITO_LIMIAR_FALHAS, settings.CIRCUITO_TEMPO_ABERTO, CIRCUITO_TTL]
+        )
+        if int(falhas) == settings.CIRCUITO_LIMIAR_FALHAS:
+            logger.error(f"[CircuitBreaker] Circuito aberto para '{host}' após {falhas} falhas consecutivas.")
+    except redis.RedisError as e:
+        logger.warning(f"[CircuitBreaker] Redis indisponível ao registrar falha de '{host}': {e}")
+
+
+def estado(host):
+    """Estado atual do circuito do host, para exibição: {'estado', 'falhas', 'reabre_em'}."""
+    try:
+        dados = get_redis_connection("default").hgetall(_chave(host))
+    except redis.RedisError:
+        dados = {}
+    estado_atual = dados.get(b'estado', FECHADO.encode()).decode()
+    reabre_em = permitir(host, apenas_consultar=True) if estado_atual != FECHADO else 0.0
+    return {
+        'estado': estado_atual,
+        'falhas': int(dados.get(b'falhas', 0)),
+        'reabre_em': int(round(reabre_em)),
+    }
@@ -0,0 +1,106 @@
+# /app/formulario_professores/services/cota_diaria.py
+
+import logging
+from datetime import datetime, time, timedelta
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+COTA_DIARIA_TTL = 2 * 24 * 3600
+
+# Reserva atômica: concede no máximo o que ainda cabe no limite e incrementa o contador de uma vez,
+# de modo que ticks concorrentes nunca ultrapassem a cota do usuário.
+_SCRIPT_RESERVAR = """
+local atual = tonumber(redis.call('GET', KEYS[1]) or '0')
+local disponivel = tonumber(ARGV[2]) - atual
+local concedido = math.min(tonumber(ARGV[1]), math.max(disponivel, 0))
+if concedido > 0 then
+    redis.call('INCRBY', KEYS[1], concedido)
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return concedido
+"""
+_script_reservar = None
+
+# Devolução por contato: cada parte (texto, mídia) que terminou sem sair entra num SET; quando todas
+# as 'partes' do contato estão lá, a unidade reservada para ele volta para a cota (uma única vez).
+_SCRIPT_DEVOLVER_CONTATO = """
+local nova = redis.call('SADD', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+if nova == 0 or redis.call('SCARD', KEYS[2]) ~= tonumber(ARGV[2]) then
+    return 0
+end
+if tonumber(redis.call('GET', KEYS[1]) or '0') > 0 then
+    redis.call('DECR', KEYS[1])
+end
+return 1
+"""
+_script_devolver_contato = None
+
+
+def _redis():
+    return get_redis_connection("default")
+
+
+def _chave(usuario_id, dia):
+    return f"cota_diaria:{usuario_id}:{dia.strftime('%Y%m%d')}"
+
+
+def _semear(usuario_id, dia):
+    """
+    Se o contador do dia ainda não existe (primeiro uso ou Redis reiniciado),
+    inicializa-o a partir das Enviadas já registradas. SET NX evita sobrescrever outro worker.
+    """
+    chave = _chave(usuario_id, dia)
+    conexao = _redis()
+    if conexao.exists(chave):
+        return chave
+
+    from ..models import Enviadas
+    fuso = timezone.get_current_timezone()
+    inicio = timezone.make_aware(datetime.combine(dia, time.min), fuso)
+    total = Enviadas.objects.filter(
+        user_id=usuario_id, data_envio__gte=inicio, data_envio__lt=inicio + timedelta(days=1)
+    ).count()
+    conexao.set(chave, total, ex=COTA_DIARIA_TTL, nx=True)
+    return chave
+
+
+def consumidas(usuario_id, dia=None):
+    """Quantas mensagens o usuário já reservou/enviou no dia (O(1) no Redis)."""
+    dia = dia or timezone.localdate()
+    return int(_redis().get(_semear(usuario_id, dia)) or 0)
+
+
+def reservar(usuario_id, quantidade, limite, dia=None):
+    """Reserva até 'quantidade' envios dentro do limite diário. Retorna quantos foram concedidos."""
+    global _script_reservar
+    if quantidade <= 0:
+        return 0
+    dia = dia or timezone.localdate()
+    chave = _semear(usuario_id, dia)
+    if _script_reservar is None:
+        _script_reservar = _redis().register_script(_SCRIPT_RESERVAR)
+    return int(_script_reservar(keys=[chave], args=[quantidade, limite, COTA_DIARIA_TTL]))
+
+
+def devolver(usuario_id, quantidade, dia=None):
+    """Devolve envios reservados que não chegaram a ser enfileirados."""
+    if quantidade <= 0:
+        return
+    dia = dia or timezone.localdate()
+    _redis().decrby(_chave(usuario_id, dia), quantidade)
+
+
+def devolver_contato(usuario_id, chave_contato, parte, partes, dia):
+    """
+    Registra que a 'parte' do envio ao contato terminou sem a mensagem sair (falha definitiva ou envio descartado
+    antes da API). Quando as 'partes' do contato terminaram assim, devolve a unidade reservada. Retorna se devolveu.
+    Duplicatas descartadas não passam por aqui: a reserva delas é a mesma do envio que de fato saiu.
+    """
+    global _script_devolver_contato
+    if _script_devolver_contato is None:
+        _script_devolver_contato = _redis().register_script(_SCRIPT_DEVOLVER_CONTATO)
+    chave_partes = f"cota_diaria:devolvidas:{usuario_id}:{dia.strftime('%Y%m%d')}:{chave_contato}"
+    return bool(_script_devolver_contato(keys=[_chave(usuario_id, dia), chave_partes], args=[parte, partes, COTA_DIARIA_TTL]))
@@ -0,0 +1,70 @@
+# /app/formulario_professores/services/idempotencia_envio.py
+
+import logging
+import re
+from django.conf import settings
+from django.core.cache import cache
+from ..repositories.evolutionRepository import EvolutionRepository
+
+logger = logging.getLogger(__name__)
+
+# Estados da chave envio_idem:{envio_log_id sem o índice}:{contato}
+EM_ANDAMENTO = "em_andamento"
+ENVIADO = "enviado"
+FALHOU = "falhou"
+
+# Tempo máximo que uma reserva fica de pé se o worker morrer no meio da chamada à API;
+# depois disso uma reentrega da mensagem pode tentar de novo.
+RESERVA_TTL = 10 * 60
+
+
+# O índice do contato (-contN) muda se a lista for editada entre ocorrências; o número não
+_INDICE_CONTATO = re.compile(r"-cont\d+")
+
+
+def _chave(envio_log_id, contato):
+    return f"envio_idem:{_INDICE_CONTATO.sub('', envio_log_id)}:{contato}"
+
+
+def ja_processado(envio_log_id, contato):
+    """Checagem barata (um GET), feita antes de gastar token do rate limiter ou preparar mídia."""
+    return cache.get(_chave(envio_log_id, contato)) is not None
+
+
+def ja_processados(envios):
+    """Versão em lote de ja_processado (um MGET) para pares (envio_log_id, contato): o conjunto dos já enviados ou em andamento."""
+    encontrados = cache.get_many([_chave(envio_log_id, contato) for envio_log_id, contato in envios])
+    return {(envio_log_id, contato) for envio_log_id, contato in envios if _chave(envio_log_id, contato) in encontrados}
+
+
+def reservar(envio_log_id, contato):
+    """
+    Reserva atômica (SET NX) do envio imediatamente antes da chamada à API.
+    Retorna False se outra execução já enviou ou está enviando o mesmo contato.
+    """
+    return cache.add(_chave(envio_log_id, contato), EM_ANDAMENTO, RESERVA_TTL)
+
+
+def confirmar(envio_log_id, contato):
+    """Marca o envio como concluído; duplicatas que chegarem depois são descartadas."""
+    # A chave se repete a cada ocorrência do agendamento, por isso o TTL é menor que 1 dia
+    cache.set(_chave(envio_log_id, contato), ENVIADO, settings.IDEMPOTENCIA_TTL)
+
+
+def liberar(envio_log_id, contato):
+    """Desfaz a reserva de um envio que falhou, permitindo que uma retentativa o refaça."""
+    cache.delete(_chave(envio_log_id, contato))
+
+
+def concluir(envio_log_id, contato, resultado_api):
+    """
+    Fecha a reserva conforme o resultado da chamada à API. Só erros sabidamente repetíveis a liberam;
+    num erro permanente ou ambíguo (timeout de leitura de um POST: a mensagem pode ter saído)
+    a chave fica como FALHOU, e reentregas da mesma tarefa são descartadas como duplicatas.
+    """
+    if EvolutionRepository.erro_transitorio(resultado_api):
+        liberar(envio_log_id, contato)
+    elif "error" in resultado_api or resultado_api.get("status") == "error":
+        cache.set(_chave(envio_log_id, contato), FALHOU, settings.IDEMPOTENCIA_TTL)
+    else:
+        confirmar(envio_log_id, contato)
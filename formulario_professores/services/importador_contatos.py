@@ -0,0 +1,104 @@
+# /app/formulario_professores/services/importador_contatos.py
+
+import codecs
+import csv
+import logging
+from dataclasses import dataclass, field
+from itertools import islice
+
+from openpyxl import load_workbook
+
+from .normalizacao_telefones import MOTIVO_VAZIO, normalizar_telefones
+
+logger = logging.getLogger(__name__)
+
+EXTENSOES_SUPORTADAS = ('.csv', '.xls', '.xlsx')
+MAX_EXEMPLOS_INVALIDOS = 3
+# Linhas normalizadas de uma vez por normalizar_telefones
+TAMANHO_BLOCO = 50_000
+
+
+@dataclass
+class ResultadoImportacao:
+    """Contatos válidos (sem repetição, na ordem do arquivo) e um resumo dos descartados."""
+    contatos: list = field(default_factory=list)
+    linhas_lidas: int = 0
+    invalidos: int = 0
+    exemplos_invalidos: list = field(default_factory=list)
+
+
+def _valor_celula(valor):
+    """Células numéricas das planilhas viram texto sem o '.0' (11988887777.0 -> '11988887777')."""
+    if valor is None:
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor).strip()
+
+
+def _linhas_csv(arquivo):
+    arquivo.seek(0)
+    texto = codecs.getreader('utf-8-sig')(arquivo, errors='replace')
+    for linha in csv.reader(texto):
+        yield linha[0] if linha else ''
+
+
+def _linhas_xlsx(arquivo):
+    arquivo.seek(0)
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for (valor,) in planilha.worksheets[0].iter_rows(max_col=1, values_only=True):
+            yield _valor_celula(valor)
+    finally:
+        planilha.close()
+
+
+def _linhas_xls(arquivo):
+    import xlrd  # Só o formato antigo (limitado a 65 mil linhas) precisa do xlrd
+    arquivo.seek(0)
+    planilha = xlrd.open_workbook(file_contents=arquivo.read(), on_demand=True)
+    try:
+        aba = planilha.sheet_by_index(0)
+        for indice in range(aba.nrows):
+            yield _valor_celula(aba.cell_value(indice, 0))
+    finally:
+        planilha.release_resources()
+
+
+def primeira_coluna(arquivo, nome_arquivo):
+    """Itera, uma linha por vez, os valores da primeira coluna de um CSV/XLS/XLSX."""
+    nome = nome_arquivo.lower()
+    if nome.endswith('.csv'):
+        return _linhas_csv(arquivo)
+    if nome.endswith('.xlsx'):
+        return _linhas_xlsx(arquivo)
+    if nome.endswith('.xls'):
+        return _linhas_xls(arquivo)
+    raise ValueError("Formato de arquivo não suportado.")
+
+
+def importar_contatos(valores, progresso=None, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Valida, normaliza e remove repetidos em blocos de 'tamanho_bloco' linhas (normalização vetorizada).
+    A memória usada cresce só com os contatos válidos distintos e um bloco, nunca com o tamanho do arquivo.
+    'progresso(linhas_lidas)' é chamado ao fim de cada bloco.
+    """
+    resultado = ResultadoImportacao()
+    vistos = set()
+    valores = iter(valores)
+    while bloco := list(islice(valores, tamanho_bloco)):
+        resultado.linhas_lidas += len(bloco)
+        normalizados = normalizar_telefones(bloco)
+        for valor, numero, motivo in zip(bloco, normalizados['numero'], normalizados['motivo']):
+            if numero is not None:
+                if numero not in vistos:
+                    vistos.add(numero)
+                    resultado.contatos.append(numero)
+            elif motivo != MOTIVO_VAZIO:
+                resultado.invalidos += 1
+                valor = str(valor).strip()
+                if len(resultado.exemplos_invalidos) < MAX_EXEMPLOS_INVALIDOS and valor not in resultado.exemplos_invalidos:
+                    resultado.exemplos_invalidos.append(valor)
+        if progresso:
+            progresso(resultado.linhas_lidas)
+    return resultado
@@ -0,0 +1,201 @@
+# /app/formulario_professores/services/midia_cache.py
+
+import base64
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import BinaryIO
+
+import boto3
+import ffmpeg
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# 3 MiB: múltiplo de 3, para que cada bloco vire base64 sem padding no meio do arquivo
+TAMANHO_BLOCO_BASE64 = 3 * 1024 * 1024
+ETAG_CACHE_TTL = 300
+
+
+@dataclass
+class MidiaPreparada:
+    """
+    Payload pronto para envio: arquivo (já aberto) com o conteúdo em Base64 + mimetype final.
+    Usar com 'with': o arquivo aberto continua legível mesmo se a entrada for removida do cache
+    por outra tarefa durante o upload, e é fechado ao final.
+    """
+    arquivo_base64: BinaryIO
+    mimetype: str
+    tamanho: int
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.arquivo_base64.close()
+
+
+def _diretorio_cache():
+    diretorio = getattr(settings, 'MIDIA_CACHE_DIR', None) or os.path.join(tempfile.gettempdir(), 'disparador_midia_cache')
+    os.makedirs(diretorio, exist_ok=True)
+    return diretorio
+
+
+def _obter_etag(midia, chave_s3):
+    """ETag do objeto no S3, guardado em cache para não fazer um HEAD a cada contato."""
+    cache_key = f"midia_etag_{midia.id}_{chave_s3}"
+    etag = cache.get(cache_key)
+    if etag is None:
+        resposta = boto3.client('s3').head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=chave_s3)
+        etag = resposta['ETag'].strip('"')
+        cache.set(cache_key, etag, ETAG_CACHE_TTL)
+    return etag
+
+
+def converter_audio_para_ogg(origem, destino):
+    """Converte o áudio para OGG/Opus, o formato de nota de voz do WhatsApp."""
+    ffmpeg.input(origem).output(
+        destino,
+        acodec='libopus',       # Codec do WhatsApp
+        format='ogg',           # Formato do WhatsApp
+        audio_bitrate='16k'     # Taxa de bits comum para áudio de voz
+    ).run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
+
+
+def codificar_base64_em_blocos(origem, destino):
+    """Grava 'origem' codificado em Base64 em 'destino' sem carregar o arquivo inteiro na memória."""
+    with open(origem, 'rb') as entrada, open(destino, 'wb') as saida:
+        while bloco := entrada.read(TAMANHO_BLOCO_BASE64):
+            saida.write(base64.b64encode(bloco))
+
+
+def _preparar(midia, chave_s3, codec_alvo, caminho_base64, caminho_meta):
+    """Baixa do S3, converte (se necessário) e codifica; grava de forma atômica no cache."""
+    mimetype = 'audio/ogg' if codec_alvo == 'ogg-opus-pronto' else (midia.mimetype or 'application/octet-stream')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        original_file_path = os.path.join(temp_dir, 'original')
+        boto3.client('s3').download_file(settings.AWS_STORAGE_BUCKET_NAME, chave_s3, original_file_path)
+
+        file_to_encode_path = original_file_path
+        if codec_alvo == 'ogg-opus':
+            # Áudios ainda sem a versão gerada no upload são convertidos aqui (uma vez por worker)
+            converted_file_path = os.path.join(temp_dir, "audio.ogg")
+            try:
+                converter_audio_para_ogg(original_file_path, converted_file_path)
+                file_to_encode_path = converted_file_path
+                mimetype = 'audio/ogg'
+            except ffmpeg.Error as e:
+                # Continua com o arquivo original se a conversão falhar
+                logger.error(f"[MidiaCache] Erro do FFmpeg ao converter a mídia {midia.id}: {e.stderr.decode()}")
+
+        temporario = f"{caminho_base64}.tmp"
+        codificar_base64_em_blocos(file_to_encode_path, temporario)
+        with open(caminho_meta, 'w') as f:
+            json.dump({'mimetype': mimetype}, f)
+        os.replace(temporario, caminho_base64)
+
+
+@contextmanager
+def _travar(caminho_lock, bloquear=True):
+    """
+    flock exclusivo no arquivo de lock da entrada. Gera False (sem lock) se 'bloquear' é False e outra tarefa o detém.
+    Como a remoção de uma entrada apaga o .lock, confere depois do flock se o arquivo travado ainda é o do caminho.
+    """
+    while True:
+        lock_file = open(caminho_lock, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if bloquear else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            yield False
+            return
+        try:
+            if os.path.exists(caminho_lock) and os.path.samestat(os.fstat(lock_file.fileno()), os.stat(caminho_lock)):
+                break
+        except FileNotFoundError:
+            pass
+        lock_file.close()  # O lock foi removido enquanto esperávamos: tenta de novo no arquivo novo
+    try:
+        yield True
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _remover_entrada(caminho_base64):
+    """Remove .b64, .json e .lock da entrada, se nenhuma outra tarefa a estiver preparando. Retorna se removeu."""
+    base = caminho_base64[:-len('.b64')]
+    with _travar(f"{base}.lock", bloquear=False) as travado:
+        if not travado:
+            return False
+        # Tarefas que já abriram o .b64 continuam lendo o arquivo normalmente depois do unlink
+        for caminho in (caminho_base64, f"{base}.json", f"{base}.lock"):
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+    return True
+
+
+def _aplicar_limite_tamanho(diretorio, preservar):
+    """Remove as entradas menos usadas recentemente (mtime) até caber no limite configurado."""
+    limite = getattr(settings, 'MIDIA_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+    entradas = []
+    for nome in os.listdir(diretorio):
+        if not nome.endswith('.b64'):
+            continue
+        caminho = os.path.join(diretorio, nome)
+        try:
+            info = os.stat(caminho)
+        except FileNotFoundError:
+            continue
+        entradas.append((info.st_mtime, info.st_size, caminho))
+
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    for _, tamanho, caminho in sorted(entradas):
+        if total <= limite:
+            break
+        if caminho == preservar or not _remover_entrada(caminho):
+            continue
+        total -= tamanho
+        logger.info(f"[MidiaCache] Entrada removida por limite de tamanho: {os.path.basename(caminho)}")
+
+
+def obter_midia_preparada(midia):
+    """
+    Retorna o payload pronto da mídia, preparando-o uma única vez por (Midia.id, ETag, codec).
+    Áudios com a versão OGG já gerada no upload são apenas baixados e codificados, sem FFmpeg.
+    O cache fica em disco local e é compartilhado entre as tarefas do mesmo worker;
+    um lock de arquivo garante que só uma tarefa prepara cada entrada. O arquivo volta aberto: use com 'with'.
+    """
+    if midia.audio_pronto:
+        chave_s3, codec_alvo = midia.arquivo_ogg.name, 'ogg-opus-pronto'
+    else:
+        chave_s3, codec_alvo = midia.arquivo.name, ('ogg-opus' if midia.tipo == 'audio' else 'original')
+    etag = _obter_etag(midia, chave_s3)
+    chave = hashlib.sha256(f"{midia.id}:{etag}:{codec_alvo}".encode()).hexdigest()[:32]
+
+    diretorio = _diretorio_cache()
+    caminho_base64 = os.path.join(diretorio, f"{chave}.b64")
+    caminho_meta = os.path.join(diretorio, f"{chave}.json")
+
+    with _travar(os.path.join(diretorio, f"{chave}.lock")):
+        if os.path.exists(caminho_base64):
+            os.utime(caminho_base64)  # Marca como usado recentemente (LRU)
+            logger.info(f"[MidiaCache] Hit para a mídia {midia.id} ({codec_alvo}).")
+        else:
+            logger.info(f"[MidiaCache] Miss para a mídia {midia.id} ({codec_alvo}). Preparando payload.")
+            _preparar(midia, chave_s3, codec_alvo, caminho_base64, caminho_meta)
+            _aplicar_limite_tamanho(diretorio, preservar=caminho_base64)
+
+        with open(caminho_meta) as f:
+            mimetype = json.load(f)['mimetype']
+        # Aberto ainda com o lock: nenhuma remoção por limite de tamanho acontece entre a checagem e a abertura
+        arquivo_base64 = open(caminho_base64, 'rb')
+        return MidiaPreparada(arquivo_base64, mimetype, os.fstat(arquivo_base64.fileno()).st_size)
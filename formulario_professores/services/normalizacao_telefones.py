@@ -0,0 +1,124 @@
+# /app/formulario_professores/services/normalizacao_telefones.py
+
+import re
+
+import numpy as np
+import pandas as pd
+
+# Motivos de rejeição ('' = número válido)
+MOTIVO_VAZIO = "vazio"
+MOTIVO_POUCOS_DIGITOS = "poucos_digitos"
+MOTIVO_NAO_BRASILEIRO = "nao_brasileiro"
+MOTIVO_DIGITOS_DEMAIS = "digitos_demais"
+
+# bytes.translate: remove tudo que não for dígito ASCII, '+' ou o separador de linhas
+_SEPARADOR = b'\n'
+_BYTES_REMOVIDOS = bytes(c for c in range(256) if c not in b'0123456789+\n')
+
+
+def formatar_numero_telefone(numero_str):
+    """Versão escalar (um número por vez): normaliza para +55DDDNÚMERO ou retorna None."""
+    if not numero_str: return None
+    numero_limpo = re.sub(r'[^\d+]', '', str(numero_str).strip())
+    if numero_limpo.startswith('+55') and (13 <= len(numero_limpo) <= 14): return numero_limpo
+    if numero_limpo.startswith('55') and (12 <= len(numero_limpo) <= 13): return f"+{numero_limpo}"
+    apenas_digitos_internos = re.sub(r'\D', '', numero_limpo)
+    if 10 <= len(apenas_digitos_internos) <= 11: return f"+55{apenas_digitos_internos}"
+    return None
+
+
+def _como_texto(valor):
+    """Células numéricas viram texto sem o '.0' (11988887777.0 -> '11988887777'); vazios viram ''."""
+    if valor is None or (isinstance(valor, float) and np.isnan(valor)):
+        return ''
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _como_lista_de_textos(valores):
+    if isinstance(valores, (pd.Series, np.ndarray)):
+        valores = valores.tolist()
+    if all(type(valor) is str for valor in valores):
+        return valores
+    return [_como_texto(valor) for valor in valores]
+
+
+def _limpar_em_bloco(textos):
+    """
+    Aplica o equivalente a re.sub(r'[^\\d+]', '', ...) ao lote inteiro com uma única chamada de bytes.translate
+    sobre os valores concatenados, e devolve um array de bytes (dtype 'S') alinhado à entrada.
+    """
+    bloco = '\n'.join(textos).encode('utf-8', 'ignore')
+    partes = bloco.translate(None, _BYTES_REMOVIDOS).split(_SEPARADOR)
+    if len(partes) != len(textos):
+        # Algum valor tinha quebra de linha: refaz trocando-as por espaço
+        return _limpar_em_bloco([texto.replace('\n', ' ') for texto in textos])
+    return np.array(partes, dtype=bytes)
+
+
+def _sem_mais(limpos):
+    # np.strings.replace não aceita array vazio
+    return np.strings.replace(limpos, b'+', b'') if limpos.size else limpos
+
+
+def _resultado(numeros, motivos):
+    # dtype object explícito: mantém None (e não NaN) nos números rejeitados
+    return pd.DataFrame({'numero': pd.Series(numeros, dtype=object), 'motivo': pd.Series(motivos, dtype=object)})
+
+
+def normalizar_telefones(valores):
+    """
+    Normaliza um lote de números (lista, array ou Series) para o formato E.164 brasileiro (+55DDDNÚMERO).
+
+    Retorna um DataFrame alinhado à entrada com as colunas:
+      - 'numero': número normalizado ou None;
+      - 'motivo': '' se válido, senão vazio / poucos_digitos / nao_brasileiro / digitos_demais.
+
+    Segue as regras de formatar_numero_telefone, mas a limpeza é feita para o lote inteiro de uma vez e
+    as regras viram operações vetorizadas do numpy (np.strings) sobre o array, sem laço Python por número.
+    As duas versões só dão o mesmo resultado para entrada em texto com dígitos ASCII: aqui células float
+    perdem o '.0' (a escalar o trataria como mais um dígito) e dígitos de outros alfabetos são descartados.
+    """
+    textos = _como_lista_de_textos(valores)
+    total = len(textos)
+    numeros = np.full(total, None, dtype=object)
+    motivos = np.full(total, '', dtype=object)
+    if total == 0:
+        return _resultado(numeros, motivos)
+
+    limpo = _limpar_em_bloco(textos)
+    tamanho_limpo = np.strings.str_len(limpo)
+    quantidade_digitos = tamanho_limpo - np.strings.count(limpo, b'+')
+    comeca_mais_55 = np.strings.startswith(limpo, b'+55')
+    comeca_55 = np.strings.startswith(limpo, b'55')
+
+    # Mesmas três regras da versão escalar, na mesma ordem de prioridade
+    regra_mais_55 = comeca_mais_55 & (tamanho_limpo >= 13) & (tamanho_limpo <= 14)
+    regra_55 = ~regra_mais_55 & comeca_55 & (tamanho_limpo >= 12) & (tamanho_limpo <= 13)
+    regra_ddd = ~regra_mais_55 & ~regra_55 & (quantidade_digitos >= 10) & (quantidade_digitos <= 11)
+
+    normalizados = np.zeros(total, dtype='S16')
+    normalizados[regra_mais_55] = limpo[regra_mais_55]
+    normalizados[regra_55] = np.strings.add(b'+', limpo[regra_55])
+    normalizados[regra_ddd] = np.strings.add(b'+55', _sem_mais(limpo[regra_ddd]))
+    validos = regra_mais_55 | regra_55 | regra_ddd
+    numeros[validos] = normalizados[validos].astype(str).astype(object)
+
+    invalidos = ~validos
+    so_digitos_55 = np.strings.startswith(_sem_mais(limpo[invalidos]), b'55')
+    motivos[invalidos] = np.select(
+        [quantidade_digitos[invalidos] < 10, ~so_digitos_55],
+        [MOTIVO_POUCOS_DIGITOS, MOTIVO_NAO_BRASILEIRO],
+        default=MOTIVO_DIGITOS_DEMAIS,
+    )
+    # Sem nenhum dígito: só é "vazio" se a célula estava de fato em branco (ou era 'nan'/'none')
+    for indice in np.flatnonzero(tamanho_limpo == 0):
+        if textos[indice].strip().lower() in ('', 'nan', 'none'):
+            motivos[indice] = MOTIVO_VAZIO
+    return _resultado(numeros, motivos)
+
+
+def normalizar_telefone(valor):
+    """Atalho para um único número: o normalizado ou None."""
+    return normalizar_telefones([valor])['numero'].iloc[0]
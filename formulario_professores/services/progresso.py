@@ -0,0 +1,85 @@
+# /app/formulario_professores/services/progresso.py
+
+import asyncio
+import json
+import logging
+import weakref
+import redis
+import redis.asyncio as redis_async
+from django.conf import settings
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+# Cada publicação também grava o último estado (progresso:ultimo:<canal>), entregue logo na conexão
+# para quem abrir o stream no meio da tarefa.
+ULTIMO_TTL = 60 * 60
+ESTADOS_FINAIS = ("SUCCESS", "FAILURE")
+
+# Um cliente (pool de conexões) por event loop: no uvicorn é um só por processo; sob WSGI cada request tem o seu loop
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def canal_exportacao(task_id):
+    return f"progresso:exportacao:{task_id}"
+
+
+def canal_status_instancia(instancia_id):
+    return f"progresso:status_instancia:{instancia_id}"
+
+
+def _chave_ultimo(canal):
+    return f"progresso:ultimo:{canal}"
+
+
+def publicar(canal, dados):
+    """Grava o último estado e avisa quem estiver ouvindo o canal. Nunca derruba a tarefa que publica."""
+    mensagem = json.dumps(dados, default=str)
+    try:
+        with get_redis_connection("default").pipeline(transaction=False) as pipe:
+            pipe.set(_chave_ultimo(canal), mensagem, ex=ULTIMO_TTL)
+            pipe.publish(canal, mensagem)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"[Progresso] Não foi possível publicar em '{canal}': {e}")
+
+
+def cliente_async():
+    """Cliente redis.asyncio no mesmo banco do cache, compartilhado pelas conexões de stream do event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _clientes_async:
+        _clientes_async[loop] = redis_async.from_url(settings.CACHES['default']['LOCATION'])
+    return _clientes_async[loop]
+
+
+async def acompanhar(canal, tempo_maximo, intervalo_keepalive=15):
+    """
+    Gera os eventos (dict) do canal: primeiro o último estado conhecido, depois cada publicação,
+    até um estado final ou 'tempo_maximo' segundos. Gera None a cada 'intervalo_keepalive' sem novidades.
+    """
+    cliente = cliente_async()
+    assinatura = cliente.pubsub()
+    # Assina antes de ler o último estado: nada publicado entre as duas operações se perde
+    await assinatura.subscribe(canal)
+    try:
+        ultimo = await cliente.get(_chave_ultimo(canal))
+        if ultimo:
+            dados = json.loads(ultimo)
+            yield dados
+            if dados.get('state') in ESTADOS_FINAIS:
+                return
+        loop = asyncio.get_running_loop()
+        limite = loop.time() + tempo_maximo
+        while loop.time() < limite:
+            mensagem = await assinatura.get_message(ignore_subscribe_messages=True, timeout=intervalo_keepalive)
+            if mensagem is None:
+                yield None
+                continue
+            dados = json.loads(mensagem['data'])
+            yield dados
+            if dados.get('state') in ESTADOS_FINAIS:
+                return
+    finally:
+        await assinatura.unsubscribe(canal)
+        # aclose() no redis-py 5+; no 4.x o equivalente é close()
+        await (assinatura.aclose() if hasattr(assinatura, 'aclose') else assinatura.close())
@@ -0,0 +1,102 @@
+# /app/formulario_professores/services/rate_limiter.py
+
+import logging
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+TAXA_ENVIO_CACHE_TTL = 60
+ENVIOS_POR_MINUTO_PADRAO = 20
+RAJADA_ENVIOS_PADRAO = 5
+
+# Token bucket atômico no Redis. Usa o relógio do próprio Redis (TIME) para que
+# workers em máquinas diferentes compartilhem o mesmo balde sem depender dos seus relógios.
+# Retorna 0 quando um token foi consumido, ou quantos segundos faltam para haver um token.
+_SCRIPT_TOKEN_BUCKET = """
+local taxa = tonumber(ARGV[1])
+local capacidade = tonumber(ARGV[2])
+local tempo = redis.call('TIME')
+local agora = tonumber(tempo[1]) + tonumber(tempo[2]) / 1000000
+local dados = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(dados[1]) or capacidade
+local ts = tonumber(dados[2]) or agora
+tokens = math.min(capacidade, tokens + math.max(0, agora - ts) * taxa)
+local espera = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    espera = (1 - tokens) / taxa
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', agora)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidade / taxa) + 60)
+return tostring(espera)
+"""
+_script = None
+
+
+def _get_script():
+    global _script
+    if _script is None:
+        _script = get_redis_connection("default").register_script(_SCRIPT_TOKEN_BUCKET)
+    return _script
+
+
+def obter_taxa_envio(usuario_id):
+    """(envios_por_minuto, rajada) configurados no UserMessageLimit do usuário, com cache curto."""
+    from ..models import UserMessageLimit
+
+    cache_key = f"taxa_envio_{usuario_id}"
+    taxa = cache.get(cache_key)
+    if taxa is None:
+        limite = UserMessageLimit.objects.filter(user_id=usuario_id).only('envios_por_minuto', 'rajada_envios').first()
+        taxa = (
+            (limite.envios_por_minuto, limite.rajada_envios) if limite
+            else (ENVIOS_POR_MINUTO_PADRAO, RAJADA_ENVIOS_PADRAO)
+        )
+        cache.set(cache_key, taxa, TAXA_ENVIO_CACHE_TTL)
+    return taxa
+
+
+def adquirir_token(nome_instancia, envios_por_minuto, rajada):
+    """
+    Tenta consumir um token do balde da instância.
+    Retorna 0.0 se o envio pode acontecer agora, senão os segundos até o próximo token.
+    """
+    taxa_por_segundo = max(envios_por_minuto, 1) / 60.0
+    espera = _get_script()(keys=[f"token_bucket:{nome_instancia}"], args=[taxa_por_segundo, max(rajada, 1)])
+    return float(espera)
+
+
+# Semáforo de requisições em voo por instância, compartilhado por todos os workers e lotes.
+# Cada vaga é um membro de um sorted set com o instante em que expira (relógio do Redis): a vaga de
+# um worker que morreu no meio da chamada volta sozinha depois de VAGA_TTL segundos.
+VAGA_TTL = 90
+_SCRIPT_VAGA = """
+local tempo = redis.call('TIME')
+local agora = tonumber(tempo[1]) + tonumber(tempo[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', agora)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], agora + tonumber(ARGV[3]), ARGV[2])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) + 60)
+return 1
+"""
+_script_vaga = None
+
+
+def _chave_vagas(nome_instancia):
+    return f"requisicoes_em_voo:{nome_instancia}"
+
+
+def adquirir_vaga(nome_instancia, limite, token):
+    """Ocupa uma das 'limite' vagas de requisição em voo da instância. Retorna False se todas estão ocupadas."""
+    global _script_vaga
+    if _script_vaga is None:
+        _script_vaga = get_redis_connection("default").register_script(_SCRIPT_VAGA)
+    return bool(_script_vaga(keys=[_chave_vagas(nome_instancia)], args=[max(limite, 1), token, VAGA_TTL]))
+
+
+def liberar_vaga(nome_instancia, token):
+    get_redis_connection("default").zrem(_chave_vagas(nome_instancia), token)
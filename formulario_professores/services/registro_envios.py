@@ -0,0 +1,125 @@
+# /app/formulario_professores/services/registro_envios.py
+
+import json
+import logging
+import re
+import uuid
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_redis import get_redis_connection
+from .webhook_evolution import avancar_estado, estados_pendentes, remover_estados_pendentes
+
+logger = logging.getLogger(__name__)
+
+# As tarefas de envio só fazem um RPUSH; a gravação no banco acontece em lote (gravar_resultados_pendentes)
+FILA_RESULTADOS = "envio_contato:resultados"
+LOTE_GRAVACAO = 1000
+_CAMPOS_REGISTRO = {
+    'mensagem_id', 'id_campanha', 'parte', 'contato', 'estado', 'tentativas',
+    'latencia_ms', 'message_key', 'erro', 'atualizado_em',
+}
+
+_PADRAO_ENVIO_LOG_ID = re.compile(r"^msg(?P<mensagem_id>\d+)-camp(?P<id_campanha>[0-9a-f-]{36})-cont(?P<indice>\d+)-(?P<parte>txt|btn|mid)$")
+
+
+def interpretar_envio_log_id(envio_log_id):
+    """'msg{id}-camp{uuid}-cont{idx}-{parte}' -> dict com os campos, ou None se o formato não bater."""
+    correspondencia = _PADRAO_ENVIO_LOG_ID.match(envio_log_id or '')
+    return correspondencia.groupdict() if correspondencia else None
+
+
+def registrar_resultado(envio_log_id, contato, resultado_api, latencia_ms, tentativas=1):
+    """Enfileira no Redis o resultado de um envio para gravação posterior em EnvioContato."""
+    campos = interpretar_envio_log_id(envio_log_id)
+    if not campos:
+        return
+    falhou = "error" in resultado_api or resultado_api.get("status") == "error"
+    chave = resultado_api.get('key') if isinstance(resultado_api.get('key'), dict) else {}
+    registro = {
+        'mensagem_id': int(campos['mensagem_id']),
+        'id_campanha': campos['id_campanha'],
+        'parte': campos['parte'],
+        'contato': contato,
+        'estado': 'falha' if falhou else 'enviado',
+        'tentativas': tentativas,
+        'latencia_ms': latencia_ms,
+        'message_key': chave.get('id', ''),
+        'erro': str(resultado_api.get('message', ''))[:255] if falhou else '',
+        'atualizado_em': timezone.now().isoformat(),
+    }
+    try:
+        get_redis_connection("default").rpush(FILA_RESULTADOS, json.dumps(registro))
+    except Exception as e:
+        # O registro é apenas observabilidade: nunca deve derrubar o envio
+        logger.warning(f"[RegistroEnvios] Não foi possível enfileirar o resultado de {envio_log_id}: {e}")
+
+
+def _ler_registro(bruto):
+    """JSON da fila -> dict validado, ou None se a entrada estiver corrompida (ela é descartada, não trava o lote)."""
+    try:
+        dados = json.loads(bruto)
+        if not isinstance(dados, dict) or _CAMPOS_REGISTRO - dados.keys():
+            raise ValueError("campos ausentes")
+        dados['id_campanha'] = str(uuid.UUID(dados['id_campanha']))
+        dados['atualizado_em'] = parse_datetime(dados['atualizado_em'])
+    except (ValueError, TypeError) as e:
+        logger.warning(f"[RegistroEnvios] Resultado ignorado (entrada inválida: {e}): {bruto[:200]!r}")
+        return None
+    return dados
+
+
+def gravar_resultados_pendentes(limite=LOTE_GRAVACAO):
+    """
+    Grava até 'limite' resultados da fila com um único upsert. Retorna quantos foram lidos da fila.
+    Os resultados só saem do Redis depois do commit; só uma execução por vez (ver tarefa gravar_resultados_envio).
+    """
+    from ..models import EnvioContato, Mensagem
+
+    conexao = get_redis_connection("default")
+    brutos = conexao.lrange(FILA_RESULTADOS, 0, limite - 1)
+    if not brutos:
+        return 0
+
+    # Um mesmo (campanha, contato, parte) pode aparecer mais de uma vez no lote: vale o último
+    registros = {}
+    for bruto in brutos:
+        dados = _ler_registro(bruto)
+        if dados:
+            registros[(dados['id_campanha'], dados['contato'], dados['parte'])] = dados
+
+    mensagens_existentes = set(
+        Mensagem.objects.filter(id__in={dados['mensagem_id'] for dados in registros.values()}).values_list('id', flat=True)
+    )
+    envios = [
+        EnvioContato(
+            id_campanha=uuid.UUID(dados['id_campanha']),
+            mensagem_id=dados['mensagem_id'] if dados['mensagem_id'] in mensagens_existentes else None,
+            contato=dados['contato'],
+            parte=dados['parte'],
+            estado=dados['estado'],
+            tentativas=dados['tentativas'],
+            latencia_ms=dados['latencia_ms'],
+            message_key=dados['message_key'],
+            erro=dados['erro'],
+            atualizado_em=dados['atualizado_em'],
+        )
+        for dados in registros.values()
+    ]
+    # Status de entrega (webhook) que chegaram antes do próprio envio ser gravado
+    entregas = estados_pendentes([envio.message_key for envio in envios])
+    for envio in envios:
+        if envio.message_key in entregas:
+            envio.estado = avancar_estado(envio.estado, entregas[envio.message_key])
+    with transaction.atomic():
+        EnvioContato.objects.bulk_create(
+            envios,
+            update_conflicts=True,
+            unique_fields=['id_campanha', 'contato', 'parte'],
+            update_fields=['estado', 'tentativas', 'latencia_ms', 'message_key', 'erro', 'atualizado_em'],
+        )
+    # Só depois do commit: se o upsert falhar (ou o worker morrer antes), o lote continua na fila.
+    # Quem publica só faz RPUSH no fim da lista, então o início ainda é exatamente o lote lido.
+    conexao.ltrim(FILA_RESULTADOS, len(brutos), -1)
+    remover_estados_pendentes(entregas)
+    return len(brutos)
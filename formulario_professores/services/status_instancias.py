@@ -0,0 +1,114 @@
+# /app/formulario_professores/services/status_instancias.py
+
+import asyncio
+import logging
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from . import progresso
+from ..repositories.evolutionAsyncRepository import AsyncEvolutionRepository
+
+logger = logging.getLogger(__name__)
+
+# Por quanto tempo depois de abrir a página de status o QR Code de uma instância desconectada é buscado
+INTERESSE_QRCODE_TTL = 5 * 60
+
+
+def chave_status(instancia_id):
+    return f"evolution_status_{instancia_id}"
+
+
+def _chave_interesse(instancia_id):
+    return f"evolution_status_qrcode_{instancia_id}"
+
+
+def status_em_cache(instancia_id):
+    """Último status gravado pelo poller ({'connected', 'qrcode', 'raw_data', 'timestamp'}) ou None."""
+    return cache.get(chave_status(instancia_id))
+
+
+def registrar_interesse_qrcode(instancia_id):
+    """A página de status foi aberta: o poller passa a trazer o QR Code enquanto a instância estiver desconectada."""
+    cache.set(_chave_interesse(instancia_id), True, INTERESSE_QRCODE_TTL)
+
+
+async def _consultar(repo, instancia, quer_qrcode, semaforo):
+    async with semaforo:
+        status_data = await repo.get_status(instancia.nome_instancia)
+        if "error" in status_data:
+            # API fora ou circuito aberto: mantém o último estado conhecido
+            return {'connected': instancia.conectado, 'qrcode': None, 'raw_data': status_data, 'erro': True}
+        conectado = status_data.get('instance', {}).get('state') == 'open'
+        qrcode = None
+        if not conectado and quer_qrcode:
+            qrcode = (await repo.get_qrcode(instancia.nome_instancia)).get('base64')
+        return {'connected': conectado, 'qrcode': qrcode, 'raw_data': status_data, 'erro': False}
+
+
+async def _consultar_todas(grupos, interesses):
+    """Uma sessão HTTP por (host, api_key); todas as instâncias consultadas ao mesmo tempo, com limite global."""
+    semaforo = asyncio.Semaphore(settings.STATUS_INSTANCIAS_CONCORRENCIA)
+
+    async def consultar_grupo(host, api_key, instancias):
+        async with AsyncEvolutionRepository(host, api_key, timeout=settings.STATUS_INSTANCIAS_TIMEOUT) as repo:
+            return await asyncio.gather(*(
+                _consultar(repo, instancia, interesses.get(_chave_interesse(instancia.id), False), semaforo)
+                for instancia in instancias
+            ))
+
+    por_grupo = await asyncio.gather(*(
+        consultar_grupo(host, api_key, instancias) for (host, api_key), instancias in grupos.items()
+    ))
+    return [
+        (instancia, status)
+        for instancias, resultados in zip(grupos.values(), por_grupo)
+        for instancia, status in zip(instancias, resultados)
+    ]
+
+
+def atualizar_status(instancias):
+    """
+    Consulta o estado de conexão das instâncias, grava em cache (lido pelas views) e em Instancia,
+    e publica as que mudaram. 'instancias' precisa vir com select_related('usuario__evolutionapisettings').
+    """
+    grupos = defaultdict(list)
+    for instancia in instancias:
+        api_settings = instancia.usuario.evolutionapisettings
+        grupos[(api_settings.api_host, api_settings.api_key)].append(instancia)
+    if not grupos:
+        return 0
+
+    interesses = cache.get_many([_chave_interesse(instancia.id) for grupo in grupos.values() for instancia in grupo])
+    resultados = asyncio.run(_consultar_todas(grupos, interesses))
+    mudancas = gravar_status(resultados)
+    logger.info(f"[StatusInstancias] {len(resultados)} instâncias consultadas, {len(mudancas)} mudaram de estado.")
+    return len(resultados)
+
+
+def gravar_status(resultados):
+    """
+    Grava [(instancia, status)] no cache lido pelas views e em Instancia, e publica as que mudaram de estado
+    no canal de progresso da instância (página de status, via SSE). Usado pelo poller e pelos webhooks da Evolution API.
+    """
+    agora = timezone.now()
+    em_cache = {}
+    alteradas = []
+    mudancas = []
+    for instancia, status in resultados:
+        status['timestamp'] = agora
+        em_cache[chave_status(instancia.id)] = status
+        if status.get('erro'):
+            continue
+        if instancia.conectado != status['connected']:
+            mudancas.append({'instancia_id': instancia.id, 'usuario_id': instancia.usuario_id, 'connected': status['connected']})
+        instancia.conectado = status['connected']
+        instancia.ultimo_status_check = agora
+        alteradas.append(instancia)
+
+    cache.set_many(em_cache, settings.STATUS_INSTANCIAS_TTL)
+    if alteradas:
+        type(alteradas[0]).objects.bulk_update(alteradas, ['conectado', 'ultimo_status_check'])
+    for mudanca in mudancas:
+        progresso.publicar(progresso.canal_status_instancia(mudanca['instancia_id']), mudanca)
+    return mudancas
@@ -0,0 +1,188 @@
+# /app/formulario_professores/services/webhook_evolution.py
+
+import hmac
+import json
+import logging
+from django.conf import settings
+from django.urls import reverse
+from django_redis import get_redis_connection
+from . import status_instancias
+from ..repositories.evolutionRepository import EvolutionRepository
+
+logger = logging.getLogger(__name__)
+
+# A view do webhook só faz um RPUSH do corpo bruto; os eventos são aplicados em lote (processar_eventos_pendentes)
+FILA_EVENTOS = "evolution_webhook:eventos"
+LOTE_EVENTOS = 1000
+# Status de entrega que chegaram antes de o envio ser gravado em EnvioContato (message_key -> estado)
+ENTREGAS_PENDENTES = "envio_contato:entregas_pendentes"
+ENTREGAS_PENDENTES_TTL = 24 * 3600
+
+EVENTOS = ["CONNECTION_UPDATE", "MESSAGES_UPDATE", "QRCODE_UPDATED"]
+
+# Status de mensagem da Evolution API (v2 em texto, v1 numérico) -> estado do EnvioContato
+_ESTADOS_ENTREGA = {
+    "DELIVERY_ACK": "entregue", 3: "entregue",
+    "READ": "lido", 4: "lido",
+    "PLAYED": "lido", 5: "lido",
+}
+# Um estado só avança: um 'entregue' atrasado não desfaz um 'lido'
+_ORDEM_ESTADOS = {"enviado": 0, "entregue": 1, "lido": 2}
+
+
+def webhooks_ativos():
+    return bool(settings.EVOLUTION_WEBHOOK_URL and settings.EVOLUTION_WEBHOOK_TOKEN)
+
+
+def token_valido(token):
+    return webhooks_ativos() and hmac.compare_digest(str(token), settings.EVOLUTION_WEBHOOK_TOKEN)
+
+
+def registrar_webhook(api_settings, instancia):
+    """Aponta o webhook da instância para este app. Retorna o resultado da API, ou None se os webhooks estão desligados."""
+    if not webhooks_ativos():
+        return None
+    url = settings.EVOLUTION_WEBHOOK_URL.rstrip('/') + reverse('webhook_evolution', args=[settings.EVOLUTION_WEBHOOK_TOKEN])
+    resultado = EvolutionRepository.configurar_webhook(
+        api_settings.api_host, api_settings.api_key, instancia.nome_instancia, url, EVENTOS
+    )
+    if "error" in resultado or resultado.get("status") == "error":
+        logger.error(f"[WebhookEvolution] Falha ao registrar o webhook de '{instancia.nome_instancia}': {resultado.get('message')}")
+    return resultado
+
+
+def enfileirar_evento(corpo):
+    """O(1) no request: guarda o corpo do webhook como veio."""
+    get_redis_connection("default").rpush(FILA_EVENTOS, corpo)
+
+
+def _nome_evento(evento):
+    # 'connection.update' (v2) e 'CONNECTION_UPDATE' (v1) viram o mesmo nome
+    return str(evento or '').upper().replace('.', '_')
+
+
+def _atualizacoes_mensagem(dados):
+    """(message_key, estado) de um MESSAGES_UPDATE, nos formatos v2 (objeto) e v1 (lista de updates)."""
+    for item in dados if isinstance(dados, list) else [dados]:
+        if not isinstance(item, dict):
+            continue
+        chave = item.get('keyId') or (item.get('key') or {}).get('id')
+        status = item.get('status', (item.get('update') or {}).get('status'))
+        estado = _ESTADOS_ENTREGA.get(status)
+        if chave and estado:
+            yield chave, estado
+
+
+def _aplicar_conexoes(conexoes, qrcodes):
+    """conexoes/qrcodes: {nome_instancia: estado / base64}, já reduzidos ao último evento do lote."""
+    from ..models import Instancia
+
+    resultados = []
+    for instancia in Instancia.objects.filter(nome_instancia__in=set(conexoes) | set(qrcodes)):
+        status_anterior = status_instancias.status_em_cache(instancia.id) or {}
+        if instancia.nome_instancia in conexoes:
+            conectado = conexoes[instancia.nome_instancia] == 'open'
+        else:
+            conectado = instancia.conectado
+        resultados.append((instancia, {
+            'connected': conectado,
+            'qrcode': None if conectado else qrcodes.get(instancia.nome_instancia, status_anterior.get('qrcode')),
+            'raw_data': {'instance': {'instanceName': instancia.nome_instancia, 'state': conexoes.get(instancia.nome_instancia)}},
+            'erro': False,
+        }))
+    status_instancias.gravar_status(resultados)
+    return len(resultados)
+
+
+def _aplicar_entregas(entregas):
+    """entregas: {message_key: estado}. Atualiza EnvioContato; o que ainda não foi gravado fica pendente no Redis."""
+    from ..models import EnvioContato
+
+    if not entregas:
+        return 0
+    atualizados = 0
+    encontrados = set()
+    for estado in ('entregue', 'lido'):
+        chaves = [chave for chave, novo in entregas.items() if novo == estado]
+        if not chaves:
+            continue
+        encontrados.update(EnvioContato.objects.filter(message_key__in=chaves).values_list('message_key', flat=True))
+        anteriores = [atual for atual, ordem in _ORDEM_ESTADOS.items() if ordem < _ORDEM_ESTADOS[estado]]
+        atualizados += EnvioContato.objects.filter(message_key__in=chaves, estado__in=anteriores).update(estado=estado)
+
+    pendentes = {chave: estado for chave, estado in entregas.items() if chave not in encontrados}
+    if pendentes:
+        conexao = get_redis_connection("default")
+        with conexao.pipeline() as pipe:
+            pipe.hset(ENTREGAS_PENDENTES, mapping=pendentes)
+            pipe.expire(ENTREGAS_PENDENTES, ENTREGAS_PENDENTES_TTL)
+            pipe.execute()
+    return atualizados
+
+
+def estados_pendentes(message_keys):
+    """Status de entrega que chegaram antes dos envios 'message_keys' serem gravados (ver remover_estados_pendentes)."""
+    message_keys = [chave for chave in message_keys if chave]
+    if not message_keys:
+        return {}
+    valores = get_redis_connection("default").hmget(ENTREGAS_PENDENTES, message_keys)
+    return {chave: valor.decode() for chave, valor in zip(message_keys, valores) if valor}
+
+
+def remover_estados_pendentes(message_keys):
+    """Apaga os status pendentes já aplicados, depois que os envios foram gravados."""
+    message_keys = [chave for chave in message_keys if chave]
+    if message_keys:
+        get_redis_connection("default").hdel(ENTREGAS_PENDENTES, *message_keys)
+
+
+def avancar_estado(atual, novo):
+    """Estado de um envio que recebeu o status de entrega 'novo': só avança, e uma falha continua falha."""
+    if atual == 'falha' or _ORDEM_ESTADOS.get(novo, 0) <= _ORDEM_ESTADOS.get(atual, 0):
+        return atual
+    return novo
+
+
+def processar_eventos_pendentes(limite=LOTE_EVENTOS):
+    """
+    Aplica até 'limite' eventos da fila, cada tipo com poucas queries. Retorna quantos foram lidos.
+    Os eventos só saem do Redis depois de aplicados; só uma execução por vez (ver tarefa processar_webhooks_evolution).
+    """
+    conexao = get_redis_connection("default")
+    brutos = conexao.lrange(FILA_EVENTOS, 0, limite - 1)
+    if not brutos:
+        return 0
+
+    conexoes, qrcodes, entregas = {}, {}, {}
+    for bruto in brutos:
+        try:
+            evento = json.loads(bruto)
+        except ValueError:
+            logger.warning(f"[WebhookEvolution] Evento ignorado (JSON inválido): {bruto[:200]!r}")
+            continue
+        if not isinstance(evento, dict):
+            continue
+        nome = _nome_evento(evento.get('event'))
+        instancia = evento.get('instance')
+        dados = evento.get('data') or {}
+        if nome == 'CONNECTION_UPDATE' and instancia and isinstance(dados, dict) and dados.get('state'):
+            conexoes[instancia] = dados['state']
+        elif nome == 'QRCODE_UPDATED' and instancia and isinstance(dados, dict):
+            qrcode = (dados.get('qrcode') or {}).get('base64')
+            if qrcode:
+                qrcodes[instancia] = qrcode
+        elif nome == 'MESSAGES_UPDATE':
+            for chave, estado in _atualizacoes_mensagem(dados):
+                entregas[chave] = avancar_estado(entregas.get(chave), estado)
+
+    if conexoes or qrcodes:
+        _aplicar_conexoes(conexoes, qrcodes)
+    atualizados = _aplicar_entregas(entregas)
+    # Se algo acima falhar, o lote continua na fila para a próxima execução (aplicar de novo é idempotente).
+    # A view só faz RPUSH no fim da lista, então o início ainda é exatamente o lote lido.
+    conexao.ltrim(FILA_EVENTOS, len(brutos), -1)
+    logger.info(
+        f"[WebhookEvolution] {len(brutos)} eventos: {len(conexoes)} conexões, {len(qrcodes)} QR Codes, "
+        f"{len(entregas)} status de entrega ({atualizados} envios atualizados)."
+    )
+    return len(brutos)
@@ -1,26 +1,58 @@
 # /app/formulario_professores/tasks.py
 
 import logging
-from celery import shared_task
+from celery import shared_task, current_app
 from django.utils import timezone
 from django.core.cache import cache
+from django.db import InterfaceError, OperationalError
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
 from django.contrib.auth.models import User
 import os
-import boto3
 import tempfile
-import base64
-from botocore.exceptions import ClientError
+import boto3
 import ffmpeg
+from botocore.exceptions import BotoCoreError, ClientError
+from django.core.files import File
 from django.conf import settings as django_settings
-from .models import Mensagem, EvolutionAPISettings, UserMessageLimit, Enviadas, Midia, Instancia
+from .models import Mensagem, ListaContatos, DisparoAgendado, EvolutionAPISettings, UserMessageLimit, Enviadas, EnviadasDiario, Midia, Instancia
 from .repositories.evolutionRepository import EvolutionRepository
-import pandas as pd 
-from django.core.files.base import ContentFile 
+from .repositories.evolutionAsyncRepository import AsyncEvolutionRepository
+from .services.midia_cache import obter_midia_preparada, converter_audio_para_ogg
+from .services.rate_limiter import adquirir_token, obter_taxa_envio, adquirir_vaga, liberar_vaga
+from .services import cota_diaria, idempotencia_envio, circuit_breaker, status_instancias, webhook_evolution, progresso
+from .services.registro_envios import registrar_resultado, gravar_resultados_pendentes
+from .services.importador_contatos import importar_contatos, primeira_coluna
+from .services.normalizacao_telefones import normalizar_telefones
+from storages.backends.s3boto3 import S3Boto3Storage
+from itertools import chain
+import uuid
+from openpyxl import Workbook
 import time
 import random
+import asyncio
+import contextlib
+from datetime import date, datetime, timedelta
 
 logger = logging.getLogger(__name__)
 VERIFICAR_DISPAROS_LOCK_EXPIRE = 50
+GRAVACAO_LOCK_EXPIRE = 5 * 60  # Drenagem das filas de resultados/webhooks: lock de uma execução por vez
+LIMITE_DIARIO_PADRAO = 65
+LOTE_ENVIO_ASSINCRONO = getattr(django_settings, 'EVOLUTION_ASYNC_LOTE', 200)
+LOTE_DURACAO_MAXIMA = getattr(django_settings, 'EVOLUTION_ASYNC_LOTE_DURACAO', 120)  # Segundos de agenda por lote
+VAGA_ESPERA = 0.05  # Intervalo entre tentativas de ocupar uma vaga do semáforo da instância
+ENVIADAS_LOTE_EXCLUSAO = 5000
+EXPORTACAO_TTL = 10 * 60  # Prazo para baixar a planilha exportada
+# Sem notícia por mais que isso a importação é dada como perdida; maior que o visibility_timeout do broker (1h),
+# para que a reentrega de uma tarefa interrompida tenha a chance de terminar antes
+IMPORTACAO_PRAZO = 90 * 60
+EXPORTACAO_CONCORRENCIA = 5  # Chamadas simultâneas a group/participants por exportação
+EXPORTACAO_PROGRESSO_INTERVALO = 1.0  # Segundos mínimos entre duas atualizações de progresso
+ESPERA_MAXIMA_EM_PROCESSO = 2  # Acima disso a tarefa é reagendada em vez de segurar o worker
+RETENTATIVA_ATRASO_MAXIMO = 600
+LOTE_RETENTATIVAS = 3
+LOTE_RETENTATIVA_ATRASO_BASE = 15
+CIRCUITO_JITTER = 10  # Espalha as tarefas reagendadas para não baterem juntas quando o circuito fechar
 
 def get_api_credentials(usuario_id: int):
     """Busca as credenciais da API e a instância para um dado usuário a partir da base de dados."""
@@ -33,14 +65,123 @@ def get_api_credentials(usuario_id: int):
         return None, None
 
 
+def reagendar_envio(task, countdown):
+    """Publica a mesma tarefa novamente com atraso, sem consumir as retentativas da original."""
+    task.apply_async(args=task.request.args, kwargs=task.request.kwargs, countdown=countdown)
+
+
+def aguardar_vez_de_envio(task, instancia, usuario_id, envio_log_id):
+    """
+    Consome um token do balde da instância antes da chamada à API.
+    Esperas curtas são feitas no próprio processo; longas reagendam a tarefa e retornam False.
+    """
+    envios_por_minuto, rajada = obter_taxa_envio(usuario_id)
+    while True:
+        espera = adquirir_token(instancia.nome_instancia, envios_por_minuto, rajada)
+        if espera <= 0:
+            return True
+        if espera > ESPERA_MAXIMA_EM_PROCESSO:
+            logger.info(f"[RateLimit ID: {envio_log_id}] Instância '{instancia.nome_instancia}' sem tokens. Reagendando em {espera:.1f}s.")
+            reagendar_envio(task, countdown=espera)
+            return False
+        time.sleep(espera)
+
+
+def reagendar_por_circuito(task, rotulo, envio_log_id, espera):
+    countdown = espera + random.uniform(0, CIRCUITO_JITTER)
+    logger.warning(f"[{rotulo} ID: {envio_log_id}] Evolution API indisponível (circuito aberto). Reagendando em {countdown:.1f}s.")
+    reagendar_envio(task, countdown=countdown)
+
+
+def circuito_disponivel(task, rotulo, api_host, envio_log_id):
+    """Com o circuito do host aberto a tarefa é reagendada logo, sem consumir token nem esperar timeout."""
+    espera = circuit_breaker.permitir(api_host, apenas_consultar=True)
+    if espera <= 0:
+        return True
+    reagendar_por_circuito(task, rotulo, envio_log_id, espera)
+    return False
+
+
+def calcular_atraso_retentativa(tentativa, atraso_base, retry_after=None):
+    """
+    Backoff exponencial com jitter (metade fixa, metade aleatória), limitado a RETENTATIVA_ATRASO_MAXIMO.
+    Se a API informou Retry-After, ele é respeitado, com um pequeno jitter para não sincronizar os workers.
+    """
+    if retry_after is not None:
+        return min(retry_after, RETENTATIVA_ATRASO_MAXIMO) + random.uniform(0, 1)
+    atraso = min(RETENTATIVA_ATRASO_MAXIMO, atraso_base * 2 ** tentativa)
+    return random.uniform(atraso / 2, atraso)
+
+
+def retentar_se_transitorio(task, rotulo, envio_log_id, resultado_api):
+    """
+    Erros transitórios (conexão, 429, 5xx) voltam para a fila com backoff via task.retry;
+    erros permanentes (4xx, payload inválido) falham na hora, sem ocupar o worker.
+    """
+    if resultado_api.get("circuito_aberto"):
+        # A chamada nem saiu: reagenda sem gastar uma das retentativas
+        reagendar_por_circuito(task, rotulo, envio_log_id, resultado_api["retry_after"])
+        return
+    if not EvolutionRepository.erro_transitorio(resultado_api):
+        return
+    tentativa = task.request.retries
+    if tentativa >= task.max_retries:
+        logger.error(f"[{rotulo} ID: {envio_log_id}] Erro transitório, mas as {task.max_retries} retentativas se esgotaram.")
+        return
+    countdown = calcular_atraso_retentativa(tentativa, task.default_retry_delay, resultado_api.get("retry_after"))
+    logger.warning(f"[{rotulo} ID: {envio_log_id}] Erro transitório. Tentativa {tentativa + 2}/{task.max_retries + 1} em {countdown:.1f}s.")
+    raise task.retry(countdown=countdown)
+
+
+def devolver_cota(rotulo, usuario_id, envio_log_id, cota):
+    """
+    O envio ao contato terminou sem a mensagem sair: devolve à cota diária a unidade reservada por verificar_disparos.
+    'cota' = [dia da reserva (ISO), partes do contato]; com texto e mídia, só devolve quando as duas partes não saíram.
+    """
+    if not cota:
+        return
+    chave_contato, parte = envio_log_id.rsplit('-', 1)
+    dia, partes = cota
+    if cota_diaria.devolver_contato(usuario_id, chave_contato, parte, partes, date.fromisoformat(dia)):
+        logger.info(f"[{rotulo} ID: {envio_log_id}] Nada foi enviado ao contato: unidade da cota diária devolvida.")
+
+
+def devolver_cota_se_nao_saiu(rotulo, usuario_id, envio_log_id, resultado_api, cota):
+    """Chamada depois de retentar_se_transitorio: falha definitiva em que a mensagem com certeza não saiu."""
+    if resultado_api.get("circuito_aberto") or not EvolutionRepository.mensagem_nao_saiu(resultado_api):
+        return
+    devolver_cota(rotulo, usuario_id, envio_log_id, cota)
+
+
+def envio_duplicado(rotulo, envio_log_id, contato, reservar=False):
+    """
+    Idempotência por envio_log_id e número do contato. Sem 'reservar' faz só a checagem barata (GET);
+    com 'reservar' faz a reserva atômica que precede a chamada à API. Retorna True se for duplicata.
+    """
+    livre = idempotencia_envio.reservar(envio_log_id, contato) if reservar else not idempotencia_envio.ja_processado(envio_log_id, contato)
+    if not livre:
+        logger.info(f"[{rotulo} ID: {envio_log_id}] Envio já realizado ou em andamento. Duplicata descartada.")
+    return not livre
+
+
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def enviar_notificacao_whatsapp_texto(self, contato, mensagem_texto, usuario_id, envio_log_id):
+def enviar_notificacao_whatsapp_texto(self, contato, mensagem_texto, usuario_id, envio_log_id, cota=None):
     """Tarefa Celery para enviar uma mensagem de texto."""
     logger.info(f"[EnvioTexto ID: {envio_log_id}] Iniciando para {contato}, Usuário ID: {usuario_id}")
+    if envio_duplicado("EnvioTexto", envio_log_id, contato):
+        return
     api_settings, instancia = get_api_credentials(usuario_id)
     if not api_settings:
+        devolver_cota("EnvioTexto", usuario_id, envio_log_id, cota)
+        return
+    if not circuito_disponivel(self, "EnvioTexto", api_settings.api_host, envio_log_id):
+        return
+    if not aguardar_vez_de_envio(self, instancia, usuario_id, envio_log_id):
+        return
+    if envio_duplicado("EnvioTexto", envio_log_id, contato, reservar=True):
         return
 
+    inicio = time.monotonic()
     resultado_api = EvolutionRepository.enviar_mensagem_texto(
         api_settings.api_host,
         api_settings.api_key,
@@ -54,16 +195,30 @@ def enviar_notificacao_whatsapp_texto(self, contato, mensagem_texto, usuario_id,
         logger.error(f"[EnvioTexto ID: {envio_log_id}] Falha ao enviar para {contato}. Erro: {error_details}")
     else:
         logger.info(f"[EnvioTexto ID: {envio_log_id}] Sucesso para {contato}.")
+    idempotencia_envio.concluir(envio_log_id, contato, resultado_api)
+    registrar_resultado(envio_log_id, contato, resultado_api, int((time.monotonic() - inicio) * 1000), self.request.retries + 1)
+    retentar_se_transitorio(self, "EnvioTexto", envio_log_id, resultado_api)
+    devolver_cota_se_nao_saiu("EnvioTexto", usuario_id, envio_log_id, resultado_api, cota)
 
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def enviar_notificacao_whatsapp_botao(self, contato, mensagem_texto, botao_texto, botao_url, usuario_id, envio_log_id):
+def enviar_notificacao_whatsapp_botao(self, contato, mensagem_texto, botao_texto, botao_url, usuario_id, envio_log_id, cota=None):
     """Tarefa Celery para enviar uma mensagem de texto com botão URL."""
     logger.info(f"[EnvioBotao ID: {envio_log_id}] Iniciando para {contato}, Usuário ID: {usuario_id}")
+    if envio_duplicado("EnvioBotao", envio_log_id, contato):
+        return
     api_settings, instancia = get_api_credentials(usuario_id)
     if not api_settings:
+        devolver_cota("EnvioBotao", usuario_id, envio_log_id, cota)
+        return
+    if not circuito_disponivel(self, "EnvioBotao", api_settings.api_host, envio_log_id):
+        return
+    if not aguardar_vez_de_envio(self, instancia, usuario_id, envio_log_id):
+        return
+    if envio_duplicado("EnvioBotao", envio_log_id, contato, reservar=True):
         return
 
+    inicio = time.monotonic()
     resultado_api = EvolutionRepository.enviar_mensagem_com_botao(
         api_settings.api_host,
         api_settings.api_key,
@@ -79,14 +234,21 @@ def enviar_notificacao_whatsapp_botao(self, contato, mensagem_texto, botao_texto
         logger.error(f"[EnvioBotao ID: {envio_log_id}] Falha ao enviar para {contato}. Erro: {error_details}")
     else:
         logger.info(f"[EnvioBotao ID: {envio_log_id}] Sucesso para {contato}.")
+    idempotencia_envio.concluir(envio_log_id, contato, resultado_api)
+    registrar_resultado(envio_log_id, contato, resultado_api, int((time.monotonic() - inicio) * 1000), self.request.retries + 1)
+    retentar_se_transitorio(self, "EnvioBotao", envio_log_id, resultado_api)
+    devolver_cota_se_nao_saiu("EnvioBotao", usuario_id, envio_log_id, resultado_api, cota)
 
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
-def enviar_notificacao_whatsapp_midia(self, contato, midia_id, mensagem_id, usuario_id, envio_log_id):
+def enviar_notificacao_whatsapp_midia(self, contato, midia_id, mensagem_id, usuario_id, envio_log_id, cota=None):
     """Tarefa Celery para enviar uma mensagem com mídia, com conversão de áudio."""
     logger.info(f"[EnvioMidia ID: {envio_log_id}] Iniciando para {contato}, Usuário ID: {usuario_id}")
+    if envio_duplicado("EnvioMidia", envio_log_id, contato):
+        return
     api_settings, instancia = get_api_credentials(usuario_id)
     if not api_settings:
+        devolver_cota("EnvioMidia", usuario_id, envio_log_id, cota)
         return
 
     try:
@@ -94,70 +256,69 @@ def enviar_notificacao_whatsapp_midia(self, contato, midia_id, mensagem_id, usua
         mensagem = Mensagem.objects.get(id=mensagem_id)
     except (Midia.DoesNotExist, Mensagem.DoesNotExist):
         logger.error(f"[EnvioMidia ID: {envio_log_id}] Mídia ou Mensagem não encontrada.")
+        devolver_cota("EnvioMidia", usuario_id, envio_log_id, cota)
+        return
+
+    if not circuito_disponivel(self, "EnvioMidia", api_settings.api_host, envio_log_id):
+        return
+    if not aguardar_vez_de_envio(self, instancia, usuario_id, envio_log_id):
+        return
+    if envio_duplicado("EnvioMidia", envio_log_id, contato, reservar=True):
         return
 
     resultado_api = {}
+    inicio = time.monotonic()
     try:
         if midia.tipo in ['image', 'video', 'document', 'audio']:
-            s3_client = boto3.client('s3')
-            
-            # Usamos um diretório temporário para lidar com os arquivos de entrada e saída
-            with tempfile.TemporaryDirectory() as temp_dir:
-                original_file_path = os.path.join(temp_dir, midia.nome)
-                
-                # Baixa o arquivo original do S3
-                s3_client.download_file(
-                    os.getenv('AWS_STORAGE_BUCKET_NAME'), midia.arquivo.name, original_file_path
-                )
-
-                file_to_encode_path = original_file_path
-                mimetype = midia.mimetype or 'application/octet-stream'
-
-                # <<< LÓGICA DE CONVERSÃO DE ÁUDIO >>>
-                if midia.tipo == 'audio':
-                    logger.info(f"[EnvioMidia ID: {envio_log_id}] Arquivo de áudio detectado. Iniciando conversão para OGG/Opus.")
-                    converted_file_path = os.path.join(temp_dir, "audio.ogg")
-                    try:
-                        # Roda o comando do ffmpeg para converter o áudio
-                        ffmpeg.input(original_file_path).output(
-                            converted_file_path, 
-                            acodec='libopus',       # Codec do WhatsApp
-                            format='ogg',           # Formato do WhatsApp
-                            audio_bitrate='16k'     # Taxa de bits comum para áudio de voz
-                        ).run(overwrite_output=True, capture_stdout=True, capture_stderr=True)
-                        
-                        file_to_encode_path = converted_file_path # O arquivo a ser enviado é o convertido
-                        mimetype = 'audio/ogg' # O mimetype agora é OGG
-                        logger.info(f"[EnvioMidia ID: {envio_log_id}] Conversão de áudio concluída com sucesso.")
-                    except ffmpeg.Error as e:
-                        logger.error(f"[EnvioMidia ID: {envio_log_id}] Erro do FFmpeg ao converter áudio: {e.stderr.decode()}")
-                        # Continua tentando enviar o arquivo original se a conversão falhar
-                        pass
-                
-                # <<< CODIFICAÇÃO PARA BASE64 >>>
-                with open(file_to_encode_path, 'rb') as f:
-                    file_bytes = f.read()
-                base64_data = base64.b64encode(file_bytes).decode('utf-8')
-                
-                # <<< CHAMADA PARA A API >>>
+            if django_settings.EVOLUTION_MIDIA_MODO_ENVIO == 'url':
+                # Modo URL: a Evolution API baixa a mídia direto do S3, nenhum byte passa pelo worker
+                arquivo_envio = midia.arquivo_ogg if midia.audio_pronto else midia.arquivo
+                media_url = midia.get_presigned_url(arquivo_envio)
+                if not media_url:
+                    logger.error(f"[EnvioMidia ID: {envio_log_id}] Não foi possível gerar a URL assinada da mídia.")
+                    idempotencia_envio.liberar(envio_log_id, contato)
+                    devolver_cota("EnvioMidia", usuario_id, envio_log_id, cota)
+                    return
                 if midia.tipo == 'audio':
                     resultado_api = EvolutionRepository.enviar_audio(
                         host=api_settings.api_host, api_key=api_settings.api_key,
                         instance_name=instancia.nome_instancia, number=contato,
-                        audio_data=base64_data # Envia o áudio (convertido ou original)
+                        audio_data=media_url
                     )
                 else:
                     resultado_api = EvolutionRepository.enviar_midia(
                         host=api_settings.api_host, api_key=api_settings.api_key,
                         instance_name=instancia.nome_instancia, number=contato,
                         mediatype=midia.tipo,
-                        mimetype=mimetype,
-                        media_data=base64_data,
+                        mimetype=midia.mimetype or 'application/octet-stream',
+                        media_data=media_url,
                         caption=mensagem.mensagem_notificacao,
                         file_name=midia.nome
                     )
+            else:
+                # Download, conversão de áudio e Base64 acontecem uma vez por mídia (cache em disco do worker);
+                # o Base64 é transmitido do disco para o socket em blocos, sem cópias em memória
+                with obter_midia_preparada(midia) as preparada:
+                    if midia.tipo == 'audio':
+                        resultado_api = EvolutionRepository.enviar_audio_arquivo(
+                            host=api_settings.api_host, api_key=api_settings.api_key,
+                            instance_name=instancia.nome_instancia, number=contato,
+                            arquivo_base64=preparada.arquivo_base64
+                        )
+                    else:
+                        resultado_api = EvolutionRepository.enviar_midia_arquivo(
+                            host=api_settings.api_host, api_key=api_settings.api_key,
+                            instance_name=instancia.nome_instancia, number=contato,
+                            mediatype=midia.tipo,
+                            mimetype=preparada.mimetype,
+                            arquivo_base64=preparada.arquivo_base64,
+                            caption=mensagem.mensagem_notificacao,
+                            file_name=midia.nome
+                        )
         else:
             logger.error(f"[EnvioMidia ID: {envio_log_id}] Tipo de mídia '{midia.tipo}' não suportado.")
+            idempotencia_envio.liberar(envio_log_id, contato)
+            devolver_cota("EnvioMidia", usuario_id, envio_log_id, cota)
             return
 
         if "error" in resultado_api or resultado_api.get("status") == "error":
@@ -168,14 +329,457 @@ def enviar_notificacao_whatsapp_midia(self, contato, midia_id, mensagem_id, usua
 
     except ClientError as s3_err:
         logger.error(f"[EnvioMidia ID: {envio_log_id}] Erro no S3: {s3_err}")
+        resultado_api = {"status": "error", "message": f"Erro no S3: {s3_err}"}
     except Exception as e:
         logger.error(f"[EnvioMidia ID: {envio_log_id}] Erro inesperado: {e}", exc_info=True)
+        resultado_api = {"status": "error", "message": f"Erro inesperado: {e}"}
+
+    idempotencia_envio.concluir(envio_log_id, contato, resultado_api)
+    registrar_resultado(envio_log_id, contato, resultado_api, int((time.monotonic() - inicio) * 1000), self.request.retries + 1)
+    retentar_se_transitorio(self, "EnvioMidia", envio_log_id, resultado_api)
+    devolver_cota_se_nao_saiu("EnvioMidia", usuario_id, envio_log_id, resultado_api, cota)
 
 
 
 
 
 
+@shared_task(bind=True)
+def transcodificar_audio_midia(self, midia_id):
+    """Gera uma única vez a versão OGG/Opus de um áudio e a guarda no S3 ao lado do original."""
+    try:
+        midia = Midia.objects.get(id=midia_id)
+    except Midia.DoesNotExist:
+        logger.error(f"[Transcodificacao] Mídia {midia_id} não encontrada.")
+        return
+    if midia.tipo != 'audio' or not midia.arquivo:
+        return
+
+    Midia.objects.filter(id=midia_id).update(status_transcodificacao='processando')
+    logger.info(f"[Transcodificacao] Convertendo a mídia {midia_id} para OGG/Opus.")
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            original_file_path = os.path.join(temp_dir, 'original')
+            converted_file_path = os.path.join(temp_dir, 'audio.ogg')
+            boto3.client('s3').download_file(django_settings.AWS_STORAGE_BUCKET_NAME, midia.arquivo.name, original_file_path)
+            converter_audio_para_ogg(original_file_path, converted_file_path)
+            duracao = float(ffmpeg.probe(converted_file_path)['format']['duration'])
+
+            if midia.arquivo_ogg:
+                midia.arquivo_ogg.delete(save=False)  # Versão de um arquivo anterior (edição)
+            nome_ogg = f"{os.path.splitext(os.path.basename(midia.arquivo.name))[0]}.ogg"
+            with open(converted_file_path, 'rb') as f:
+                midia.arquivo_ogg.save(nome_ogg, File(f), save=False)
+    except ffmpeg.Error as e:
+        logger.error(f"[Transcodificacao] Erro do FFmpeg na mídia {midia_id}: {e.stderr.decode() if e.stderr else e}")
+        Midia.objects.filter(id=midia_id).update(status_transcodificacao='erro')
+        return
+    except (ClientError, KeyError, ValueError) as e:
+        logger.error(f"[Transcodificacao] Falha ao preparar a mídia {midia_id}: {e}")
+        Midia.objects.filter(id=midia_id).update(status_transcodificacao='erro')
+        return
+
+    midia.status_transcodificacao = 'pronto'
+    midia.duracao_audio = duracao
+    midia.save(update_fields=['arquivo_ogg', 'status_transcodificacao', 'duracao_audio'])
+    logger.info(f"[Transcodificacao] Mídia {midia_id} pronta ({duracao:.1f}s).")
+
+
+def agendar_transcodificacao_audio(midia):
+    """Marca o áudio como pendente e enfileira a conversão; para outros tipos limpa o status."""
+    if midia.tipo == 'audio':
+        Midia.objects.filter(id=midia.id).update(status_transcodificacao='pendente', duracao_audio=None)
+        transcodificar_audio_midia.delay(midia.id)
+    elif midia.status_transcodificacao:
+        Midia.objects.filter(id=midia.id).update(status_transcodificacao='', duracao_audio=None)
+
+
+# Falhas de infraestrutura (S3, banco) na importação: a tarefa é repetida com o arquivo ainda no S3.
+# Planilha inválida não é repetida (vira 'erro' na hora).
+IMPORTACAO_ERROS_TRANSITORIOS = (ClientError, BotoCoreError, OperationalError, InterfaceError)
+
+
+def _atualizar_importacao(mensagem_id, **campos):
+    Mensagem.objects.filter(id=mensagem_id).update(importacao_atualizada_em=timezone.now(), **campos)
+
+
+# acks_late + reject_on_worker_lost: se o worker morrer no meio (deploy, OOM), a importação volta para a fila
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, autoretry_for=IMPORTACAO_ERROS_TRANSITORIOS,
+             max_retries=3, retry_backoff=30)
+def importar_contatos_arquivo(self, mensagem_id, caminho_arquivo, contatos_digitados):
+    """
+    Importa em segundo plano a planilha de contatos de uma mensagem, linha a linha.
+    O progresso fica em Mensagem.importacao_linhas; ao final a lista pronta vira a ListaContatos da mensagem.
+    O arquivo só é apagado do S3 depois de importado, para que uma retentativa possa relê-lo.
+    """
+    armazenamento = S3Boto3Storage()
+    if not armazenamento.exists(caminho_arquivo):
+        # Reentrega de uma importação que já terminou (o arquivo só é apagado no fim)
+        logger.info(f"[ImportacaoContatos] Mensagem {mensagem_id}: arquivo '{caminho_arquivo}' já processado.")
+        return
+    _atualizar_importacao(mensagem_id, importacao_status='processando', importacao_linhas=0)
+
+    def progresso(linhas):
+        _atualizar_importacao(mensagem_id, importacao_linhas=linhas)
+        self.update_state(state='PROGRESS', meta={'linhas': linhas})
+
+    try:
+        with armazenamento.open(caminho_arquivo, 'rb') as arquivo:
+            resultado = importar_contatos(chain(contatos_digitados, primeira_coluna(arquivo, caminho_arquivo)), progresso)
+    except IMPORTACAO_ERROS_TRANSITORIOS as e:
+        if self.request.retries < self.max_retries:
+            logger.warning(f"[ImportacaoContatos] Falha temporária na mensagem {mensagem_id} ({e}). Tentando de novo.")
+            raise
+        logger.error(f"[ImportacaoContatos] Retentativas esgotadas na mensagem {mensagem_id}: {e}", exc_info=True)
+        _atualizar_importacao(
+            mensagem_id, importacao_status='erro', importacao_detalhe=f"Erro ao ler o arquivo: {e}"[:255]
+        )
+        return
+    except Exception as e:
+        logger.error(f"[ImportacaoContatos] Erro ao processar o arquivo da mensagem {mensagem_id}: {e}", exc_info=True)
+        _atualizar_importacao(
+            mensagem_id, importacao_status='erro', importacao_detalhe=f"Erro ao processar o arquivo: {e}"[:255]
+        )
+        return
+
+    detalhe = f"{len(resultado.contatos)} contatos importados de {resultado.linhas_lidas} linhas."
+    if resultado.invalidos:
+        detalhe += f" {resultado.invalidos} números inválidos descartados (ex: {', '.join(resultado.exemplos_invalidos)})."
+    if not resultado.contatos:
+        _atualizar_importacao(
+            mensagem_id, importacao_status='erro', importacao_linhas=resultado.linhas_lidas,
+            importacao_detalhe="Nenhum contato válido foi encontrado no arquivo."
+        )
+    else:
+        _atualizar_importacao(
+            mensagem_id, lista_contatos=ListaContatos.obter(resultado.contatos), importacao_status='concluida',
+            importacao_linhas=resultado.linhas_lidas, importacao_detalhe=detalhe[:255]
+        )
+        logger.info(f"[ImportacaoContatos] Mensagem {mensagem_id}: {detalhe}")
+    armazenamento.delete(caminho_arquivo)
+
+
+@shared_task
+def verificar_importacoes_interrompidas():
+    """
+    Marca como 'erro' as importações pendentes/em andamento sem notícia há IMPORTACAO_PRAZO segundos
+    (worker morto sem reentrega, mensagem perdida), avisando o usuário em vez de deixar o agendamento parado.
+    """
+    corte = timezone.now() - timedelta(seconds=IMPORTACAO_PRAZO)
+    interrompidas = Mensagem.objects.filter(importacao_status__in=['pendente', 'processando']).filter(
+        Q(importacao_atualizada_em__lt=corte) | Q(importacao_atualizada_em__isnull=True)
+    )
+    total = interrompidas.update(
+        importacao_status='erro', importacao_atualizada_em=timezone.now(),
+        importacao_detalhe="A importação foi interrompida. Envie a planilha novamente.",
+    )
+    if total:
+        logger.warning(f"VERIFICAR_IMPORTACOES: {total} importações interrompidas marcadas como erro.")
+
+
+def agendar_importacao_contatos(mensagem, arquivo, contatos_digitados):
+    """Guarda a planilha no S3 e enfileira a importação; a mensagem já deve estar salva como 'pendente'."""
+    caminho = S3Boto3Storage().save(f"importacoes/{uuid.uuid4().hex}_{os.path.basename(arquivo.name)}", arquivo)
+    importar_contatos_arquivo.delay(mensagem.id, caminho, contatos_digitados)
+
+
+@contextlib.asynccontextmanager
+async def _vaga_na_instancia(nome_instancia, limite):
+    """Segura uma vaga do semáforo da instância no Redis (vale para todos os lotes e workers) durante a chamada."""
+    token = uuid.uuid4().hex
+    while not await asyncio.to_thread(adquirir_vaga, nome_instancia, limite, token):
+        await asyncio.sleep(VAGA_ESPERA)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(liberar_vaga, nome_instancia, token)
+
+
+def tamanho_lote_assincrono(intervalo_disparo):
+    """Contatos por lote assíncrono: no máximo LOTE_ENVIO_ASSINCRONO e LOTE_DURACAO_MAXIMA segundos de agenda."""
+    if intervalo_disparo <= 0:
+        return LOTE_ENVIO_ASSINCRONO
+    return max(1, min(LOTE_ENVIO_ASSINCRONO, int(LOTE_DURACAO_MAXIMA // intervalo_disparo) + 1))
+
+
+async def _enviar_lote_texto(api_settings, nome_instancia, msg, contatos_indexados, cota=None):
+    """
+    Dispara o lote em um único event loop: cada contato parte no seu horário
+    (posição * intervalo_disparo) e o semáforo da instância limita as requisições em voo.
+    """
+    loop = asyncio.get_running_loop()
+    limite_instancia = getattr(django_settings, 'EVOLUTION_ASYNC_MAX_CONCORRENCIA', 100)
+    com_botao = bool(msg.incluir_botao and msg.botao_texto and msg.botao_url)
+    envios_por_minuto, rajada = await asyncio.to_thread(obter_taxa_envio, msg.usuario_id)
+    sufixo = "btn" if com_botao else "txt"
+    inicio = loop.time()
+
+    # Numa reentrega do lote (worker reiniciado no meio), os contatos já enviados são pulados
+    # e os restantes recomeçam a agenda do zero
+    envio_log_ids = {
+        contato_idx: f"msg{msg.id}-camp{msg.id_campanha}-cont{contato_idx}-{sufixo}" for contato_idx, _ in contatos_indexados
+    }
+    processados = await asyncio.to_thread(
+        idempotencia_envio.ja_processados, [(envio_log_ids[contato_idx], contato) for contato_idx, contato in contatos_indexados]
+    )
+    pendentes = [
+        (contato_idx, contato) for contato_idx, contato in contatos_indexados
+        if (envio_log_ids[contato_idx], contato) not in processados
+    ]
+    if len(pendentes) < len(contatos_indexados):
+        logger.info(f"[EnvioLoteAsync] Mensagem {msg.id}: {len(contatos_indexados) - len(pendentes)} contatos do lote já processados.")
+
+    async def aguardar_token():
+        while (espera := await asyncio.to_thread(adquirir_token, nome_instancia, envios_por_minuto, rajada)) > 0:
+            await asyncio.sleep(espera)
+
+    async with AsyncEvolutionRepository(api_settings.api_host, api_settings.api_key) as repo:
+        async def enviar(posicao, contato_idx, contato):
+            await asyncio.sleep(max(0, inicio + posicao * msg.intervalo_disparo - loop.time()))
+            envio_log_id = envio_log_ids[contato_idx]
+            if await asyncio.to_thread(envio_duplicado, "EnvioLoteAsync", envio_log_id, contato):
+                return None
+            await aguardar_token()
+            if await asyncio.to_thread(envio_duplicado, "EnvioLoteAsync", envio_log_id, contato, True):
+                return None
+
+            # Erros transitórios são repetidos aqui mesmo, sem reenfileirar o lote inteiro
+            tentativa = 0
+            while True:
+                async with _vaga_na_instancia(nome_instancia, limite_instancia):
+                    inicio_envio = loop.time()
+                    if com_botao:
+                        resultado_api = await repo.enviar_mensagem_com_botao(
+                            nome_instancia, contato, msg.mensagem_notificacao, msg.botao_texto, msg.botao_url
+                        )
+                    else:
+                        resultado_api = await repo.enviar_mensagem_texto(nome_instancia, contato, msg.mensagem_notificacao)
+                if not EvolutionRepository.erro_transitorio(resultado_api) or tentativa >= LOTE_RETENTATIVAS:
+                    break
+                espera = calcular_atraso_retentativa(tentativa, LOTE_RETENTATIVA_ATRASO_BASE, resultado_api.get("retry_after"))
+                logger.warning(f"[EnvioLoteAsync ID: {envio_log_id}] Erro transitório. Nova tentativa em {espera:.1f}s.")
+                await asyncio.sleep(espera)
+                tentativa += 1
+                await aguardar_token()
+            await asyncio.to_thread(idempotencia_envio.concluir, envio_log_id, contato, resultado_api)
+            await asyncio.to_thread(
+                registrar_resultado, envio_log_id, contato, resultado_api, int((loop.time() - inicio_envio) * 1000), tentativa + 1
+            )
+
+            if "error" in resultado_api or resultado_api.get("status") == "error":
+                error_details = resultado_api.get('message', 'Erro desconhecido')
+                logger.error(f"[EnvioLoteAsync ID: {envio_log_id}] Falha ao enviar para {contato}. Erro: {error_details}")
+                await asyncio.to_thread(devolver_cota_se_nao_saiu, "EnvioLoteAsync", msg.usuario_id, envio_log_id, resultado_api, cota)
+                return False
+            logger.info(f"[EnvioLoteAsync ID: {envio_log_id}] Sucesso para {contato}.")
+            return True
+
+        return await asyncio.gather(*(
+            enviar(posicao, contato_idx, contato)
+            for posicao, (contato_idx, contato) in enumerate(pendentes)
+        ))
+
+
+# acks_late + reject_on_worker_lost: se o worker morrer no meio do lote, a mensagem volta para a fila
+# e a reentrega envia só os contatos que faltaram (ver _enviar_lote_texto)
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def enviar_lote_texto_async(self, mensagem_id, contatos_indexados, usuario_id, cota=None):
+    """
+    Envia o texto (ou texto com botão) de uma mensagem para um lote de [índice, contato]
+    usando o repositório assíncrono, mantendo várias requisições em voo num só processo.
+    """
+    logger.info(f"[EnvioLoteAsync] Mensagem {mensagem_id}: {len(contatos_indexados)} contatos, Usuário ID: {usuario_id}")
+    try:
+        msg = Mensagem.objects.get(id=mensagem_id)
+    except Mensagem.DoesNotExist:
+        msg = None
+        logger.error(f"[EnvioLoteAsync] Mensagem {mensagem_id} não encontrada.")
+    api_settings, instancia = get_api_credentials(usuario_id) if msg else (None, None)
+    if not api_settings:
+        # Nenhum contato do lote foi enviado: devolve as unidades que ainda não tinham saído
+        if msg and cota:
+            sufixo = "btn" if msg.incluir_botao and msg.botao_texto and msg.botao_url else "txt"
+            envios = [(f"msg{msg.id}-camp{msg.id_campanha}-cont{contato_idx}-{sufixo}", contato) for contato_idx, contato in contatos_indexados]
+            for envio_log_id, _ in set(envios) - idempotencia_envio.ja_processados(envios):
+                devolver_cota("EnvioLoteAsync", usuario_id, envio_log_id, cota)
+        return
+
+    inicio = time.monotonic()
+    resultados = asyncio.run(_enviar_lote_texto(api_settings, instancia.nome_instancia, msg, contatos_indexados, cota))
+    sucessos = sum(1 for ok in resultados if ok)
+    logger.info(
+        f"[EnvioLoteAsync] Mensagem {mensagem_id}: {sucessos}/{len(resultados)} enviados em {time.monotonic() - inicio:.1f}s."
+    )
+
+
+def carregar_limites_diarios(usuario_ids):
+    """Limite diário de cada usuário, lido com uma única consulta por tick."""
+    usuario_ids = set(usuario_ids)
+    limites = dict(
+        UserMessageLimit.objects.filter(user_id__in=usuario_ids).values_list('user_id', 'limite_diario')
+    )
+    return {usuario_id: limites.get(usuario_id, LIMITE_DIARIO_PADRAO) for usuario_id in usuario_ids}
+
+
+@shared_task
+def registrar_enviadas(usuario_id, textos):
+    """Reconcilia a tabela Enviadas com o contador de cota do Redis (gravação em lote, fora do tick)."""
+    Enviadas.objects.bulk_create([Enviadas(user_id=usuario_id, texto=texto) for texto in textos])
+
+
+def _consolidar_enviadas(inicio, fim, sobrescrever):
+    """Agrega Enviadas por (usuário, dia local) no intervalo e grava em EnviadasDiario."""
+    linhas = Enviadas.objects.filter(data_envio__lt=fim)
+    if inicio is not None:
+        linhas = linhas.filter(data_envio__gte=inicio)
+    resumos = [
+        EnviadasDiario(user_id=linha['user_id'], data=linha['dia'], total=linha['total'])
+        for linha in linhas.annotate(dia=TruncDate('data_envio')).values('user_id', 'dia').annotate(total=Count('id'))
+    ]
+    if sobrescrever:
+        EnviadasDiario.objects.bulk_create(
+            resumos, update_conflicts=True, unique_fields=['user', 'data'], update_fields=['total']
+        )
+    else:
+        # Dias já resumidos não são recalculados: podem ter sido parcialmente apagados numa execução anterior
+        EnviadasDiario.objects.bulk_create(resumos, ignore_conflicts=True)
+    return len(resumos)
+
+
+@shared_task
+def consolidar_enviadas():
+    """
+    Tarefa noturna: resume o dia anterior em EnviadasDiario e apaga, em lotes,
+    as Enviadas mais antigas que ENVIADAS_RETENCAO_DIAS (depois de garantir o resumo delas)
+    e os DisparoAgendado de dias anteriores.
+    """
+    fuso = timezone.get_current_timezone()
+    inicio_hoje = timezone.make_aware(datetime.combine(timezone.localdate(), datetime.min.time()), fuso)
+    resumidos = _consolidar_enviadas(inicio_hoje - timedelta(days=1), inicio_hoje, sobrescrever=True)
+
+    corte = inicio_hoje - timedelta(days=django_settings.ENVIADAS_RETENCAO_DIAS)
+    _consolidar_enviadas(None, corte, sobrescrever=False)
+
+    apagadas = 0
+    antigas = Enviadas.objects.filter(data_envio__lt=corte).order_by('id').values_list('id', flat=True)
+    while ids := list(antigas[:ENVIADAS_LOTE_EXCLUSAO]):
+        Enviadas.objects.filter(id__in=ids).delete()
+        apagadas += len(ids)
+
+    # Ocorrências de dias anteriores já dispararam (ou passaram): não são mais lidas por verificar_disparos
+    disparos_apagados = 0
+    passados = DisparoAgendado.objects.filter(data_hora__lt=inicio_hoje).order_by('id').values_list('id', flat=True)
+    while ids := list(passados[:ENVIADAS_LOTE_EXCLUSAO]):
+        DisparoAgendado.objects.filter(id__in=ids).delete()
+        disparos_apagados += len(ids)
+
+    logger.info(
+        f"CONSOLIDAR_ENVIADAS: {resumidos} resumos diários gravados, {apagadas} registros antigos apagados, "
+        f"{disparos_apagados} disparos agendados passados removidos."
+    )
+
+
+@shared_task
+def atualizar_status_instancias(instancia_ids=None):
+    """
+    Consulta de uma vez o estado de conexão de todas as instâncias ativas (ou só das 'instancia_ids')
+    e grava no cache lido pelas views.
+    """
+    instancias = Instancia.objects.filter(
+        usuario__evolutionapisettings__is_active=True
+    ).select_related('usuario__evolutionapisettings')
+    if instancia_ids:
+        status_instancias.atualizar_status(list(instancias.filter(id__in=instancia_ids)))
+        return
+
+    # Rodadas completas não se sobrepõem se uma demorar mais que o intervalo do beat
+    lock_key = "atualizar_status_instancias_lock"
+    if not cache.add(lock_key, True, int(django_settings.STATUS_INSTANCIAS_INTERVALO * 2)):
+        logger.warning("ATUALIZAR_STATUS_INSTANCIAS: rodada anterior ainda em andamento. Saindo.")
+        return
+    try:
+        # Com webhooks, só as instâncias sem notícia há STATUS_INSTANCIAS_REVALIDAR segundos
+        corte = timezone.now() - timedelta(seconds=django_settings.STATUS_INSTANCIAS_REVALIDAR - django_settings.STATUS_INSTANCIAS_INTERVALO / 2)
+        status_instancias.atualizar_status(list(instancias.filter(
+            Q(ultimo_status_check__isnull=True) | Q(ultimo_status_check__lt=corte)
+        )))
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task
+def processar_webhooks_evolution(max_lotes=20):
+    """Aplica em lote os eventos recebidos pelo webhook da Evolution API (conexão, QR Code, entregas)."""
+    # Um processador por vez: cada lote só é retirado da fila depois de aplicado (LTRIM no fim)
+    lock_key = "processar_webhooks_evolution_lock"
+    if not cache.add(lock_key, True, GRAVACAO_LOCK_EXPIRE):
+        logger.warning("PROCESSAR_WEBHOOKS_EVOLUTION: execução anterior ainda em andamento. Saindo.")
+        return
+    try:
+        for _ in range(max_lotes):
+            if not webhook_evolution.processar_eventos_pendentes():
+                break
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task
+def limpar_listas_contatos():
+    """Tarefa noturna: apaga as ListaContatos que nenhuma mensagem usa mais (criadas há mais de um dia)."""
+    apagadas, _ = ListaContatos.objects.orfas().filter(criado_em__lt=timezone.now() - timedelta(days=1)).delete()
+    if apagadas:
+        logger.info(f"LIMPAR_LISTAS_CONTATOS: {apagadas} listas sem uso apagadas.")
+
+
+@shared_task
+def gravar_resultados_envio(max_lotes=20):
+    """Drena a fila de resultados dos envios para a tabela EnvioContato, em lotes."""
+    # Um drenador por vez: cada lote só é retirado da fila depois de gravado (LTRIM após o commit)
+    lock_key = "gravar_resultados_envio_lock"
+    if not cache.add(lock_key, True, GRAVACAO_LOCK_EXPIRE):
+        logger.warning("GRAVAR_RESULTADOS_ENVIO: execução anterior ainda em andamento. Saindo.")
+        return
+    total = 0
+    try:
+        for _ in range(max_lotes):
+            gravados = gravar_resultados_pendentes()
+            total += gravados
+            if not gravados:
+                break
+    finally:
+        cache.delete(lock_key)
+    if total:
+        logger.info(f"GRAVAR_RESULTADOS_ENVIO: {total} resultados gravados.")
+
+
+def publicar_envios_em_lote(envios, descricao=""):
+    """
+    Publica uma lista de (tarefa, args, countdown) reaproveitando um único producer,
+    ou seja, uma única conexão com o broker para todo o agendamento.
+    Retorna quantas foram publicadas: se o broker falhar no meio, as restantes ficam de fora (na ordem da lista).
+    """
+    if not envios:
+        return 0
+
+    inicio = time.monotonic()
+    publicados = 0
+    try:
+        with current_app.producer_or_acquire() as producer:
+            for tarefa, args, countdown in envios:
+                tarefa.apply_async(args=args, countdown=countdown, producer=producer)
+                publicados += 1
+    except Exception:
+        logger.exception(f"PUBLICAR_ENVIOS {descricao}: falha no broker após {publicados} de {len(envios)} tarefas.")
+        return publicados
+    duracao = time.monotonic() - inicio
+
+    logger.info(
+        f"PUBLICAR_ENVIOS {descricao}: {publicados} tarefas publicadas em {duracao:.2f}s "
+        f"({publicados / max(duracao, 0.001):.0f} tarefas/s)."
+    )
+    return publicados
+
+
 @shared_task(bind=True)
 def verificar_disparos(self):
     """Verifica e enfileira os disparos de mensagens agendados para o minuto atual."""
@@ -190,76 +794,110 @@ def verificar_disparos(self):
     logger.info(f"VERIFICAR_DISPAROS: Task {self.request.id} adquiriu lock '{lock_key}'.")
     try:
         agora = timezone.localtime(timezone.now())
-        hora_minuto_atual = agora.time()
-        data_atual_str = agora.strftime("%Y-%m-%d")
 
-        mensagens_para_hoje = Mensagem.objects.filter(
-            horario_disparo__hour=hora_minuto_atual.hour,
-            horario_disparo__minute=hora_minuto_atual.minute,
-            dias_disparo__contains=data_atual_str
-        ).select_related('usuario', 'midia')
+        # Mensagens com importação de contatos em andamento (ou que falhou) só têm a lista parcial: não disparam
+        disparos_do_minuto = DisparoAgendado.objects.do_minuto(agora).exclude(
+            mensagem__importacao_status__in=['pendente', 'processando', 'erro']
+        ).select_related('mensagem__usuario', 'mensagem__midia', 'mensagem__lista_contatos')
+        mensagens_para_hoje = [disparo.mensagem for disparo in disparos_do_minuto]
+
+        logger.info(f"VERIFICAR_DISPAROS ({self.request.id}): {len(mensagens_para_hoje)} agendamentos encontrados.")
 
-        logger.info(f"VERIFICAR_DISPAROS ({self.request.id}): {mensagens_para_hoje.count()} agendamentos encontrados.")
+        limites_diarios = carregar_limites_diarios(msg.usuario_id for msg in mensagens_para_hoje)
 
         for msg in mensagens_para_hoje:
             usuario = msg.usuario
-            limite_obj = UserMessageLimit.objects.filter(user=usuario).first()
-            limite_diario = limite_obj.limite_diario if limite_obj else 65
+            envia_texto = msg.modo_envio in ('texto', 'ambos')
+            envia_midia = msg.modo_envio in ('midia', 'ambos')
+            if envia_midia and not (msg.midia and msg.midia.arquivo):
+                logger.warning(f"VERIFICAR_DISPAROS: Mídia não encontrada para msg {msg.id}")
+                envia_midia = False
+            if not (envia_texto or envia_midia):
+                continue
 
-            enviadas_hoje = Enviadas.objects.filter(user=usuario, data_envio__date=agora.date()).count()
-            if enviadas_hoje >= limite_diario:
+            # O contador do Redis é a fonte da verdade: a reserva é atômica entre ticks concorrentes
+            todos_contatos = msg.contatos
+            concedidos = cota_diaria.reservar(usuario.id, len(todos_contatos), limites_diarios[usuario.id], agora.date())
+            if concedidos <= 0:
                 logger.warning(f"VERIFICAR_DISPAROS: Limite diário atingido para {usuario.username}. Agendamento {msg.id} ignorado.")
                 continue
 
-            delay = 0
-            for contato_idx, contato in enumerate(msg.contato):
-                if Enviadas.objects.filter(user=usuario, data_envio__date=agora.date()).count() >= limite_diario:
-                    logger.warning(f"VERIFICAR_DISPAROS: Limite diário atingido durante o envio do lote para {usuario.username}.")
-                    break
+            contatos = todos_contatos[:concedidos]
+            if len(contatos) < len(todos_contatos):
+                logger.warning(
+                    f"VERIFICAR_DISPAROS: Limite diário atingido durante o envio do lote para {usuario.username}. "
+                    f"{len(todos_contatos) - len(contatos)} contatos do agendamento {msg.id} ficaram de fora."
+                )
 
-                envio_log_id = f"msg{msg.id}-camp{msg.id_campanha}-cont{contato_idx}"
-                enviou_algo = False
+            # Cada contato reservou uma unidade; ela volta se nenhuma das partes (texto/mídia) chegar a sair
+            cota = [agora.date().isoformat(), 2 if envia_texto and envia_midia else 1]
+            midia_primeiro = msg.modo_envio == 'ambos' and msg.tipo_envio == 'midia_primeiro'
+            atraso_midia = 2 if msg.modo_envio == 'ambos' and msg.tipo_envio == 'texto_primeiro' else 0
+            registros_enviadas = []
+            envios = []
+            usa_envio_assincrono = django_settings.EVOLUTION_ENVIO_ASSINCRONO and envia_texto and not envia_midia
+            if usa_envio_assincrono:
+                # Um executor assíncrono por lote, com o primeiro contato do lote no seu horário original.
+                # Lotes curtos (LOTE_DURACAO_MAXIMA) não prendem o worker por horas e perdem pouco num reinício
+                tamanho_lote = tamanho_lote_assincrono(msg.intervalo_disparo)
+                for inicio_lote in range(0, len(contatos), tamanho_lote):
+                    lote = [[idx, contatos[idx]] for idx in range(inicio_lote, min(inicio_lote + tamanho_lote, len(contatos)))]
+                    envios.append((enviar_lote_texto_async, [msg.id, lote, usuario.id, cota], inicio_lote * msg.intervalo_disparo))
+                registros_enviadas = [f"Agend.: {msg.id} - Contato: {contato}" for contato in contatos]
+            else:
+                delay = 0
+                for contato_idx, contato in enumerate(contatos):
+                    envio_log_id = f"msg{msg.id}-camp{msg.id_campanha}-cont{contato_idx}"
 
-                def agendar_envio_texto():
-                    # Verifica se deve enviar com botão ou texto simples
-                    if msg.incluir_botao and msg.botao_texto and msg.botao_url:
-                        enviar_notificacao_whatsapp_botao.apply_async(
-                            args=[contato, msg.mensagem_notificacao, msg.botao_texto, msg.botao_url, usuario.id, f"{envio_log_id}-btn"],
-                            countdown=delay
-                        )
+                    def agendar_envio_texto():
+                        # Verifica se deve enviar com botão ou texto simples
+                        if msg.incluir_botao and msg.botao_texto and msg.botao_url:
+                            envios.append((
+                                enviar_notificacao_whatsapp_botao,
+                                [contato, msg.mensagem_notificacao, msg.botao_texto, msg.botao_url, usuario.id, f"{envio_log_id}-btn", cota],
+                                delay
+                            ))
+                        else:
+                            envios.append((
+                                enviar_notificacao_whatsapp_texto,
+                                [contato, msg.mensagem_notificacao, usuario.id, f"{envio_log_id}-txt", cota],
+                                delay
+                            ))
+
+                    def agendar_envio_midia():
+                        envios.append((
+                            enviar_notificacao_whatsapp_midia,
+                            [contato, msg.midia.id, msg.id, usuario.id, f"{envio_log_id}-mid", cota],
+                            delay + atraso_midia
+                        ))
+
+                    if midia_primeiro and envia_midia:
+                        agendar_envio_midia()
+                        agendar_envio_texto()
                     else:
-                        enviar_notificacao_whatsapp_texto.apply_async(
-                            args=[contato, msg.mensagem_notificacao, usuario.id, f"{envio_log_id}-txt"],
-                            countdown=delay
-                        )
-                    return True
+                        if envia_texto:
+                            agendar_envio_texto()
+                        if envia_midia:
+                            agendar_envio_midia()
 
-                def agendar_envio_midia():
-                    if msg.midia and msg.midia.arquivo:
-                        enviar_notificacao_whatsapp_midia.apply_async(
-                            args=[contato, msg.midia.id, msg.id, usuario.id, f"{envio_log_id}-mid"],
-                            countdown=delay + (2 if msg.modo_envio == 'ambos' and msg.tipo_envio == 'texto_primeiro' else 0)
-                        )
-                        return True
-                    logger.warning(f"VERIFICAR_DISPAROS: Mídia não encontrada para msg {msg.id}")
-                    return False
-
-                if msg.modo_envio == 'texto':
-                    enviou_algo = agendar_envio_texto()
-                elif msg.modo_envio == 'midia':
-                    enviou_algo = agendar_envio_midia()
-                elif msg.modo_envio == 'ambos':
-                    if msg.tipo_envio == 'texto_primeiro':
-                        enviou_algo = agendar_envio_texto()
-                        enviou_algo = agendar_envio_midia() or enviou_algo
-                    else:  # midia_primeiro
-                        enviou_algo = agendar_envio_midia()
-                        enviou_algo = agendar_envio_texto() or enviou_algo
-
-                if enviou_algo:
-                    Enviadas.objects.create(user=usuario, texto=f"Agend.: {msg.id} - Contato: {contato}")
+                    registros_enviadas.append(f"Agend.: {msg.id} - Contato: {contato}")
                     delay += msg.intervalo_disparo
 
+            # As Enviadas são gravadas de forma assíncrona, numa única escrita por agendamento
+            envios.append((registrar_enviadas, [usuario.id, registros_enviadas], 0))
+            publicados = publicar_envios_em_lote(envios, f"msg{msg.id}")
+            if publicados < len(envios):
+                # Só volta a cota dos contatos sem nenhuma tarefa publicada; os demais devolvem pela própria tarefa
+                if usa_envio_assincrono:
+                    contatos_publicados = min(publicados * tamanho_lote, len(contatos))
+                else:
+                    contatos_publicados = min(-(-publicados // cota[1]), len(contatos))
+                cota_diaria.devolver(usuario.id, len(contatos) - contatos_publicados, agora.date())
+                logger.error(
+                    f"VERIFICAR_DISPAROS: Agendamento {msg.id} publicado pela metade "
+                    f"({contatos_publicados} de {len(contatos)} contatos). Seguindo para o próximo."
+                )
+
     finally:
         if lock_adquirido:
             cache.delete(lock_key)
@@ -267,69 +905,144 @@ def verificar_disparos(self):
             
             
 
-@shared_task(bind=True)
-def exportar_contatos_task(self, usuario_id, selected_group_ids):
+async def _buscar_participantes_grupos(api_settings, nome_instancia, group_ids, ao_receber_grupo):
     """
-    VERSÃO FINAL E OTIMIZADA (15/08/2025)
-    - Usa UMA ÚNICA chamada de API para buscar grupos e participantes, eliminando o 'rate-overlimit'.
-    - Salva o arquivo Excel gerado diretamente no cache para download imediato.
+    Busca os participantes dos grupos com no máximo EXPORTACAO_CONCORRENCIA chamadas simultâneas e chama
+    ao_receber_grupo(group_id, nome_do_grupo, resposta) para cada um, na ordem em que as respostas chegam.
+    O callback (síncrono: planilha, Redis, backend do Celery) roda numa thread, um por vez, sem travar o event loop.
     """
-    self.update_state(state='PENDING', meta={'status': 'Iniciando...'})
+    semaforo = asyncio.Semaphore(EXPORTACAO_CONCORRENCIA)
+    async with AsyncEvolutionRepository(api_settings.api_host, api_settings.api_key, max_conexoes=EXPORTACAO_CONCORRENCIA) as repo:
+        # Os nomes vêm da listagem sem participantes (a mesma, leve, que a tela usa para escolher os grupos)
+        grupos = await repo.get_todos_grupos(nome_instancia, get_participants=False)
+        nomes = {grupo.get('id'): grupo.get('subject') for grupo in grupos} if isinstance(grupos, list) else {}
+
+        async def buscar(group_id):
+            async with semaforo:
+                return group_id, await repo.get_participantes_grupo(nome_instancia, group_id)
+
+        for proximo in asyncio.as_completed([buscar(group_id) for group_id in group_ids]):
+            group_id, resposta = await proximo
+            await asyncio.to_thread(ao_receber_grupo, group_id, nomes.get(group_id) or group_id, resposta)
+
+
+def _progresso_exportacao(task, estado, meta, resultado=None):
+    """Atualiza o estado da tarefa no Celery e publica o mesmo no canal de progresso (SSE)."""
+    if estado != 'SUCCESS':  # O SUCCESS o Celery grava sozinho com o retorno da tarefa
+        task.update_state(state=estado, meta=meta)
+    # O dono vale tanto quanto o último estado publicado: o prazo conta da atualização mais recente (e do fim)
+    cache.touch(_chave_dono_exportacao(task.request.id), progresso.ULTIMO_TTL)
+    progresso.publicar(progresso.canal_exportacao(task.request.id), {
+        'task_id': task.request.id, 'state': estado, 'meta': meta, 'result': resultado,
+    })
+
+
+@shared_task(bind=True)
+def exportar_contatos_task(self, usuario_id, selected_group_ids):
+    """Exporta para um Excel no S3 os participantes (sem repetição) dos grupos escolhidos, publicando o progresso."""
+    _progresso_exportacao(self, 'PENDING', {'status': 'Iniciando...'})
     
     # 1. Busca as credenciais da API
     try:
         settings = EvolutionAPISettings.objects.select_related('usuario__instancia').get(usuario_id=usuario_id, is_active=True)
         instancia = settings.usuario.instancia
     except Exception as e:
-        self.update_state(state='FAILURE', meta={'status': f'Configuração da API não encontrada: {e}'})
+        _progresso_exportacao(self, 'FAILURE', {'status': f'Configuração da API não encontrada: {e}'})
         return "Erro de configuração"
 
-    host = settings.api_host
-    api_key = settings.api_key
     instance_name = instancia.nome_instancia
 
-    self.update_state(state='PROGRESS', meta={'status': 'Buscando todos os grupos e participantes... (Isso pode levar um momento)'})
-    
-    # 2. FAZ A CHAMADA ÚNICA E EFICIENTE À API
-    grupos_com_participantes = EvolutionRepository.get_todos_grupos(host, api_key, instance_name, get_participants=True)
-
-    if "error" in grupos_com_participantes or not isinstance(grupos_com_participantes, list):
-        error_msg = f"Erro ao buscar grupos na API: {grupos_com_participantes}"
-        self.update_state(state='FAILURE', meta={'status': error_msg})
-        return error_msg
-
-    # 3. PROCESSA OS DADOS (JÁ EM MEMÓRIA, SEM NOVAS CHAMADAS DE API)
-    todos_os_contatos = []
-    total_grupos = len(grupos_com_participantes)
-    for i, grupo in enumerate(grupos_com_participantes):
-        group_name = grupo.get('subject', 'Nome Desconhecido')
-        self.update_state(state='PROGRESS', meta={'status': f'Processando dados do grupo {i+1}/{total_grupos}: {group_name}', 'current': i + 1, 'total': total_grupos})
-        
-        for participante in grupo.get('participants', []):
-            numero = participante.get('id', '').split('@')[0]
-            if numero:
-                todos_os_contatos.append({'Numero': numero, 'Nome do Grupo': group_name})
-
-    if not todos_os_contatos:
-        self.update_state(state='SUCCESS', meta={'status': 'Nenhum contato encontrado nos grupos.'})
-        return "EMPTY" # Sinaliza ao frontend que não há arquivo
-
-    self.update_state(state='PROGRESS', meta={'status': 'Finalizando e gerando arquivo Excel...'})
-    
-    # 4. GERA O ARQUIVO EXCEL EM MEMÓRIA
-    df = pd.DataFrame(todos_os_contatos).drop_duplicates(subset=['Numero'])
-    output = ContentFile(b'')
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Contatos')
-    output.seek(0)
-    
+    group_ids = list(dict.fromkeys(selected_group_ids or []))
+    if not group_ids:
+        _progresso_exportacao(self, 'FAILURE', {'status': 'Nenhum grupo foi selecionado.'})
+        return "Nenhum grupo selecionado"
+    total_grupos = len(group_ids)
+    _progresso_exportacao(self, 'PROGRESS', {'status': f'Buscando os participantes de {total_grupos} grupos...', 'current': 0, 'total': total_grupos})
+
+    # 2. BUSCA SÓ OS GRUPOS ESCOLHIDOS E 3. ESCREVE A PLANILHA AOS POUCOS
+    # (openpyxl write-only em arquivo temporário, nada inteiro em memória), à medida que cada grupo chega
     nome_arquivo = f"contatos_whatsapp_{timezone.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    # 5. SALVA O ARQUIVO NO CACHE UNIFICADO
-    cache_data = {
-        'file_content': output.read(),
-        'filename': nome_arquivo
-    }
-    cache.set(f"export_task_{self.request.id}", cache_data, timeout=600) # 10 minutos para baixar
-    
-    return True
\ No newline at end of file
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as temporario:
+        planilha = Workbook(write_only=True)
+        aba = planilha.create_sheet('Contatos')
+        aba.append(['Numero', 'Numero Formatado', 'Nome do Grupo'])
+        vistos = set()
+        falhas = []
+        concluidos = 0
+        ultimo_progresso = 0.0
+
+        def ao_receber_grupo(group_id, group_name, resposta):
+            nonlocal concluidos, ultimo_progresso
+            concluidos += 1
+            participantes = resposta.get('participants') if isinstance(resposta, dict) else resposta
+            if not isinstance(participantes, list):
+                logger.error(f"[ExportarContatos] Erro ao buscar os participantes do grupo {group_id}: {resposta}")
+                falhas.append(group_name)
+                participantes = []
+
+            # Cada número entra uma vez só, no primeiro grupo recebido em que aparece
+            novos = []
+            for participante in participantes:
+                numero = participante.get('id', '').split('@')[0]
+                if numero and numero not in vistos:
+                    vistos.add(numero)
+                    novos.append(numero)
+            for numero, formatado in zip(novos, normalizar_telefones(novos)['numero']):
+                aba.append([numero, formatado, group_name])
+
+            # Progresso no máximo a cada EXPORTACAO_PROGRESSO_INTERVALO segundos (e sempre no último grupo)
+            agora = time.monotonic()
+            if concluidos == total_grupos or agora - ultimo_progresso >= EXPORTACAO_PROGRESSO_INTERVALO:
+                ultimo_progresso = agora
+                _progresso_exportacao(self, 'PROGRESS', {
+                    'status': f'Processando dados do grupo {concluidos}/{total_grupos}: {group_name}',
+                    'current': concluidos, 'total': total_grupos,
+                })
+
+        asyncio.run(_buscar_participantes_grupos(settings, instance_name, group_ids, ao_receber_grupo))
+
+        planilha.save(temporario.name)  # Fecha as linhas pendentes da planilha write-only mesmo se vazia
+        if len(falhas) == total_grupos:
+            _progresso_exportacao(self, 'FAILURE', {'status': 'Erro ao buscar os participantes dos grupos na API.'})
+            return "Erro ao buscar participantes"
+
+        _progresso_exportacao(self, 'PROGRESS', {'status': 'Finalizando e enviando o arquivo Excel...'})
+        if not vistos:
+            _progresso_exportacao(self, 'SUCCESS', {'status': 'Nenhum contato encontrado nos grupos.'}, resultado="EMPTY")
+            return "EMPTY" # Sinaliza ao frontend que não há arquivo
+
+        # 4. ENVIA PARA O S3; o download é feito direto de lá, por URL assinada
+        caminho = S3Boto3Storage().save(f"exportacoes/{self.request.id}/{nome_arquivo}", File(temporario))
+
+    # 5. NO CACHE FICAM SÓ OS METADADOS; o arquivo é apagado do S3 quando o link expira
+    cache.set(
+        f"export_task_{self.request.id}",
+        {'caminho': caminho, 'filename': nome_arquivo, 'usuario_id': usuario_id},
+        timeout=EXPORTACAO_TTL,
+    )
+    remover_arquivo_exportado.apply_async(args=[caminho], countdown=EXPORTACAO_TTL)
+    _progresso_exportacao(self, 'SUCCESS', {'status': 'Concluído!'}, resultado=True)
+    return True
+
+
+def _chave_dono_exportacao(task_id):
+    return f"export_owner_{task_id}"
+
+
+def iniciar_exportacao(usuario_id, group_ids):
+    """Enfileira a exportação já registrando o dono do task_id: só ele pode acompanhar o progresso."""
+    task_id = str(uuid.uuid4())
+    cache.set(_chave_dono_exportacao(task_id), usuario_id, progresso.ULTIMO_TTL)
+    exportar_contatos_task.apply_async(args=[usuario_id, group_ids], task_id=task_id)
+    return task_id
+
+
+def dono_exportacao(task_id):
+    """usuario_id de quem iniciou a exportação, ou None (task_id desconhecido ou expirado)."""
+    return cache.get(_chave_dono_exportacao(task_id))
+
+
+@shared_task
+def remover_arquivo_exportado(caminho):
+    """Apaga do S3 a planilha de uma exportação cujo prazo de download acabou."""
+    S3Boto3Storage().delete(caminho)
@@ -1,3 +1,173 @@
-from django.test import TestCase
+import json
+import uuid
+from datetime import date, datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from . import tasks
+from .models import EnvioContato, ListaContatos, Mensagem, UserMessageLimit
+from .services import cota_diaria, webhook_evolution
+from .services.normalizacao_telefones import (
+    MOTIVO_NAO_BRASILEIRO, MOTIVO_POUCOS_DIGITOS, MOTIVO_VAZIO, formatar_numero_telefone, normalizar_telefones,
+)
+
+
+class CotaDiariaTests(TestCase):
+    """Contador de cota no Redis (precisa do Redis configurado em CACHES)."""
+
+    def setUp(self):
+        self.usuario = User.objects.create(username='cota')
+        self.dia = date(2030, 1, 2)
+        conexao = get_redis_connection("default")
+        chaves = [cota_diaria._chave(self.usuario.id, self.dia), f"cota_diaria:devolvidas:{self.usuario.id}:20300102:msg1-campX-cont0"]
+        conexao.delete(*chaves)
+        self.addCleanup(conexao.delete, *chaves)
+
+    def test_reservar_concede_so_o_que_cabe_no_limite(self):
+        self.assertEqual(cota_diaria.reservar(self.usuario.id, 8, 10, self.dia), 8)
+        self.assertEqual(cota_diaria.reservar(self.usuario.id, 5, 10, self.dia), 2)
+        self.assertEqual(cota_diaria.reservar(self.usuario.id, 1, 10, self.dia), 0)
+        self.assertEqual(cota_diaria.consumidas(self.usuario.id, self.dia), 10)
+
+    def test_devolver_libera_a_cota(self):
+        cota_diaria.reservar(self.usuario.id, 10, 10, self.dia)
+        cota_diaria.devolver(self.usuario.id, 3, self.dia)
+        cota_diaria.devolver(self.usuario.id, 0, self.dia)
+        self.assertEqual(cota_diaria.consumidas(self.usuario.id, self.dia), 7)
+        self.assertEqual(cota_diaria.reservar(self.usuario.id, 5, 10, self.dia), 3)
+
+    def test_devolver_contato_espera_todas_as_partes_e_devolve_uma_vez(self):
+        cota_diaria.reservar(self.usuario.id, 1, 10, self.dia)
+        self.assertFalse(cota_diaria.devolver_contato(self.usuario.id, 'msg1-campX-cont0', 'txt', 2, self.dia))
+        self.assertFalse(cota_diaria.devolver_contato(self.usuario.id, 'msg1-campX-cont0', 'txt', 2, self.dia))
+        self.assertTrue(cota_diaria.devolver_contato(self.usuario.id, 'msg1-campX-cont0', 'mid', 2, self.dia))
+        self.assertFalse(cota_diaria.devolver_contato(self.usuario.id, 'msg1-campX-cont0', 'mid', 2, self.dia))
+        self.assertEqual(cota_diaria.consumidas(self.usuario.id, self.dia), 0)
+
+
+class NormalizacaoTelefonesTests(TestCase):
+    NUMEROS = [
+        '(11) 98888-7777', '+55 11 98888 7777', '5511988887777', '11988887777', '1133334444',
+        '+551133334444', '8888-7777', '', '   ', 'nan', 'abc', '+44 20 7946 0958', '55119888877771234',
+        '+55 (21) 9 9999-0000', '011988887777',
+    ]
+
+    def test_vetorizada_igual_a_escalar_para_texto(self):
+        esperado = [formatar_numero_telefone(numero) for numero in self.NUMEROS]
+        self.assertEqual(normalizar_telefones(self.NUMEROS)['numero'].tolist(), esperado)
+
+    def test_motivos_de_rejeicao(self):
+        motivos = normalizar_telefones(['', '8888-7777', '+44 20 7946 0958', '11988887777'])['motivo'].tolist()
+        self.assertEqual(motivos, [MOTIVO_VAZIO, MOTIVO_POUCOS_DIGITOS, MOTIVO_NAO_BRASILEIRO, ''])
+
+    def test_celula_numerica_perde_o_ponto_zero(self):
+        # Só a versão vetorizada trata células float de planilha (ver docstring de normalizar_telefones)
+        self.assertEqual(normalizar_telefones([11988887777.0, None])['numero'].tolist(), ['+5511988887777', None])
+
+    def test_lote_vazio(self):
+        self.assertTrue(normalizar_telefones([]).empty)
+
+
+class WebhookEvolutionTests(TestCase):
+
+    def setUp(self):
+        conexao = get_redis_connection("default")
+        conexao.delete(webhook_evolution.FILA_EVENTOS, webhook_evolution.ENTREGAS_PENDENTES)
+        self.addCleanup(conexao.delete, webhook_evolution.FILA_EVENTOS, webhook_evolution.ENTREGAS_PENDENTES)
+
+    def test_nome_evento_v1_e_v2(self):
+        self.assertEqual(webhook_evolution._nome_evento('messages.update'), 'MESSAGES_UPDATE')
+        self.assertEqual(webhook_evolution._nome_evento('MESSAGES_UPDATE'), 'MESSAGES_UPDATE')
+        self.assertEqual(webhook_evolution._nome_evento(None), '')
+
+    def test_atualizacoes_mensagem_v1_e_v2(self):
+        v2 = {'keyId': 'AAA', 'status': 'READ'}
+        v1 = [{'key': {'id': 'BBB'}, 'update': {'status': 3}}, {'key': {'id': 'CCC'}, 'update': {'status': 'SERVER_ACK'}}, 'lixo']
+        self.assertEqual(list(webhook_evolution._atualizacoes_mensagem(v2)), [('AAA', 'lido')])
+        self.assertEqual(list(webhook_evolution._atualizacoes_mensagem(v1)), [('BBB', 'entregue')])
+
+    def test_avancar_estado_so_avanca(self):
+        self.assertEqual(webhook_evolution.avancar_estado('enviado', 'entregue'), 'entregue')
+        self.assertEqual(webhook_evolution.avancar_estado('lido', 'entregue'), 'lido')
+        self.assertEqual(webhook_evolution.avancar_estado('falha', 'lido'), 'falha')
+        self.assertEqual(webhook_evolution.avancar_estado(None, 'entregue'), 'entregue')
+
+    def test_processar_eventos_pendentes(self):
+        EnvioContato.objects.create(id_campanha=uuid.uuid4(), contato='+5511988887777', parte='txt', estado='enviado', message_key='AAA')
+        for evento in (
+            {'event': 'messages.update', 'data': {'keyId': 'AAA', 'status': 'DELIVERY_ACK'}},
+            {'event': 'messages.update', 'data': {'keyId': 'AAA', 'status': 'READ'}},
+            {'event': 'messages.update', 'data': {'keyId': 'ZZZ', 'status': 'DELIVERY_ACK'}},
+        ):
+            webhook_evolution.enfileirar_evento(json.dumps(evento))
+        webhook_evolution.enfileirar_evento('{corpo inválido')
+
+        self.assertEqual(webhook_evolution.processar_eventos_pendentes(), 4)
+        self.assertEqual(EnvioContato.objects.get(message_key='AAA').estado, 'lido')
+        # O envio de ZZZ ainda não foi gravado: o status fica pendente para quando ele chegar
+        self.assertEqual(webhook_evolution.estados_pendentes(['ZZZ']), {'ZZZ': 'entregue'})
+        self.assertEqual(get_redis_connection("default").llen(webhook_evolution.FILA_EVENTOS), 0)
+
+
+@override_settings(EVOLUTION_ENVIO_ASSINCRONO=False)
+class VerificarDisparosTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create(username='disparos')
+        UserMessageLimit.objects.create(user=self.usuario, limite_diario=10)
+        self.agora = timezone.make_aware(datetime.combine(date(2030, 1, 2), datetime.min.time()) + timedelta(hours=10, seconds=30))
+        patcher = mock.patch('django.utils.timezone.now', return_value=self.agora)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        conexao = get_redis_connection("default")
+        chave_cota = cota_diaria._chave(self.usuario.id, self.agora.date())
+        conexao.delete(chave_cota)
+        self.addCleanup(conexao.delete, chave_cota)
+
+        self.lista = ListaContatos.obter([f"+55119{indice:08d}" for indice in range(25)])
+
+    def _agendar(self):
+        return Mensagem.objects.create(
+            usuario=self.usuario, dias_disparo=['2030-01-02'], horario_disparo=self.agora.time(),
+            intervalo_disparo=1, lista_contatos=self.lista, mensagem_notificacao='Oi',
+        )
+
+    def _contatos_publicados(self, publicar):
+        with mock.patch.object(tasks.enviar_notificacao_whatsapp_texto, 'apply_async', side_effect=publicar) as texto, \
+                mock.patch.object(tasks.enviar_lote_texto_async, 'apply_async') as lote, \
+                mock.patch.object(tasks.registrar_enviadas, 'apply_async'):
+            tasks.verificar_disparos.apply()
+        return [chamada.kwargs['args'][0] for chamada in texto.call_args_list], lote
+
+    def test_trunca_no_limite_diario(self):
+        self._agendar()
+        contatos, _ = self._contatos_publicados(None)
+        self.assertEqual(contatos, self.lista.contatos[:10])
+        self.assertEqual(cota_diaria.consumidas(self.usuario.id, self.agora.date()), 10)
+
+    @override_settings(EVOLUTION_ENVIO_ASSINCRONO=True)
+    def test_trunca_no_limite_diario_em_lotes(self):
+        self._agendar()
+        _, lote = self._contatos_publicados(None)
+        contatos = [contato for chamada in lote.call_args_list for _, contato in chamada.kwargs['args'][1]]
+        self.assertEqual(contatos, self.lista.contatos[:10])
+
+    def test_falha_do_broker_devolve_so_o_que_nao_foi_publicado(self):
+        self._agendar()
+        self._agendar()
+        publicados = []
+
+        def publicar(*args, **kwargs):
+            if len(publicados) == 3:
+                raise ConnectionError("broker fora")
+            publicados.append(kwargs['args'][0])
+
+        self._contatos_publicados(publicar)
+        # Primeiro agendamento: 3 publicados, 7 devolvidos; o segundo ainda é tentado (e também falha)
+        self.assertEqual(len(publicados), 3)
+        self.assertEqual(cota_diaria.consumidas(self.usuario.id, self.agora.date()), 3)
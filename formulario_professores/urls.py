@@ -12,6 +12,7 @@ urlpatterns = [
     # --- NOVAS URLs para Configuração da Evolution API ---
     path('evolution/config/', views.evolution_config_view, name='evolution_config'),
     path('evolution/status/', views.evolution_status_view, name='evolution_status'),
+    path('evolution/status/stream/', views.stream_status_instancia_view, name='evolution_status_stream'),
     path('evolution/instance/create/', views.evolution_create_instance, name='evolution_create_instance'),
     path('evolution/instance/disconnect/', views.evolution_disconnect_instance, name='evolution_disconnect_instance'),
 
@@ -20,6 +21,8 @@ urlpatterns = [
     path('mensagens/', views.listar_aulas, name='listar_aulas'),
     path('editar/<int:mensagem_id>/', views.editar_aula, name='editar_aula'),
     path('excluir/<int:aula_id>/', views.excluir_aula, name='excluir_aula'),
+    path('api/campanhas/<uuid:id_campanha>/resumo/', views.resumo_campanha_view, name='resumo_campanha'),
+    path('api/mensagens/<int:mensagem_id>/importacao/', views.status_importacao_view, name='status_importacao'),
 
     # URLs de Autenticação
     path('login/', CustomLoginView.as_view(), name='login'),
@@ -40,6 +43,10 @@ urlpatterns = [
     path('api/iniciar-exportacao/', views.iniciar_exportacao_view, name='iniciar_exportacao'),
     
     path('api/status-exportacao/<str:task_id>/', views.status_exportacao_view, name='status_exportacao'),
+    path('api/status-exportacao/<str:task_id>/stream/', views.stream_exportacao_view, name='stream_exportacao'),
     path('download-exportacao/<str:task_id>/', views.download_arquivo_exportado, name='download_arquivo_exportado'),
     path('api/listar-grupos/', views.listar_grupos_view, name='api_listar_grupos'),
+
+    # Webhook da Evolution API (o token secreto faz parte do caminho)
+    path('webhooks/evolution/<str:token>/', views.webhook_evolution_view, name='webhook_evolution'),
 ]
\ No newline at end of file
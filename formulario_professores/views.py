@@ -7,19 +7,28 @@ from django.contrib import messages
 from django.core.cache import cache
 from django.utils import timezone
 from .forms import MensagemForm, MidiaForm, EvolutionAPISettingsForm
-from .models import Mensagem, EvolutionAPISettings, Instancia, Enviadas, UserMessageLimit, Midia
+from .models import Mensagem, EvolutionAPISettings, Instancia, EnviadasDiario, EnvioContato, UserMessageLimit, Midia
 from .repositories.evolutionRepository import EvolutionRepository
+from .services import cota_diaria, circuit_breaker, status_instancias, webhook_evolution, progresso
 import uuid
-from datetime import datetime as dt
-from django.http import JsonResponse, HttpResponse
+from datetime import datetime as dt, timedelta
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from celery.result import AsyncResult
-from .tasks import exportar_contatos_task # <-- NOVO IMPORT
+from asgiref.sync import sync_to_async
+from storages.backends.s3boto3 import S3Boto3Storage
+from .tasks import iniciar_exportacao, dono_exportacao, agendar_transcodificacao_audio, agendar_importacao_contatos, atualizar_status_instancias
 import json
 
 
 # --- Constantes ---
 TAMANHO_LOTE_CONTATOS = 65
-CACHE_STATUS_TTL = 30  # 30 segundos de cache para o status da conexão
+EXPORTACAO_URL_VALIDADE = 5 * 60  # Segundos de validade do link assinado do download
+SSE_TEMPO_MAXIMO = 10 * 60  # O navegador reconecta sozinho (EventSource) e recebe o último estado
+WEBHOOK_TAMANHO_MAXIMO = 256 * 1024  # Eventos de conexão/status têm poucos KB; mensagens com mídia não são assinadas
 
 # --- Funções Auxiliares (Estão corretas!) ---
 def get_user_api_config(user):
@@ -33,46 +42,16 @@ def get_user_api_config(user):
         return None, None
 
 def check_connection_status(request, api_settings, instancia):
-    """Verifica e atualiza o status da conexão, buscando o QR Code se necessário."""
-    cache_key = f'evolution_status_{instancia.id}'
-    
-    # Não vamos usar o cache aqui por enquanto para facilitar o debug
-    # cached_status = cache.get(cache_key)
-    # if cached_status:
-    #     return cached_status
-
-    # 1. Primeiro, apenas checa o estado da conexão
-    status_data = EvolutionRepository.get_status(
-        api_settings.api_host, api_settings.api_key, instancia.nome_instancia
-    )
-    
-    is_connected = status_data.get('instance', {}).get('state') == 'open'
-    qr_code_base64 = None
-
-    # 2. Se não estiver conectado, pede ativamente o QR Code
-    if not is_connected:
-        qr_data = EvolutionRepository.get_qrcode(
-            api_settings.api_host, api_settings.api_key, instancia.nome_instancia
-        )
-        # A API retorna o QR Code dentro da chave 'base64'
-        qr_code_base64 = qr_data.get('base64')
-
-    status_info = {
-        'connected': is_connected,
-        'qrcode': qr_code_base64,
-        'raw_data': status_data,
-        'timestamp': timezone.now()
-    }
-    
-    # Armazena em cache apenas se estiver conectado (para não guardar o QR Code)
-    if is_connected:
-        cache.set(cache_key, status_info, CACHE_STATUS_TTL)
-    
-    # Atualiza o banco de dados
-    if instancia.conectado != is_connected:
-        instancia.conectado = is_connected
-        instancia.save(update_fields=['conectado'])
-        
+    """
+    Status da conexão gravado pelo poller (tasks.atualizar_status_instancias); não chama a API.
+    Sem dado no cache (instância nova ou recém-alterada), pede uma consulta imediata só desta instância.
+    """
+    status_instancias.registrar_interesse_qrcode(instancia.id)
+    status_info = status_instancias.status_em_cache(instancia.id)
+    if status_info is None or (not status_info['connected'] and not status_info['qrcode'] and not status_info.get('erro')):
+        atualizar_status_instancias.delay([instancia.id])
+    if status_info is None:
+        status_info = {'connected': instancia.conectado, 'qrcode': None, 'raw_data': {}, 'timestamp': instancia.ultimo_status_check, 'atualizando': True}
     return status_info
 
 # --- Views de Autenticação ---
@@ -113,6 +92,7 @@ def evolution_status_view(request):
     context = {
         'instancia': instancia,
         'status_info': status_info,
+        'circuito': circuit_breaker.estado(api_settings.api_host),
     }
     return render(request, 'evolution/status.html', context)
 
@@ -134,11 +114,11 @@ def evolution_create_instance(request):
         )
 
         if result.get('instance'):
-            # --- CORREÇÃO AQUI ---
-            # Limpa o cache de status para forçar a busca do novo status com o QR Code
-            cache_key = f'evolution_status_{instancia.id}'
-            cache.delete(cache_key)
-            # --- FIM DA CORREÇÃO ---
+            webhook_evolution.registrar_webhook(api_settings, instancia)
+            # Descarta o status antigo e pede uma consulta já com o QR Code da instância nova
+            cache.delete(status_instancias.chave_status(instancia.id))
+            status_instancias.registrar_interesse_qrcode(instancia.id)
+            atualizar_status_instancias.delay([instancia.id])
 
             messages.success(request, f"Instância '{instance_name}' criada/iniciada. Escaneie o QR Code se necessário.")
         else:
@@ -156,7 +136,8 @@ def evolution_disconnect_instance(request):
             if result.get('status') != 'error':
                 instancia.conectado = False
                 instancia.save()
-                cache.delete(f'evolution_status_{instancia.id}')
+                cache.delete(status_instancias.chave_status(instancia.id))
+                atualizar_status_instancias.delay([instancia.id])
                 messages.success(request, "Instância desconectada com sucesso.")
             else:
                 messages.error(request, f"Erro ao desconectar: {result.get('message')}")
@@ -165,6 +146,19 @@ def evolution_disconnect_instance(request):
 
 # --- Views Principais da Aplicação (Adaptadas) ---
 
+def _marcar_importacao(mensagem, form):
+    """Se a planilha ficou para importação em segundo plano, marca a mensagem como pendente e devolve o arquivo."""
+    arquivo = form.cleaned_data.get('arquivo_importacao')
+    if arquivo:
+        mensagem.importacao_status = 'pendente'
+        mensagem.importacao_linhas = 0
+        mensagem.importacao_detalhe = ''
+        mensagem.importacao_atualizada_em = timezone.now()
+    elif mensagem.importacao_status == 'erro':
+        mensagem.importacao_status = ''  # Contatos corrigidos manualmente: volta a disparar
+    return arquivo
+
+
 @login_required
 def listar_aulas(request):
     api_settings, instancia = get_user_api_config(request.user)
@@ -174,10 +168,17 @@ def listar_aulas(request):
 
     status_conexao = instancia.get_cached_status()
     
-    mensagens_qs = Mensagem.objects.filter(usuario=request.user).order_by('-id_campanha', '-id')
+    # Só a contagem: os números ficam na ListaContatos e não são carregados na listagem
+    mensagens_qs = Mensagem.objects.filter(usuario=request.user).annotate(
+        contato_count=Coalesce(F('lista_contatos__total'), 0)
+    ).order_by('-id_campanha', '-id')
     
-    hoje = timezone.now().date()
-    mensagens_enviadas_hoje = Enviadas.objects.filter(user=request.user, data_envio__date=hoje).count()
+    mensagens_enviadas_hoje = cota_diaria.consumidas(request.user.id)
+    # Histórico vem do resumo diário; o dia corrente, do contador de cota
+    hoje = timezone.localdate()
+    mensagens_enviadas_30_dias = mensagens_enviadas_hoje + (EnviadasDiario.objects.filter(
+        user=request.user, data__gte=hoje - timedelta(days=29), data__lt=hoje
+    ).aggregate(total=Sum('total'))['total'] or 0)
     limite = UserMessageLimit.objects.filter(user=request.user).first()
     limite_diario = limite.limite_diario if limite else 65
 
@@ -185,6 +186,7 @@ def listar_aulas(request):
         'mensagens': mensagens_qs,
         'status_conexao': status_conexao,
         'mensagens_enviadas_hoje': mensagens_enviadas_hoje,
+        'mensagens_enviadas_30_dias': mensagens_enviadas_30_dias,
         'limite_diario': limite_diario
     })
 
@@ -208,8 +210,14 @@ def cadastrar_aula(request):
             if id_midia:
                 nova_mensagem.midia = get_object_or_404(Midia, id=id_midia, usuario=request.user)
             
+            arquivo_importacao = _marcar_importacao(nova_mensagem, form)
+            form.gravar_lista_contatos()
             nova_mensagem.save()
-            messages.success(request, "Agendamento criado com sucesso!")
+            if arquivo_importacao:
+                agendar_importacao_contatos(nova_mensagem, arquivo_importacao, form.cleaned_data['contato'])
+                messages.success(request, "Agendamento criado! Os contatos da planilha estão sendo importados em segundo plano.")
+            else:
+                messages.success(request, "Agendamento criado com sucesso!")
             return redirect('listar_aulas')
     else:
         form = MensagemForm()
@@ -243,8 +251,14 @@ def editar_aula(request, mensagem_id):
             else:
                 mensagem_editada.midia = None # Remove a associação se nenhuma mídia for selecionada
             
+            arquivo_importacao = _marcar_importacao(mensagem_editada, form)
+            form.gravar_lista_contatos()
             mensagem_editada.save()
-            messages.success(request, "Mensagem atualizada com sucesso!")
+            if arquivo_importacao:
+                agendar_importacao_contatos(mensagem_editada, arquivo_importacao, form.cleaned_data['contato'])
+                messages.success(request, "Mensagem atualizada! Os contatos da planilha estão sendo importados em segundo plano.")
+            else:
+                messages.success(request, "Mensagem atualizada com sucesso!")
             return redirect('listar_aulas')
         else:
             messages.error(request, "Por favor, corrija os erros no formulário.")
@@ -272,6 +286,28 @@ def excluir_aula(request, aula_id):
 
 
 
+@login_required
+def status_importacao_view(request, mensagem_id):
+    """Progresso da importação de contatos em segundo plano de uma mensagem (JSON)."""
+    mensagem = get_object_or_404(
+        Mensagem.objects.only('importacao_status', 'importacao_linhas', 'importacao_detalhe'),
+        id=mensagem_id, usuario=request.user
+    )
+    return JsonResponse({
+        'status': mensagem.importacao_status,
+        'linhas_processadas': mensagem.importacao_linhas,
+        'detalhe': mensagem.importacao_detalhe,
+    })
+
+
+@login_required
+def resumo_campanha_view(request, id_campanha):
+    """Vazão, latência e taxa de falha dos envios de uma campanha do usuário (JSON)."""
+    if not Mensagem.objects.filter(usuario=request.user, id_campanha=id_campanha).exists():
+        return JsonResponse({'error': 'Campanha não encontrada.'}, status=404)
+    return JsonResponse(EnvioContato.objects.resumo_campanha(id_campanha))
+
+
 @login_required
 def listar_midias(request):
     _, instancia = get_user_api_config(request.user)
@@ -287,6 +323,7 @@ def upload_midia(request):
             midia_obj = form.save(commit=False)
             midia_obj.usuario = request.user
             midia_obj.save()
+            agendar_transcodificacao_audio(midia_obj)
             messages.success(request, "Mídia enviada com sucesso!")
             return redirect('listar_midias')
     else:
@@ -304,6 +341,8 @@ def editar_midia(request, midia_id):
         form = MidiaForm(request.POST, request.FILES, instance=midia_obj)
         if form.is_valid():
             form.save()
+            if 'arquivo' in form.changed_data or 'tipo' in form.changed_data:
+                agendar_transcodificacao_audio(midia_obj)
             messages.success(request, f"Mídia '{midia_obj.nome}' atualizada com sucesso!")
             return redirect('listar_midias')
         else:
@@ -360,8 +399,8 @@ def iniciar_exportacao_view(request):
                 return JsonResponse({'error': 'Nenhum grupo foi selecionado.'}, status=400)
             
             # Passa a lista de IDs para a tarefa Celery
-            task = exportar_contatos_task.delay(request.user.id, group_ids)
-            return JsonResponse({'task_id': task.id})
+            task_id = iniciar_exportacao(request.user.id, group_ids)
+            return JsonResponse({'task_id': task_id})
 
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Requisição JSON inválida.'}, status=400)
@@ -375,6 +414,8 @@ def status_exportacao_view(request, task_id):
     Retorna o status de uma tarefa Celery em formato JSON,
     de uma maneira que o nosso JavaScript entende perfeitamente.
     """
+    if dono_exportacao(task_id) != request.user.id:
+        return JsonResponse({'error': 'Exportação não encontrada.'}, status=404)
     result = AsyncResult(task_id)
     
     response_data = {
@@ -407,33 +448,55 @@ def status_exportacao_view(request, task_id):
 
     return JsonResponse(response_data)
 
+def _resposta_sse(canal):
+    """Stream text/event-stream com cada publicação do canal de progresso (servido pelo ASGI)."""
+    async def eventos():
+        yield "retry: 3000\n\n"
+        async for dados in progresso.acompanhar(canal, SSE_TEMPO_MAXIMO):
+            # Comentário SSE a cada intervalo sem novidades: mantém proxies e balanceadores com a conexão aberta
+            yield ": keepalive\n\n" if dados is None else f"data: {json.dumps(dados, default=str)}\n\n"
+
+    resposta = StreamingHttpResponse(eventos(), content_type='text/event-stream')
+    resposta['Cache-Control'] = 'no-cache'
+    resposta['X-Accel-Buffering'] = 'no'
+    return resposta
+
+
+@login_required
+async def stream_exportacao_view(request, task_id):
+    """Progresso de exportar_contatos_task por SSE, no mesmo formato de status_exportacao_view."""
+    usuario = await request.auser()
+    if await sync_to_async(dono_exportacao)(task_id) != usuario.id:
+        return JsonResponse({'error': 'Exportação não encontrada.'}, status=404)
+    return _resposta_sse(progresso.canal_exportacao(task_id))
+
+
+@login_required
+async def stream_status_instancia_view(request):
+    """Mudanças de conexão da instância do usuário ({'instancia_id', 'usuario_id', 'connected'}) por SSE, para a página de status."""
+    usuario = await request.auser()
+    instancia = await Instancia.objects.filter(usuario=usuario).only('id').afirst()
+    if not instancia:
+        return JsonResponse({'error': 'Instância não encontrada.'}, status=404)
+    return _resposta_sse(progresso.canal_status_instancia(instancia.id))
+
+
 @login_required
 def download_arquivo_exportado(request, task_id):
     """
-    Busca o arquivo gerado pela tarefa Celery no cache e o serve para download.
+    Redireciona para uma URL assinada (curta) da planilha gerada pela tarefa Celery no S3.
     """
-    cache_key = f"export_task_{task_id}"
-    cached_data = cache.get(cache_key)
-    
-    if not cached_data:
+    dados = cache.get(f"export_task_{task_id}")
+    if not dados or dados.get('usuario_id') != request.user.id:
         messages.error(request, "O arquivo para download não foi encontrado ou expirou. Por favor, tente gerar novamente.")
         return redirect('exportar_contatos')
 
-    # Pega o conteúdo e o nome do arquivo do cache
-    file_content = cached_data['file_content']
-    filename = cached_data['filename']
-    
-    # Cria uma resposta HTTP com o arquivo
-    response = HttpResponse(
-        file_content,
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    url = S3Boto3Storage().url(
+        dados['caminho'],
+        parameters={'ResponseContentDisposition': f'attachment; filename="{dados["filename"]}"'},
+        expire=EXPORTACAO_URL_VALIDADE,
     )
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # (Opcional) Deleta a chave do cache após o primeiro download
-    cache.delete(cache_key)
-    
-    return response
+    return redirect(url)
 
 @login_required
 def listar_grupos_view(request):
@@ -462,4 +525,16 @@ def listar_grupos_view(request):
         for g in grupos_data
     ]
 
-    return JsonResponse({'groups': grupos_simplificados})
\ No newline at end of file
+    return JsonResponse({'groups': grupos_simplificados})
+
+# --- Webhook da Evolution API ---
+@csrf_exempt
+@require_POST
+def webhook_evolution_view(request, token):
+    """Recebe eventos da Evolution API. Só enfileira o corpo; o processamento é feito em lote pelo Celery."""
+    if not webhook_evolution.token_valido(token):
+        raise Http404
+    if len(request.body) > WEBHOOK_TAMANHO_MAXIMO:
+        return JsonResponse({'error': 'Evento grande demais.'}, status=413)
+    webhook_evolution.enfileirar_evento(request.body)
+    return JsonResponse({'status': 'ok'})
@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+É o app servido em produção (start.sh: gunicorn com workers uvicorn), necessário para os
+streams de progresso por SSE (views.stream_exportacao_view / stream_status_instancia_view).
 """
 
 import os
@@ -14,6 +14,50 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Descobre tarefas automaticamente nos aplicativos do Django
 app.autodiscover_tasks()
 
+# Dois tipos de carga, cada um com o seu pool (ver start-worker.sh e start-worker-midia.sh):
+# - envios_N: texto/botão, quase só espera de rede -> pool de threads com alta concorrência;
+# - midia_N e midia: download, FFmpeg e Base64, presos à CPU -> prefork com um processo por núcleo.
+# Tarefa de envio -> (prefixo da fila, posição do usuario_id nos args)
+_ROTAS_POR_USUARIO = {
+    'formulario_professores.tasks.enviar_notificacao_whatsapp_texto': ('envios', 2),
+    'formulario_professores.tasks.enviar_notificacao_whatsapp_botao': ('envios', 4),
+    'formulario_professores.tasks.enviar_lote_texto_async': ('envios', 2),
+    'formulario_professores.tasks.enviar_notificacao_whatsapp_midia': ('midia', 3),
+}
+_ROTAS_FIXAS = {
+    'formulario_professores.tasks.transcodificar_audio_midia': 'midia',
+    # Leitura de planilhas grandes também é carga de CPU
+    'formulario_professores.tasks.importar_contatos_arquivo': 'midia',
+}
+
+
+def fila_envio(usuario_id, prefixo='envios'):
+    """Fila de envio do usuário: <prefixo>_0 ... <prefixo>_<ENVIO_FILAS - 1>."""
+    return f"{prefixo}_{int(usuario_id) % settings.ENVIO_FILAS}"
+
+
+def rotear_envios(name, args, kwargs, options, task=None, **kw):
+    """
+    Manda cada tarefa de envio para a fila do seu usuário, no pool do seu tipo de carga.
+    Como os workers consomem as filas em rodízio, os envios de um usuário não passam
+    na frente dos de outro. As demais tarefas seguem para a fila padrão ('celery').
+    """
+    if name in _ROTAS_FIXAS:
+        return {'queue': _ROTAS_FIXAS[name]}
+    rota = _ROTAS_POR_USUARIO.get(name)
+    if rota is None:
+        return None
+    prefixo, posicao = rota
+    usuario_id = (kwargs or {}).get('usuario_id')
+    if usuario_id is None and args and len(args) > posicao:
+        usuario_id = args[posicao]
+    if usuario_id is None:
+        return None
+    return {'queue': fila_envio(usuario_id, prefixo)}
+
+
+app.conf.task_routes = (rotear_envios,)
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -126,13 +126,74 @@ CACHES = {
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_IMPORTS = ('formulario_professores.tasks',)
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1  # Cada processo reserva só a próxima tarefa: as filas são servidas em rodízio
+# Tarefas de envio vão para envios_<usuario_id % ENVIO_FILAS> (mídia: midia_<...>; roteador em setup/celery.py),
+# de modo que uma campanha grande ocupa uma fila só e não atrasa os agendamentos pequenos dos outros usuários.
+ENVIO_FILAS = int(os.getenv('ENVIO_FILAS', '4'))
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 CELERY_BEAT_SCHEDULE = {
     'disparar_mensagens': {
         'task': 'formulario_professores.tasks.verificar_disparos',
         'schedule': crontab(minute='*'),
     },
+    'gravar_resultados_envio': {
+        'task': 'formulario_professores.tasks.gravar_resultados_envio',
+        'schedule': 10.0,
+    },
+    'consolidar_enviadas': {
+        'task': 'formulario_professores.tasks.consolidar_enviadas',
+        'schedule': crontab(hour=0, minute=15),
+    },
+    'atualizar_status_instancias': {
+        'task': 'formulario_professores.tasks.atualizar_status_instancias',
+        'schedule': float(os.getenv('STATUS_INSTANCIAS_INTERVALO', '30')),
+    },
+    'processar_webhooks_evolution': {
+        'task': 'formulario_professores.tasks.processar_webhooks_evolution',
+        'schedule': 5.0,
+    },
+    'verificar_importacoes_interrompidas': {
+        'task': 'formulario_professores.tasks.verificar_importacoes_interrompidas',
+        'schedule': crontab(minute='*/10'),
+    },
+    'limpar_listas_contatos': {
+        'task': 'formulario_professores.tasks.limpar_listas_contatos',
+        'schedule': crontab(hour=0, minute=45),
+    },
 }
+# Poller do estado de conexão (atualizar_status_instancias): as views só leem o cache que ele grava
+STATUS_INSTANCIAS_INTERVALO = float(os.getenv('STATUS_INSTANCIAS_INTERVALO', '30'))
+# Webhooks da Evolution API: URL pública deste app e token secreto que vai no caminho do webhook.
+# Com os dois definidos, conexão e entregas chegam por evento e o poller só revalida cada instância
+# a cada STATUS_INSTANCIAS_REVALIDAR segundos.
+EVOLUTION_WEBHOOK_URL = os.getenv('EVOLUTION_WEBHOOK_URL', '')
+EVOLUTION_WEBHOOK_TOKEN = os.getenv('EVOLUTION_WEBHOOK_TOKEN', '')
+if EVOLUTION_WEBHOOK_URL and EVOLUTION_WEBHOOK_TOKEN:
+    STATUS_INSTANCIAS_REVALIDAR = float(os.getenv('STATUS_INSTANCIAS_REVALIDAR', '600'))
+else:
+    STATUS_INSTANCIAS_REVALIDAR = STATUS_INSTANCIAS_INTERVALO
+STATUS_INSTANCIAS_TTL = int(STATUS_INSTANCIAS_REVALIDAR * 3)  # Sobrevive a uma ou duas rodadas perdidas
+STATUS_INSTANCIAS_CONCORRENCIA = int(os.getenv('STATUS_INSTANCIAS_CONCORRENCIA', '20'))
+STATUS_INSTANCIAS_TIMEOUT = int(os.getenv('STATUS_INSTANCIAS_TIMEOUT', '10'))
+ENVIADAS_RETENCAO_DIAS = int(os.getenv('ENVIADAS_RETENCAO_DIAS', '30'))  # Linhas brutas mantidas antes do resumo diário
+
+# --- EVOLUTION API (HTTP) ---
+EVOLUTION_HTTP_POOL_SIZE = int(os.getenv('EVOLUTION_HTTP_POOL_SIZE', '20'))  # Conexões keep-alive por host
+EVOLUTION_HTTP_RETRIES = int(os.getenv('EVOLUTION_HTTP_RETRIES', '2'))
+EVOLUTION_HTTP_BACKOFF = float(os.getenv('EVOLUTION_HTTP_BACKOFF', '0.5'))
+# Circuit breaker por host: abre após N falhas de rede/5xx seguidas e recusa chamadas por T segundos
+CIRCUITO_LIMIAR_FALHAS = int(os.getenv('CIRCUITO_LIMIAR_FALHAS', '5'))
+CIRCUITO_TEMPO_ABERTO = int(os.getenv('CIRCUITO_TEMPO_ABERTO', '30'))
+
+# Envio assíncrono (httpx) de agendamentos somente texto: vários envios em voo por worker
+EVOLUTION_ENVIO_ASSINCRONO = os.getenv('EVOLUTION_ENVIO_ASSINCRONO', 'False') == 'True'
+EVOLUTION_ASYNC_MAX_CONCORRENCIA = int(os.getenv('EVOLUTION_ASYNC_MAX_CONCORRENCIA', '100'))  # Por instância, somando todos os lotes
+EVOLUTION_ASYNC_LOTE = int(os.getenv('EVOLUTION_ASYNC_LOTE', '200'))  # Contatos por tarefa
+EVOLUTION_ASYNC_LOTE_DURACAO = int(os.getenv('EVOLUTION_ASYNC_LOTE_DURACAO', '120'))  # Segundos de agenda por tarefa
+
+# Validade da chave de idempotência de cada envio (envio_idem:<envio_log_id sem o índice>:<contato>), em segundos.
+# Deve ser menor que o intervalo entre ocorrências do mesmo agendamento (1 dia).
+IDEMPOTENCIA_TTL = int(os.getenv('IDEMPOTENCIA_TTL', str(12 * 3600)))
 
 # --- ARQUIVOS ESTÁTICOS E DE MÍDIA ---
 STATIC_URL = "/static/"
@@ -146,6 +207,15 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_DEFAULT_ACL = None # Mais seguro, controle o acesso pelo bucket policy.
 
+# Cache local (por worker) das mídias já baixadas, convertidas e codificadas em Base64
+MIDIA_CACHE_DIR = os.getenv('MIDIA_CACHE_DIR')  # Padrão: <tmp>/disparador_midia_cache
+MIDIA_CACHE_MAX_BYTES = int(os.getenv('MIDIA_CACHE_MAX_BYTES', str(2 * 1024 ** 3)))
+# 'stream': Base64 transmitido do cache em disco | 'url': envia a URL assinada do S3 para a Evolution API
+EVOLUTION_MIDIA_MODO_ENVIO = os.getenv('EVOLUTION_MIDIA_MODO_ENVIO', 'stream')
+
+# Planilhas de contatos maiores que isso são importadas em segundo plano (Celery), fora da requisição web
+IMPORTACAO_CONTATOS_LIMITE_BYTES = int(os.getenv('IMPORTACAO_CONTATOS_LIMITE_BYTES', str(1024 * 1024)))
+
 # --- OUTRAS CONFIGURAÇÕES ---
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
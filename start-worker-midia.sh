@@ -0,0 +1,22 @@
+#!/bin/bash
+
+echo "🎞️ Preparando Celery Worker de mídia..."
+
+# Aguarda um pouco para garantir que o django-web já iniciou
+echo "🔄 Aguardando django-web executar migrações..."
+sleep 20
+
+# Worker de mídia: download do S3, FFmpeg e Base64 são presos à CPU, então roda em prefork
+# com um processo por núcleo (CELERY_CONCORRENCIA_MIDIA sobrescreve).
+# Filas: 'midia' (transcodificação) + midia_0 ... midia_<ENVIO_FILAS - 1> (envios por usuário, em rodízio).
+ENVIO_FILAS=${ENVIO_FILAS:-4}
+if [ -z "$CELERY_WORKER_FILAS_MIDIA" ]; then
+    CELERY_WORKER_FILAS_MIDIA="midia"
+    for i in $(seq 0 $((ENVIO_FILAS - 1))); do
+        CELERY_WORKER_FILAS_MIDIA="$CELERY_WORKER_FILAS_MIDIA,midia_$i"
+    done
+fi
+
+echo "✅ Iniciando Celery Worker de mídia (filas: $CELERY_WORKER_FILAS_MIDIA)..."
+exec celery -A setup worker --loglevel=info --pool=prefork --concurrency=${CELERY_CONCORRENCIA_MIDIA:-$(nproc)} \
+    -Q "$CELERY_WORKER_FILAS_MIDIA" --prefetch-multiplier=1 -n midia@%h
@@ -6,5 +6,30 @@ echo "👷 Preparando Celery Worker..."
 echo "🔄 Aguardando django-web executar migrações..."
 sleep 20
 
-echo "✅ Iniciando Celery Worker..."
-exec celery -A setup worker --loglevel=info --concurrency=2
+# Worker de texto/botão: os envios passam quase todo o tempo esperando a Evolution API,
+# então roda num pool de threads com concorrência alta. Mídia tem o seu próprio worker
+# (start-worker-midia.sh).
+# Filas consumidas por este worker. Padrão: a fila geral ('celery') + todas as filas de envio
+# (envios_0 ... envios_<ENVIO_FILAS - 1>), atendidas em rodízio.
+# Para dar mais peso a um grupo de usuários, suba workers extras só com as filas dele, ex.:
+#   CELERY_WORKER_FILAS=envios_0,envios_1 ./start-worker.sh
+# Sem CELERY_WORKER_FILAS_MIDIA (deploys só com web + este worker, ex. Procfile/Railway/Fly), este worker também
+# consome as filas de mídia (midia, midia_0 ...), senão envios de mídia e importações ficariam parados na fila.
+# Com um worker de mídia separado (docker-compose), defina CELERY_WORKER_FILAS_MIDIA para deixá-las só com ele.
+ENVIO_FILAS=${ENVIO_FILAS:-4}
+if [ -z "$CELERY_WORKER_FILAS" ]; then
+    CELERY_WORKER_FILAS="celery"
+    for i in $(seq 0 $((ENVIO_FILAS - 1))); do
+        CELERY_WORKER_FILAS="$CELERY_WORKER_FILAS,envios_$i"
+    done
+    if [ -z "$CELERY_WORKER_FILAS_MIDIA" ]; then
+        CELERY_WORKER_FILAS="$CELERY_WORKER_FILAS,midia"
+        for i in $(seq 0 $((ENVIO_FILAS - 1))); do
+            CELERY_WORKER_FILAS="$CELERY_WORKER_FILAS,midia_$i"
+        done
+    fi
+fi
+
+echo "✅ Iniciando Celery Worker de envios (filas: $CELERY_WORKER_FILAS)..."
+exec celery -A setup worker --loglevel=info --pool=threads --concurrency=${CELERY_CONCORRENCIA:-50} \
+    -Q "$CELERY_WORKER_FILAS" --prefetch-multiplier=1 -n envios@%h
@@ -15,6 +15,7 @@ python manage.py create_superuser
 echo "📁 Verificando arquivos estáticos..."
 python manage.py collectstatic --no-input --clear
 
-# Inicia o Gunicorn
-echo "🌐 Iniciando servidor Gunicorn na porta $PORT..."
-exec gunicorn setup.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 3 --timeout 120 --access-logfile - --error-logfile -
+# Inicia o Gunicorn servindo o app ASGI (workers uvicorn): os streams de progresso (SSE)
+# ficam abertos no event loop sem ocupar um worker cada
+echo "🌐 Iniciando servidor Gunicorn (ASGI) na porta $PORT..."
+exec gunicorn setup.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:${PORT:-8000} --workers 3 --timeout 120 --access-logfile - --error-logfile -